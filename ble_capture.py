@@ -0,0 +1,142 @@
+# Raw advertisement capture and replay.
+# A capture is the 5 byte header b'BLEC' + version, followed by records of
+#   uint32 ms since capture start, uint8 address type, 6 bytes address,
+#   int8 RSSI, uint8 advertisement length, advertisement bytes
+# all little endian. Recorder batches records in a preallocated buffer so flash or a
+# socket only sees large writes. ReplayScan feeds a capture back as an aioble scanner.
+# Advertisements over 255 bytes (extended advertising) do not fit the length byte: they
+# are not recorded, only counted in Recorder.dropped.
+import struct
+
+from ble_util import sleep_ms, ticks_ms, ticks_diff, addr_hex
+from ble_decoder import parse_adv
+
+MAGIC = b'BLEC'
+VERSION = 1
+RECORD = '<IB6sbB'
+RECORD_SIZE = struct.calcsize(RECORD)
+
+
+class Recorder:
+    # stream: anything with write(), e.g. open('/capture.bin', 'ab') or a socket.
+    # limit: stop recording once that many bytes were written (0 = no limit).
+    def __init__(self, stream, batch=2048, limit=0, header=True):
+        self._stream = stream
+        self._buf = bytearray(batch)
+        self._mv = memoryview(self._buf)
+        self._n = 0
+        self._limit = limit
+        self._t0 = ticks_ms()
+        self.written = 0
+        self.records = 0
+        self.dropped = 0
+        if header:
+            self._stream.write(MAGIC + bytes((VERSION,)))
+            self.written += len(MAGIC) + 1
+
+    def record(self, addr_type, addr, rssi, adv):
+        size = RECORD_SIZE + len(adv)
+        if len(adv) > 0xFF or size > len(self._buf) or self._limit and self.written + self._n + size > self._limit:
+            self.dropped += 1
+            return
+        if self._n + size > len(self._buf):
+            self.flush()
+        struct.pack_into(RECORD, self._buf, self._n, ticks_diff(ticks_ms(), self._t0) & 0xFFFFFFFF,
+                         addr_type, addr, rssi, len(adv))
+        self._n += RECORD_SIZE
+        self._buf[self._n:self._n + len(adv)] = adv
+        self._n += len(adv)
+        self.records += 1
+
+    def flush(self):
+        if self._n:
+            self._stream.write(self._mv[:self._n])
+            self.written += self._n
+            self._n = 0
+        if hasattr(self._stream, 'flush'):
+            self._stream.flush()
+
+    def close(self):
+        self.flush()
+        self._stream.close()
+
+
+# Yields (ms, addr_type, addr, rssi, adv) for every record of a capture stream
+def read_capture(stream):
+    header = stream.read(len(MAGIC) + 1)
+    if header[:len(MAGIC)] != MAGIC or header[len(MAGIC)] != VERSION:
+        raise ValueError('Not a capture file')
+    while True:
+        rec = stream.read(RECORD_SIZE)
+        if len(rec) < RECORD_SIZE:
+            return
+        t, addr_type, addr, rssi, size = struct.unpack(RECORD, rec)
+        adv = stream.read(size)
+        if len(adv) < size:  # Truncated last record
+            return
+        yield t, addr_type, addr, rssi, adv
+
+
+class ReplayDevice:
+    def __init__(self, addr_type, addr):
+        self.addr_type = addr_type
+        self.addr = addr
+
+    def addr_hex(self):
+        return addr_hex(self.addr)
+
+
+# Mimics the aioble ScanResult attributes used by get_ble_adv()
+class ReplayResult:
+    def __init__(self, addr_type, addr, rssi, adv):
+        self.device = ReplayDevice(addr_type, addr)
+        self.rssi = rssi
+        self.adv_data = adv
+        self.resp_data = None
+        self.connectable = False
+
+    # Like aioble, from the advertisement or the scan response
+    def name(self):
+        name = parse_adv(self.adv_data)[2]
+        if name is None and self.resp_data:
+            name = parse_adv(self.resp_data)[2]
+        return name
+
+
+# Drop-in replacement for aioble.scan(): async with ReplayScan(path) as scanner: async for result in scanner
+# speed is the replay rate relative to the capture (2 = twice as fast), 0 for as fast as possible.
+class ReplayScan:
+    def __init__(self, path, speed=1):
+        self._path = path
+        self._speed = speed
+        self._file = None
+        self._records = None
+        self._cancelled = False
+
+    async def __aenter__(self):
+        self._file = open(self._path, 'rb')
+        self._records = read_capture(self._file)
+        self._t0 = ticks_ms()
+        return self
+
+    async def __aexit__(self, *_):
+        self._file.close()
+
+    async def cancel(self):
+        self._cancelled = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._cancelled:
+            raise StopAsyncIteration
+        try:
+            t, addr_type, addr, rssi, adv = next(self._records)
+        except StopIteration:
+            raise StopAsyncIteration
+        delay = 0
+        if self._speed:
+            delay = max(0, int(t / self._speed) - ticks_diff(ticks_ms(), self._t0))
+        await sleep_ms(delay)
+        return ReplayResult(addr_type, addr, rssi, adv)
@@ -0,0 +1,160 @@
+# Payload codecs of the publish path, picked with params.json "codec":
+#   json    the JSON object as always, raw_data as a hex string
+#   cbor    the same object in CBOR (RFC 8949 subset: ints, float32, str, bytes, lists,
+#           maps, bool, None), raw_data as bytes
+#   binary  a 20 byte record plus the raw advertisement for thermometers (temp, hum, batt,
+#           battery_volts, counter), CBOR for every frame the record cannot carry whole
+# Every codec has encode(frame) -> payload, array(payloads) -> one batch message, and
+# raw_hex (whether frames carry raw_data as hex). tools/payload_decode.py decodes all
+# three on the host.
+import json
+import struct
+
+from ble_decoder import unhexlify
+
+# Binary records: type byte, then the fields. Records are sent as <H length><record>,
+# a batch being several of them back to back.
+RECORD_CBOR = 0  # CBOR of the frame follows
+RECORD_THERMO = 1
+THERMO = '<B6sbIhHBHB'  # type, addr, rssi, timestamp, temp * 100, hum * 100, batt, battery mV, counter
+THERMO_SIZE = struct.calcsize(THERMO)  # raw_data follows, up to the end of the record
+THERMO_FRAME = ('addr', 'rssi', 'timestamp', 'raw_data', 'data')
+THERMO_DATA = ('temp', 'hum', 'batt', 'battery_volts', 'counter')
+
+
+# Whether a THERMO record carries everything of the frame: no name or window, only the
+# THERMO_DATA fields, in range and at the record's resolution (0.01 for temp and hum)
+def _thermo(frame):
+    data = frame.get('data')
+    if not data or 'temp' not in data or 'hum' not in data or 'counter' not in data:
+        return False
+    for key in frame:
+        if key not in THERMO_FRAME:
+            return False
+    for key in data:
+        if key not in THERMO_DATA:
+            return False
+    temp = int(round(data['temp'] * 100))
+    hum = int(round(data['hum'] * 100))
+    if not -0x8000 <= temp < 0x8000 or temp / 100 != data['temp'] or not 0 <= hum < 0x10000 or hum / 100 != data['hum']:
+        return False
+    if not 0 <= data['counter'] < 0x100 or not 0 <= data.get('batt', 0) < 0xFF:
+        return False
+    return 0 < data.get('battery_volts', 1) < 0x10000
+
+
+def _head(buf, major, n):
+    major <<= 5
+    if n < 24:
+        buf.append(major | n)
+    elif n < 0x100:
+        buf.append(major | 24)
+        buf.append(n)
+    elif n < 0x10000:
+        buf.append(major | 25)
+        buf.extend(struct.pack('>H', n))
+    elif n < 0x100000000:
+        buf.append(major | 26)
+        buf.extend(struct.pack('>I', n))
+    else:
+        buf.append(major | 27)
+        buf.extend(struct.pack('>Q', n))
+
+
+def _cbor(buf, obj):
+    if obj is None:
+        buf.append(0xF6)
+    elif obj is True:
+        buf.append(0xF5)
+    elif obj is False:
+        buf.append(0xF4)
+    elif isinstance(obj, int):
+        if obj >= 0:
+            _head(buf, 0, obj)
+        else:
+            _head(buf, 1, -1 - obj)
+    elif isinstance(obj, float):
+        buf.append(0xFA)  # Single precision, what the Pico computes in anyway
+        buf.extend(struct.pack('>f', obj))
+    elif isinstance(obj, str):
+        data = obj.encode()
+        _head(buf, 3, len(data))
+        buf.extend(data)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        _head(buf, 2, len(obj))
+        buf.extend(obj)
+    elif isinstance(obj, (list, tuple)):
+        _head(buf, 4, len(obj))
+        for item in obj:
+            _cbor(buf, item)
+    elif isinstance(obj, dict):
+        _head(buf, 5, len(obj))
+        for key, value in obj.items():
+            _cbor(buf, key)
+            _cbor(buf, value)
+    else:
+        raise TypeError('Cannot encode {}'.format(type(obj)))
+
+
+def cbor_encode(obj):
+    buf = bytearray()
+    _cbor(buf, obj)
+    return buf
+
+
+class JsonCodec:
+    name = 'json'
+    raw_hex = True
+
+    def encode(self, frame):
+        return json.dumps(frame)
+
+    def array(self, payloads):
+        return '[' + ','.join(payloads) + ']'
+
+
+class CborCodec:
+    name = 'cbor'
+    raw_hex = False
+
+    def encode(self, frame):
+        return cbor_encode(frame)
+
+    def array(self, payloads):
+        buf = bytearray()
+        _head(buf, 4, len(payloads))
+        for payload in payloads:
+            buf.extend(payload)
+        return buf
+
+
+class BinaryCodec:
+    name = 'binary'
+    raw_hex = False
+
+    def encode(self, frame):
+        if _thermo(frame):
+            data = frame['data']
+            raw = frame.get('raw_data', b'')
+            record = bytearray(2 + THERMO_SIZE + len(raw))
+            struct.pack_into('<H' + THERMO[1:], record, 0, THERMO_SIZE + len(raw), RECORD_THERMO,
+                             unhexlify(frame['addr'].replace(':', '')), frame['rssi'], frame['timestamp'],
+                             int(round(data['temp'] * 100)), int(round(data['hum'] * 100)), int(data.get('batt', 0xFF)),
+                             int(data.get('battery_volts', 0)), int(data['counter']))
+            record[2 + THERMO_SIZE:] = raw
+            return record
+        record = bytearray(3)
+        record[2] = RECORD_CBOR
+        _cbor(record, frame)
+        struct.pack_into('<H', record, 0, len(record) - 2)
+        return record
+
+    def array(self, payloads):
+        return b''.join(payloads)
+
+
+CODECS = {'json': JsonCodec, 'cbor': CborCodec, 'binary': BinaryCodec}
+
+
+def get_codec(name='json'):
+    return CODECS[name]()
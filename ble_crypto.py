@@ -0,0 +1,127 @@
+# AES-CCM decryption of encrypted advertisements (PVVX custom format, BTHome v2).
+# Bindkeys are loaded once with load_keys(). The AES context and the constant part of
+# the nonce are prepared the first time a device is seen and reused for every frame.
+
+try:
+    from ubinascii import unhexlify
+except ImportError:
+    from binascii import unhexlify
+
+# AES-ECB block encryption: cryptolib on MicroPython, the cryptography package on the host
+try:
+    from cryptolib import aes
+
+    def _ecb(key):
+        return aes(key, 1).encrypt
+
+except ImportError:
+    try:
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        def _ecb(key):
+            return Cipher(algorithms.AES(key), modes.ECB()).encryptor().update
+
+    except ImportError:
+        _ecb = None
+
+BTHOME_UUID = b'\xd2\xfc'
+PVVX_AAD = b'\x11'
+
+_keys = {}  # addr bytes -> bindkey bytes
+_contexts = {}  # addr bytes -> [encrypt, BTHome nonce, PVVX nonce]
+
+
+# keys maps 'a4:c1:38:aa:bb:cc' (or 'a4c138aabbcc') to a 32 hex digit bindkey
+def load_keys(keys):
+    for addr, key in keys.items():
+        _keys[unhexlify(addr.replace(':', ''))] = unhexlify(key)
+    _contexts.clear()
+
+
+def available():
+    return _ecb is not None
+
+
+def context(addr):
+    ctx = _contexts.get(addr)
+    if ctx is None:
+        key = _keys.get(addr)
+        if key is None or _ecb is None:
+            return None
+        addr = bytes(addr)
+        # Nonces: BTHome MAC + UUID + info byte + counter (13), PVVX reversed MAC + AD header + counter (11)
+        bthome_nonce = bytearray(13)
+        bthome_nonce[0:8] = addr + BTHOME_UUID
+        pvvx_nonce = bytearray(11)
+        pvvx_nonce[0:6] = bytes(reversed(addr))
+        ctx = _contexts[addr] = [_ecb(key), bthome_nonce, pvvx_nonce]
+    return ctx
+
+
+def _cbc_mac(encrypt, x, data):
+    for i in range(0, len(data), 16):
+        block = bytearray(x)
+        for j in range(min(16, len(data) - i)):
+            block[j] ^= data[i + j]
+        x = encrypt(block)
+    return x
+
+
+# RFC 3610 AES-CCM. Returns the plaintext, or None if the MIC does not match.
+def ccm_decrypt(encrypt, nonce, data, mic, aad=b''):
+    q = 15 - len(nonce)
+    m = len(mic)
+    n = len(data)
+
+    # CTR decryption, counter blocks A1.. (A0 encrypts the MIC)
+    a = bytearray(16)
+    a[0] = q - 1
+    a[1:16 - q] = nonce
+    plain = bytearray(n)
+    for i in range(0, n, 16):
+        ctr = i // 16 + 1
+        a[14] = ctr >> 8
+        a[15] = ctr & 0xFF
+        s = encrypt(a)
+        for j in range(min(16, n - i)):
+            plain[i + j] = data[i + j] ^ s[j]
+    a[14] = 0
+    a[15] = 0
+    s0 = encrypt(a)
+
+    # CBC-MAC over B0, the associated data and the plaintext
+    b = bytearray(16)
+    b[0] = (0x40 if aad else 0) | ((m - 2) // 2) << 3 | (q - 1)
+    b[1:16 - q] = nonce
+    b[14] = n >> 8
+    b[15] = n & 0xFF
+    x = encrypt(b)
+    if aad:
+        x = _cbc_mac(encrypt, x, bytes((len(aad) >> 8, len(aad) & 0xFF)) + aad)
+    x = _cbc_mac(encrypt, x, plain)
+
+    for j in range(m):
+        if x[j] ^ s0[j] != mic[j]:
+            return None
+    return plain
+
+
+# PVVX custom encrypted format, service data 0x181A: counter, 6 bytes ciphertext, 4 bytes MIC
+def decrypt_pvvx(adv, start, end, addr):
+    ctx = context(addr)
+    if ctx is None:
+        return None
+    nonce = ctx[2]
+    nonce[6:11] = adv[start - 4:start + 1]  # AD length, type, UUID and counter
+    return ccm_decrypt(ctx[0], nonce, adv[start + 1:end - 4], adv[end - 4:end], PVVX_AAD)
+
+
+# BTHome v2 encrypted: info byte, ciphertext, 4 bytes counter, 4 bytes MIC
+def decrypt_bthome(adv, start, end, addr):
+    ctx = context(addr)
+    if ctx is None:
+        return None
+    nonce = ctx[1]
+    nonce[8] = adv[start]
+    nonce[9:13] = adv[end - 8:end - 4]
+    return ccm_decrypt(ctx[0], nonce, adv[start + 1:end - 8], adv[end - 4:end])
@@ -1,40 +1,271 @@
-def decode_ble(pkg):
+import struct
+import sys
+
+try:
+    from ubinascii import hexlify, unhexlify
+except ImportError:
+    from binascii import hexlify, unhexlify
+
+# AD types used by the parser
+AD_NAME_SHORT = 0x08
+AD_NAME_COMPLETE = 0x09
+AD_SERVICE_DATA_16 = 0x16
+AD_MANUFACTURER = 0xFF
+
+
+# Hex form of the raw advertisement, built only when something displays or publishes it
+def adv_hex(adv):
+    if isinstance(adv, str):
+        return adv
+    return hexlify(adv).decode()
+
+
+# Single pass over the length-type-value AD structures of an advertisement.
+# Returns (services, manufacturers, name): services maps a 16 bit service data UUID and
+# manufacturers a company ID to the (start, end) offsets of the payload that follows it.
+def parse_adv(adv):
+    services = {}
+    manufacturers = {}
+    name = None
+    i = 0
+    n = len(adv)
+    while i < n:
+        length = adv[i]
+        if length == 0:  # Early terminator / zero padding
+            break
+        end = i + 1 + length
+        if end > n:  # Truncated structure
+            break
+        ad_type = adv[i + 1]
+        if ad_type == AD_SERVICE_DATA_16:
+            if length >= 3:
+                services[adv[i + 2] | adv[i + 3] << 8] = (i + 4, end)
+        elif ad_type == AD_MANUFACTURER:
+            if length >= 3:
+                manufacturers[adv[i + 2] | adv[i + 3] << 8] = (i + 4, end)
+        elif ad_type == AD_NAME_COMPLETE or (ad_type == AD_NAME_SHORT and name is None):
+            try:
+                name = str(adv[i + 2:end], 'utf-8')
+            except Exception:
+                pass
+        i = end
+    return services, manufacturers, name
+
+
+# LYWSD03MMC custom firmwares (service data 0x181A)
+def decode_181a(adv, start, end, addr=None):
+    output = {}
+
+    # ATC1441
+    if end - start == 13:
+        temp, hum, batt, vbat, counter = struct.unpack_from('>hBBHB', adv, start + 6)
+        output['temp'] = temp / 10.0
+        output['hum'] = hum
+        output['batt'] = batt
+        output['battery_volts'] = vbat
+        output['counter'] = counter
+
+    # PVVX
+    elif end - start == 15:
+        temp, hum, vbat, batt, counter, flag = struct.unpack_from('<hHHBBB', adv, start + 6)
+        output['temp'] = temp / 100.0
+        output['hum'] = hum / 100.0
+        output['battery_volts'] = vbat
+        output['batt'] = batt
+        output['counter'] = counter
+        output['flag'] = flag
+
+    # PVVX encrypted custom format, needs the device bindkey
+    elif end - start == 11 and addr is not None:
+        from ble_crypto import decrypt_pvvx
+        plain = decrypt_pvvx(adv, start, end, addr)
+        if plain is not None:
+            temp, hum, batt, flag = struct.unpack('<hHBB', plain)
+            output['temp'] = temp / 100.0
+            output['hum'] = hum / 100.0
+            output['batt'] = batt
+            output['counter'] = adv[start]
+            output['flag'] = flag
+
+    return output
+
+
+def counter_181a(adv, start, end):
+    size = end - start
+    if size == 13:
+        return start + 12
+    if size == 15:
+        return start + 13
+    return start  # Encrypted
+
+
+# Decoders are called as decoder(adv, start, end, addr) with the payload offsets from parse_adv()
+# and the device address (None if unknown), needed to decrypt encrypted formats.
+# A string entry names a ble_formats module: it is imported the first time a matching frame
+# is seen, so RAM is only spent on the formats actually present.
+SERVICE_DECODERS = {
+    0x181A: decode_181a,
+    0xFCD2: 'ble_formats.bthome',
+    0xFE95: 'ble_formats.mibeacon',
+}
+MANUFACTURER_DECODERS = {
+    0x0499: 'ble_formats.ruuvi',
+    0xEC88: 'ble_formats.govee',
+    0x004C: 'ble_formats.ibeacon',
+}
+
+# Decoder -> function(adv, start, end) giving the offset of the frame counter byte (-1 if none).
+# ble_formats modules add theirs by defining counter_offset().
+COUNTER_OFFSETS = {
+    decode_181a: counter_181a,
+}
+
+
+# Cached affinities are dropped so devices seen as undecodable get a new chance
+def register_service(uuid, decoder):
+    SERVICE_DECODERS[uuid] = decoder
+    affinity_clear()
+
+
+def register_manufacturer(company, decoder):
+    MANUFACTURER_DECODERS[company] = decoder
+    affinity_clear()
+
+
+def _resolve(table, key):
+    decoder = table.get(key)
+    if isinstance(decoder, str):
+        __import__(decoder)
+        module = sys.modules[decoder]
+        decoder = table[key] = module.decode
+        if hasattr(module, 'counter_offset'):
+            COUNTER_OFFSETS[decoder] = module.counter_offset
+    return decoder
+
+
+# Format detection. Returns (output, match) where match is [decoder, start, end, ad_type, key]
+# for the AD structure that decoded, or None.
+def _detect(adv, addr=None):
+    services, manufacturers, _ = parse_adv(adv)
+    for uuid, (start, end) in services.items():
+        decoder = _resolve(SERVICE_DECODERS, uuid)
+        if decoder is not None:
+            output = decoder(adv, start, end, addr)
+            if output:
+                return output, [decoder, start, end, AD_SERVICE_DATA_16, uuid]
+    for company, (start, end) in manufacturers.items():
+        decoder = _resolve(MANUFACTURER_DECODERS, company)
+        if decoder is not None:
+            output = decoder(adv, start, end, addr)
+            if output:
+                return output, [decoder, start, end, AD_MANUFACTURER, company]
+    return {}, None
+
+
+def decode_ble(adv):
+    # adv is the raw advertisement (bytes or memoryview). A hex string is still accepted.
     output = {}
-    
+
+    try:
+        if isinstance(adv, str):
+            adv = unhexlify(adv)
+        output, _ = _detect(adv)
+
+    except Exception as e:
+        output = {}
+        print(e)
+
+    finally:
+        return output
+
+
+# Per-device decoder affinity. Once an address decoded with a format, later frames from it
+# go straight to that decoder at the same offsets. Undecodable devices are remembered too and
+# only re-checked every NEGATIVE_RECHECK frames.
+# Entries are [decoder, start, end, ad_type, key, counter offset, last counter]
+# or [None, frames left before re-check].
+AFFINITY_SIZE = 256
+NEGATIVE_RECHECK = 64
+_affinity = {}
+affinity_stats = {'hits': 0, 'misses': 0, 'negative_hits': 0, 'invalidations': 0, 'evictions': 0,
+                  'duplicates': 0}
+
+
+def _affinity_store(addr, entry):
+    if addr not in _affinity and len(_affinity) >= AFFINITY_SIZE:
+        del _affinity[next(iter(_affinity))]
+        affinity_stats['evictions'] += 1
+    _affinity[addr] = entry
+
+
+# True if the AD structure header is where it was when the entry was cached
+def _entry_matches(entry, adv):
+    start = entry[1]
+    end = entry[2]
+    return (end <= len(adv) and adv[start - 4] == end - start + 3 and adv[start - 3] == entry[3]
+            and adv[start - 2] | adv[start - 1] << 8 == entry[4])
+
+
+def _new_entry(adv, match):
+    if match is None:
+        return [None, NEGATIVE_RECHECK]
+    counter_offset = COUNTER_OFFSETS.get(match[0])
+    offset = counter_offset(adv, match[1], match[2]) if counter_offset is not None else -1
+    match.append(offset)
+    match.append(adv[offset] if offset >= 0 else -1)
+    return match
+
+
+# Peek at the counter byte of a frame from a known device: True if it repeats the
+# measurement of the last decoded frame, so it can be dropped before decoding.
+def is_duplicate(addr, adv):
+    entry = _affinity.get(addr)
+    if entry is None or entry[0] is None or not 0 <= entry[5] < len(adv):
+        return False
+    if adv[entry[5]] != entry[6] or not _entry_matches(entry, adv):
+        return False
+    affinity_stats['duplicates'] += 1
+    return True
+
+
+# Same as decode_ble() for a frame from addr (any hashable, e.g. device.addr bytes)
+def decode_cached(addr, adv):
+    output = {}
+    stats = affinity_stats
+
     try:
-        # LYWSD03MMC
-        if pkg[4:8] == '1a18' or pkg[10:14] == '1a18':
-            pkg_init = pkg.index('1a18') + 4 # Support for AdFlags
-
-            # ATC1441
-            if pkg_init + 26 == len(pkg):
-                output['temp'] = int(pkg[12+pkg_init:16+pkg_init], 16) / 10.0
-                output['hum'] = int(pkg[16+pkg_init:18+pkg_init], 16)
-                output['batt'] = int(pkg[18+pkg_init:20+pkg_init], 16)
-                output['battery_volts'] = int(pkg[20+pkg_init:24+pkg_init], 16)
-                output['counter'] = int(pkg[24+pkg_init:26+pkg_init], 16)
-
-            # PVVX
+        entry = _affinity.get(addr)
+        if entry is not None:
+            decoder = entry[0]
+            if decoder is None:  # Known undecodable
+                entry[1] -= 1
+                if entry[1] > 0:
+                    stats['negative_hits'] += 1
+                    return output
             else:
-                temp_little = pkg[12+pkg_init:16+pkg_init]
-                temp_big = ''.join([temp_little[i:i+2] for i in range(0, len(temp_little), 2)][::-1])
-                output['temp'] = int(temp_big, 16) / 100.0
-                
-                hum_little = pkg[16+pkg_init:20+pkg_init]
-                hum_big = ''.join([hum_little[i:i+2] for i in range(0, len(hum_little), 2)][::-1])
-                output['hum'] = int(hum_big, 16) / 100.0
-
-                vbat_little = pkg[20+pkg_init:24+pkg_init]
-                vbat_big = ''.join([vbat_little[i:i+2] for i in range(0, len(vbat_little), 2)][::-1])
-                output['battery_volts'] = int(vbat_big, 16)
-
-                output['batt'] = int(pkg[24+pkg_init:26+pkg_init], 16) 
-                output['counter'] = int(pkg[26+pkg_init:28+pkg_init], 16)
-                output['flag'] = int(pkg[28+pkg_init:30+pkg_init], 16)
-    
+                # Fast path only if the AD structure header is where it was last time
+                if _entry_matches(entry, adv):
+                    output = decoder(adv, entry[1], entry[2], addr)
+                    if output:
+                        if entry[5] >= 0:
+                            entry[6] = adv[entry[5]]
+                        stats['hits'] += 1
+                        return output
+                stats['invalidations'] += 1
+            del _affinity[addr]
+
+        stats['misses'] += 1
+        output, match = _detect(adv, addr)
+        _affinity_store(addr, _new_entry(adv, match))
+
     except Exception as e:
+        _affinity.pop(addr, None)
         output = {}
         print(e)
-    
+
     finally:
         return output
+
+
+def affinity_clear():
+    _affinity.clear()
@@ -0,0 +1,98 @@
+# Address filter, run on every frame before anything else is done with it.
+# Entries are full addresses ('a4:c1:38:12:34:56') or OUI prefixes ('a4:c1:38'), kept in
+# sets so a lookup costs the same with thousands of entries. Exact entries win over OUI
+# entries and deny wins over allow; once any allow entry exists, everything else is dropped.
+try:
+    from ubinascii import unhexlify
+except ImportError:
+    from binascii import unhexlify
+
+from ble_util import addr_hex
+
+
+# 'a4:c1:38', 'A4-C1-38-12-34-56' or 'a4c138123456' -> bytes
+def parse_addr(entry):
+    raw = unhexlify(entry.replace(':', '').replace('-', ''))
+    if len(raw) not in (3, 6):
+        raise ValueError(f'Not an address or OUI: {entry}')
+    return raw
+
+
+# OUI of an address as an int, small enough to not allocate on MicroPython
+def oui_key(addr):
+    return addr[0] << 16 | addr[1] << 8 | addr[2]
+
+
+class AddrFilter:
+    def __init__(self, config=None):
+        self.stats = {'passed': 0, 'denied': 0, 'not_allowed': 0}
+        self.clear()
+        if config:
+            self.load(config)
+
+    def clear(self):
+        self._allow_macs = set()
+        self._deny_macs = set()
+        self._allow_ouis = set()
+        self._deny_ouis = set()
+        self._update()
+
+    def _update(self):
+        self._empty = not (self._allow_macs or self._deny_macs or self._allow_ouis or self._deny_ouis)
+        self._allowing = bool(self._allow_macs or self._allow_ouis)
+
+    # config: {'allow': [entries], 'deny': [entries]}, replaces the current entries
+    def load(self, config):
+        self.clear()
+        for entry in config.get('allow', ()):
+            self.add('allow', entry)
+        for entry in config.get('deny', ()):
+            self.add('deny', entry)
+
+    # kind: 'allow' or 'deny'
+    def add(self, kind, entry):
+        raw = parse_addr(entry)
+        self.remove(entry)
+        if len(raw) == 6:
+            (self._allow_macs if kind == 'allow' else self._deny_macs).add(raw)
+        else:
+            (self._allow_ouis if kind == 'allow' else self._deny_ouis).add(oui_key(raw))
+        self._update()
+
+    def remove(self, entry):
+        raw = parse_addr(entry)
+        if len(raw) == 6:
+            self._allow_macs.discard(raw)
+            self._deny_macs.discard(raw)
+        else:
+            self._allow_ouis.discard(oui_key(raw))
+            self._deny_ouis.discard(oui_key(raw))
+        self._update()
+
+    # addr: 6 bytes in display order, as aioble's device.addr. Returns True to keep the frame.
+    def check(self, addr):
+        if self._empty:
+            return True
+        stats = self.stats
+        if addr in self._deny_macs:
+            stats['denied'] += 1
+            return False
+        if addr in self._allow_macs:
+            stats['passed'] += 1
+            return True
+        oui = oui_key(addr)
+        if oui in self._deny_ouis:
+            stats['denied'] += 1
+            return False
+        if self._allowing and oui not in self._allow_ouis:
+            stats['not_allowed'] += 1
+            return False
+        stats['passed'] += 1
+        return True
+
+    def as_dict(self):
+        def fmt_oui(key):
+            return addr_hex(bytes((key >> 16, key >> 8 & 0xFF, key & 0xFF)))
+
+        return {'allow': [addr_hex(m) for m in self._allow_macs] + [fmt_oui(o) for o in self._allow_ouis],
+                'deny': [addr_hex(m) for m in self._deny_macs] + [fmt_oui(o) for o in self._deny_ouis]}
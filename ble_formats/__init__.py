@@ -0,0 +1,5 @@
+# Decoders for advertisement formats other than the LYWSD03MMC custom firmwares.
+# Each module is imported by ble_decoder the first time a frame with its
+# service data UUID / company ID is seen, and exposes decode(adv, start, end, addr).
+# The UUIDs and company IDs are only listed in ble_decoder.SERVICE_DECODERS and
+# MANUFACTURER_DECODERS: the tables name the module, so nothing is imported before use.
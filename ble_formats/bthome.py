@@ -0,0 +1,90 @@
+# BTHome v2 (https://bthome.io/format/), service data UUID 0xFCD2
+import struct
+
+# Device information byte
+FLAG_ENCRYPTED = 0x01
+
+# Object ID -> (key, struct format, size, factor). Size 3 is an unsigned 24 bit value.
+OBJECTS = {
+    0x00: ('counter', 'B', 1, 1),
+    0x01: ('batt', 'B', 1, 1),
+    0x02: ('temp', '<h', 2, 0.01),
+    0x03: ('hum', '<H', 2, 0.01),
+    0x04: ('pressure', None, 3, 0.01),
+    0x05: ('illuminance', None, 3, 0.01),
+    0x08: ('dewpoint', '<h', 2, 0.01),
+    0x09: ('count', 'B', 1, 1),
+    0x0A: ('energy', None, 3, 0.001),
+    0x0B: ('power', None, 3, 0.01),
+    0x0C: ('voltage', '<H', 2, 0.001),
+    0x0D: ('pm25', '<H', 2, 1),
+    0x0E: ('pm10', '<H', 2, 1),
+    0x0F: ('generic', 'B', 1, 1),
+    0x10: ('power_on', 'B', 1, 1),
+    0x11: ('opening', 'B', 1, 1),
+    0x12: ('co2', '<H', 2, 1),
+    0x13: ('tvoc', '<H', 2, 1),
+    0x14: ('moisture', '<H', 2, 0.01),
+    0x2E: ('hum', 'B', 1, 1),
+    0x2F: ('moisture', 'B', 1, 1),
+    0x3A: ('button', 'B', 1, 1),
+    0x3D: ('count', '<H', 2, 1),
+    0x3E: ('count', '<I', 4, 1),
+    0x3F: ('rotation', '<h', 2, 0.1),
+    0x40: ('distance_mm', '<H', 2, 1),
+    0x41: ('distance_m', '<H', 2, 0.1),
+    0x42: ('duration', None, 3, 0.001),
+    0x43: ('current', '<H', 2, 0.001),
+    0x44: ('speed', '<H', 2, 0.01),
+    0x45: ('temp', '<h', 2, 0.1),
+    0x46: ('uv_index', 'B', 1, 0.1),
+    0x4A: ('voltage', '<H', 2, 0.1),
+    0x51: ('acceleration', '<H', 2, 0.001),
+    0x52: ('gyroscope', '<H', 2, 0.001),
+}
+
+
+def decode(adv, start, end, addr=None):
+    output = {}
+    if end - start < 1:
+        return output
+    info = adv[start]
+    if info >> 5 != 2:  # Only BTHome v2
+        return output
+    if info & FLAG_ENCRYPTED:
+        if addr is None or end - start < 10:
+            return output
+        from ble_crypto import decrypt_bthome
+        plain = decrypt_bthome(adv, start, end, addr)
+        if plain is None:
+            return output
+        return decode_objects(plain, 0, len(plain))
+    return decode_objects(adv, start + 1, end)
+
+
+def decode_objects(data, i, end):
+    output = {}
+    while i < end:
+        obj = OBJECTS.get(data[i])
+        if obj is None:  # Unknown object: its size is unknown too, stop here
+            break
+        key, fmt, size, factor = obj
+        i += 1
+        if i + size > end:
+            break
+        if fmt is None:
+            value = data[i] | data[i + 1] << 8 | data[i + 2] << 16
+        else:
+            value = struct.unpack_from(fmt, data, i)[0]
+        if factor != 1:
+            value = round(value * factor, 3)
+        output[key] = value
+        i += size
+    return output
+
+
+# Low byte of the counter of encrypted frames, else the packet id object when it comes first
+def counter_offset(adv, start, end):
+    if adv[start] & FLAG_ENCRYPTED:
+        return end - 8
+    return start + 2 if end - start > 2 and adv[start + 1] == 0x00 else -1
@@ -0,0 +1,18 @@
+# Govee H5075 / H5072 thermo-hygrometers, manufacturer data of company ID 0xEC88
+
+
+def decode(adv, start, end, addr=None):
+    output = {}
+    if end - start != 6:
+        return output
+
+    # Temperature and humidity packed in a 24 bit big endian value, sign in the top bit
+    packed = adv[start + 1] << 16 | adv[start + 2] << 8 | adv[start + 3]
+    sign = 1
+    if packed & 0x800000:
+        packed &= 0x7FFFFF
+        sign = -1
+    output['temp'] = sign * (packed // 1000) / 10
+    output['hum'] = (packed % 1000) / 10
+    output['batt'] = adv[start + 4]
+    return output
@@ -0,0 +1,23 @@
+# Apple iBeacon, manufacturer data of company ID 0x004C
+import struct
+
+try:
+    from ubinascii import hexlify
+except ImportError:
+    from binascii import hexlify
+
+# Beacon type and remaining length, other Apple frames (phones, AirPods...) differ
+IBEACON_PREFIX = 0x0215
+
+
+def decode(adv, start, end, addr=None):
+    output = {}
+    if end - start != 23 or (adv[start] << 8 | adv[start + 1]) != IBEACON_PREFIX:
+        return output
+
+    major, minor, tx_power = struct.unpack_from('>HHb', adv, start + 18)
+    output['uuid'] = hexlify(adv[start + 2:start + 18]).decode()
+    output['major'] = major
+    output['minor'] = minor
+    output['tx_power'] = tx_power
+    return output
@@ -0,0 +1,74 @@
+# Xiaomi MiBeacon, service data UUID 0xFE95
+import struct
+
+# Frame control bits
+FRCTRL_ENCRYPTED = 0x0008
+FRCTRL_MAC = 0x0010
+FRCTRL_CAPABILITY = 0x0020
+FRCTRL_OBJECT = 0x0040
+CAPABILITY_IO = 0x20
+
+
+def _temp_hum(data, i):
+    temp, hum = struct.unpack_from('<hH', data, i)
+    return {'temp': temp / 10.0, 'hum': hum / 10.0}
+
+
+# Object type -> (key, struct format, factor), or a function for composite objects
+OBJECTS = {
+    0x1004: ('temp', '<h', 0.1),
+    0x1006: ('hum', '<H', 0.1),
+    0x1007: ('illuminance', None, 1),
+    0x1008: ('moisture', 'B', 1),
+    0x1009: ('conductivity', '<H', 1),
+    0x100A: ('batt', 'B', 1),
+    0x100D: _temp_hum,
+}
+
+
+def decode(adv, start, end, addr=None):
+    output = {}
+    if end - start < 5:
+        return output
+    frctrl = adv[start] | adv[start + 1] << 8
+    if frctrl & FRCTRL_ENCRYPTED or not frctrl & FRCTRL_OBJECT:
+        return output
+
+    counter = adv[start + 4]
+    i = start + 5
+    if frctrl & FRCTRL_MAC:
+        i += 6
+    if frctrl & FRCTRL_CAPABILITY:
+        if i < end and adv[i] & CAPABILITY_IO:
+            i += 2
+        i += 1
+
+    while i + 3 <= end:
+        obj_type = adv[i] | adv[i + 1] << 8
+        size = adv[i + 2]
+        i += 3
+        if i + size > end:
+            break
+        obj = OBJECTS.get(obj_type)
+        if obj is None:
+            pass
+        elif not isinstance(obj, tuple):
+            output.update(obj(adv, i))
+        else:
+            key, fmt, factor = obj
+            if fmt is None:
+                value = adv[i] | adv[i + 1] << 8 | adv[i + 2] << 16
+            else:
+                value = struct.unpack_from(fmt, adv, i)[0]
+            if factor != 1:
+                value = round(value * factor, 3)
+            output[key] = value
+        i += size
+
+    if output:
+        output['counter'] = counter
+    return output
+
+
+def counter_offset(adv, start, end):
+    return start + 4
@@ -0,0 +1,34 @@
+# RuuviTag data format 5 (RAWv2), manufacturer data of company ID 0x0499
+import struct
+
+FORMAT_RAWV2 = 0x05
+
+
+def decode(adv, start, end, addr=None):
+    output = {}
+    if end - start < 24 or adv[start] != FORMAT_RAWV2:
+        return output
+
+    temp, hum, pressure, acc_x, acc_y, acc_z, power, movement, counter = \
+        struct.unpack_from('>hHHhhhHBH', adv, start + 1)
+
+    # 0x8000 / 0xFFFF mark values the tag could not measure
+    if temp != -32768:
+        output['temp'] = temp / 200
+    if hum != 0xFFFF:
+        output['hum'] = hum / 400
+    if pressure != 0xFFFF:
+        output['pressure'] = (pressure + 50000) / 100
+    output['acc_x'] = acc_x
+    output['acc_y'] = acc_y
+    output['acc_z'] = acc_z
+    output['battery_volts'] = (power >> 5) + 1600
+    output['tx_power'] = (power & 0x1F) * 2 - 40
+    output['movement'] = movement
+    output['counter'] = counter
+    return output
+
+
+# Low byte of the measurement sequence number (big endian, after the movement counter)
+def counter_offset(adv, start, end):
+    return start + 17
@@ -0,0 +1,20 @@
+# Batching of device payloads into gateway messages.
+# groups() splits (key, payload) pairs in order into groups whose array (the codec's
+# array(), see ble_codec.py) stays within max_bytes and holds at most max_count payloads.
+# A payload bigger than max_bytes on its own still goes, alone.
+
+
+def groups(items, max_count=50, max_bytes=4096):
+    group = []
+    size = 2  # Brackets
+    for item in items:
+        n = len(item[1]) + 1  # Payload and its separator
+        if group and (len(group) >= max_count or size + n > max_bytes):
+            yield group
+            group = []
+            size = 2
+        group.append(item)
+        size += n
+    if group:
+        yield group
+
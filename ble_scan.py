@@ -0,0 +1,248 @@
+# Supervised continuous BLE scanning.
+# The scan runs with duration 0 (until stopped) and is only restarted when it fails or
+# its source ends, with exponential backoff between failed attempts, and at the end of
+# every session: aioble keeps each device seen during a scan in a set it searches for
+# every frame, and only yields a device again when its advertising data changed, so long
+# scans grow that set without limit and never report static devices again. ScanStats records
+# the frame rate and the time lost between scans. DutyCycle adapts the scan window and
+# interval to the air and to the WiFi side, which shares the radio on the Pico W.
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from ble_util import sleep_ms, ticks_ms, ticks_diff
+
+
+FPS_WINDOW_MS = 5000
+
+
+class ScanStats:
+    def __init__(self):
+        self.frames = 0
+        self.new = 0  # Frames that were not a repeated measurement, counted by the frame handler
+        self.restarts = 0
+        self.reconfigs = 0
+        self.sessions = 0  # Scans ended by session_ms or session_devices
+        self.errors = 0
+        self.gap_ms = 0  # Total time with no scan running, restarts and backoff included
+        self.last_gap_ms = 0
+        self._t = ticks_ms()
+        self._frames = 0
+        self._fps = 0
+
+    # Frames per second, over windows of at least FPS_WINDOW_MS
+    def fps(self):
+        now = ticks_ms()
+        dt = ticks_diff(now, self._t)
+        if dt >= FPS_WINDOW_MS:
+            self._fps = (self.frames - self._frames) * 1000 / dt
+            self._t = now
+            self._frames = self.frames
+        return self._fps
+
+    def as_dict(self):
+        return {'frames': self.frames, 'new': self.new, 'fps': round(self.fps(), 1), 'restarts': self.restarts,
+                'reconfigs': self.reconfigs, 'sessions': self.sessions, 'errors': self.errors, 'gap_ms': self.gap_ms, 'last_gap_ms': self.last_gap_ms}
+
+
+class Scanner:
+    # scan: callable returning the scan context manager, e.g. lambda: aioble.scan(0, ...)
+    # A scan session ends after session_ms or once session_devices addresses were seen (0: no limit)
+    def __init__(self, scan, stats=None, min_backoff_ms=250, max_backoff_ms=30000, session_ms=60000,
+                 session_devices=128, log=print):
+        self._scan = scan
+        self.stats = stats if stats is not None else ScanStats()
+        self._min_backoff = min_backoff_ms
+        self._max_backoff = max_backoff_ms
+        self._session_ms = session_ms
+        self._session_devices = session_devices
+        self._log = log
+        self._stop = False
+        self._restart = False
+        self._session_end = False
+        self._active = None
+
+    def stop(self):
+        self._stop = True
+
+    # Stop the running scan, it starts again at once with what the scan callable returns now
+    async def restart(self):
+        self._restart = True
+        if self._active is not None and hasattr(self._active, 'cancel'):
+            await self._active.cancel()
+
+    # Ends the scan session after session_ms, even while no frame comes in
+    async def _session_timer(self, scanner):
+        await sleep_ms(self._session_ms)
+        self._session_end = True
+        if hasattr(scanner, 'cancel'):
+            await scanner.cancel()
+
+    # Calls on_result(result) for every frame until stop()
+    async def run(self, on_result):
+        stats = self.stats
+        backoff = self._min_backoff
+        stopped = None
+        seen = set()
+        while not self._stop:
+            frames = stats.frames
+            failed = False
+            timer = None
+            seen.clear()
+            try:
+                async with self._scan() as scanner:
+                    self._active = scanner
+                    if stopped is not None:
+                        stats.last_gap_ms = ticks_diff(ticks_ms(), stopped)
+                        stats.gap_ms += stats.last_gap_ms
+                    if self._session_ms:
+                        timer = asyncio.create_task(self._session_timer(scanner))
+                    async for result in scanner:
+                        stats.frames += 1
+                        on_result(result)
+                        if self._session_devices:
+                            seen.add(result.device.addr)
+                            if len(seen) >= self._session_devices:
+                                self._session_end = True
+                        if self._stop or self._restart or self._session_end:
+                            break
+            except Exception as e:
+                stats.errors += 1
+                failed = True
+                self._log(f'Scan failed ({e}), restarting in {backoff} ms')
+            if timer is not None:
+                timer.cancel()
+            self._active = None
+            stopped = ticks_ms()
+            if self._stop:
+                break
+            if (self._restart or self._session_end) and not failed:
+                if self._restart:
+                    stats.reconfigs += 1
+                else:
+                    stats.sessions += 1
+                self._restart = self._session_end = False
+                backoff = self._min_backoff
+                continue
+            self._restart = self._session_end = False
+            stats.restarts += 1
+            # Back off while the scan keeps failing or ending without frames
+            if failed or stats.frames == frames:
+                await sleep_ms(backoff)
+                backoff = min(backoff * 2, self._max_backoff)
+            else:
+                backoff = self._min_backoff
+                await sleep_ms(0)
+
+
+# (interval_us, window_us) from continuous scanning down to a 10 % duty cycle
+DUTY_LEVELS = ((30000, 30000), (60000, 30000), (120000, 30000), (300000, 30000))
+
+
+# Picks the scan duty cycle every period_ms. It backs off (longer interval) while the
+# publisher struggles: a publish burst still in flight, more than busy_ratio of the period
+# spent publishing, a backlog above backlog_high or a write latency above latency_high_ms.
+# Otherwise it ramps up when the air is busy (at least busy_frames new frames per scan
+# interval) and slowly steps down when it is quiet (below quiet_frames).
+class DutyCycle:
+    def __init__(self, stats, levels=DUTY_LEVELS, period_ms=10000, busy_frames=0.5, quiet_frames=0.05,
+                 backlog_high=20, latency_high_ms=500, busy_ratio=0.5, log=print):
+        self._stats = stats
+        self._levels = levels
+        self._period = period_ms
+        self._busy_frames = busy_frames
+        self._quiet_frames = quiet_frames
+        self._backlog_high = backlog_high
+        self._latency_high = latency_high_ms
+        self._busy_ratio = busy_ratio
+        self._log = log
+        self.level = 0
+        self.changes = 0
+        self.reason = 'start'
+        self.frames_per_window = 0
+        self.backlog = 0
+        self.latency_ms = 0  # Moving average of the MQTT publish time
+        self.publish_ms = 0  # Time spent publishing during the last period
+        self._burst = None
+        self._new = stats.new
+        self._t = ticks_ms()
+
+    @property
+    def interval_us(self):
+        return self._levels[self.level][0]
+
+    @property
+    def window_us(self):
+        return self._levels[self.level][1]
+
+    # Publisher hooks: a burst of backlog messages starts, one message took ms, the burst ended
+    def publish_begin(self, backlog):
+        self.backlog = backlog
+        if backlog:
+            self._burst = ticks_ms()
+
+    def published(self, ms):
+        self.latency_ms = ms if not self.latency_ms else (self.latency_ms * 7 + ms) / 8
+
+    def publish_end(self):
+        if self._burst is not None:
+            self.publish_ms += ticks_diff(ticks_ms(), self._burst)
+            self._burst = None
+
+    # Returns True when the level changed
+    def decide(self):
+        now = ticks_ms()
+        dt = ticks_diff(now, self._t)
+        if dt <= 0:
+            return False
+        new = self._stats.new - self._new
+        self._new = self._stats.new
+        self._t = now
+        publish_ms = self.publish_ms
+        if self._burst is not None:
+            publish_ms += ticks_diff(now, self._burst)
+            self._burst = now
+        self.publish_ms = 0
+        # New frames seen per scan interval while scanning
+        self.frames_per_window = new * self.interval_us / (dt * 1000) / (self.window_us / self.interval_us)
+
+        level = self.level
+        if self._burst is not None and publish_ms > dt * self._busy_ratio:
+            reason = 'publish burst'
+        elif self.backlog > self._backlog_high:
+            reason = f'backlog {self.backlog}'
+        elif self.latency_ms > self._latency_high:
+            reason = f'latency {self.latency_ms:.0f} ms'
+        elif publish_ms > dt * self._busy_ratio:
+            reason = f'publishing {publish_ms * 100 // dt} %'
+        else:
+            reason = None
+        if reason:
+            level = min(level + 1, len(self._levels) - 1)
+        elif self.frames_per_window >= self._busy_frames:
+            level = max(level - 1, 0)
+            reason = f'busy air {self.frames_per_window:.2f}'
+        elif self.frames_per_window < self._quiet_frames:
+            level = min(level + 1, len(self._levels) - 1)
+            reason = f'quiet air {self.frames_per_window:.2f}'
+        if level == self.level:
+            return False
+        self.level = level
+        self.reason = reason
+        self.changes += 1
+        self._log(f'Scan interval {self.interval_us} us window {self.window_us} us ({reason})')
+        return True
+
+    # Re-decides every period and restarts the scanner on a change
+    async def run(self, scanner):
+        while True:
+            await sleep_ms(self._period)
+            if self.decide():
+                await scanner.restart()
+
+    def as_dict(self):
+        return {'interval_us': self.interval_us, 'window_us': self.window_us, 'level': self.level,
+                'changes': self.changes, 'reason': self.reason, 'frames_per_window': round(self.frames_per_window, 2),
+                'backlog': self.backlog, 'latency_ms': round(self.latency_ms), 'publish_ms': self.publish_ms}
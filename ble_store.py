@@ -0,0 +1,434 @@
+# Bounded device table.
+# Holds the last frame of every device, keyed by address, until it is published. At most
+# `capacity` devices are kept: when a new one arrives with the table full, the evict_batch
+# least recently seen devices are dropped at once (one sort per batch instead of one scan
+# per frame). Devices whose frames decode (sensors) are only evicted once no other device
+# is left, so a flood of phones with rotating addresses cannot push them out. Devices not
+# seen for ttl_s seconds are dropped by expire().
+# Devices live in slots of preallocated arrays (RSSI, times, flags, a bytearray per slot
+# for the advertisement) that are updated in place, so storing a frame allocates nothing.
+# The published dict is only built by frame(), right before it is serialized.
+# Names are cached per slot: wants_name() tells whether resolving the name of a frame is
+# still worth it, so a name is looked up at most NAME_TRIES times per device.
+# With aggregate=True every slot also keeps min/max/mean/EWMA and a count of the RSSI
+# (repeated frames included) and of the numeric decoded fields, until close_window().
+# With deadbands ({field: band}) a decoded frame is only marked pending when a field
+# moved by its band or more since the last published frame (other numeric fields: any
+# change), or heartbeat_s passed since that publish. Sent/suppressed/duplicate counts are
+# per slot, so they survive the decoder cache being invalidated.
+# Every device that becomes pending is queued once and on_pending() is called, so the
+# publisher can sleep until there is work and drain() only the queued devices.
+from array import array
+
+from ble_util import ticks_ms, ticks_diff, addr_hex
+from ble_decoder import adv_hex
+
+# Legacy advertising payload size, longer (extended, up to 1650 bytes) advertisements get their own buffer
+ADV_MAX = 31
+
+# Frames of a device looked at for a name before giving up (until the next active scan)
+NAME_TRIES = 3
+
+# Decoded fields that are identifiers or counters, not measurements to aggregate
+AGG_SKIP = ('counter', 'flag', 'packet_id', 'movement', 'major', 'minor', 'tx_power', 'button')
+
+# Per field aggregate array
+AGG_COUNT = 0
+AGG_MIN = 1
+AGG_MAX = 2
+AGG_SUM = 3
+AGG_EWMA = 4
+
+# Slot flags
+PENDING = 1  # Frame not published yet
+SENSOR = 2  # Last frame was decoded
+QUEUED = 4  # In the drain() queue
+
+
+class DeviceStore:
+    def __init__(self, capacity=256, ttl_s=600, evict_batch=16, aggregate=False, ewma_alpha=0.2, deadbands=None,
+                 heartbeat_s=300, on_pending=None):
+        self.capacity = capacity
+        self.ttl_ms = ttl_s * 1000
+        self._batch = max(1, min(evict_batch, capacity))
+        self._slots = {}  # addr -> slot
+        self._free = list(range(capacity - 1, -1, -1))
+        self._addr = [None] * capacity
+        self._seen = array('l', [0] * capacity)
+        self._timestamp = array('L', [0] * capacity)
+        self._rssi = array('b', [0] * capacity)
+        self._flags = bytearray(capacity)
+        self._version = array('H', [0] * capacity)  # Bumped by every frame, see published()
+        self._adv = [bytearray(ADV_MAX) for _ in range(capacity)]
+        self._adv_len = array('H', [0] * capacity)
+        self._name = [None] * capacity
+        self._name_tries = bytearray(capacity)
+        self._data = [None] * capacity
+        self._sent = array('L', [0] * capacity)
+        self._suppressed = array('L', [0] * capacity)
+        self._duplicates = array('L', [0] * capacity)  # Repeated frames dropped before decoding, see touch()
+        self._queue = []  # Addresses that became pending since the last drain()
+        self._on_pending = on_pending
+        self.deadbands = deadbands
+        if deadbands is not None:
+            self._heartbeat = heartbeat_s * 1000
+            self._last_data = [None] * capacity  # Decoded dict of the last published frame
+            self._last_pub = array('l', [0] * capacity)
+        self.aggregate = aggregate
+        self._alpha = ewma_alpha
+        if aggregate:
+            self._rssi_count = array('H', [0] * capacity)
+            self._rssi_min = array('b', [0] * capacity)
+            self._rssi_max = array('b', [0] * capacity)
+            self._rssi_sum = array('l', [0] * capacity)
+            self._rssi_ewma = array('f', [0] * capacity)
+            self._fields = [None] * capacity  # field -> array('f') indexed by AGG_*, reused across windows
+        self._sweep = ticks_ms()
+        self.stats = {'inserted': 0, 'evicted': 0, 'evicted_sensors': 0, 'evicted_pending': 0, 'expired': 0,
+                      'name_lookups': 0, 'name_cached': 0, 'sent': 0, 'suppressed': 0}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, addr):
+        return addr in self._slots
+
+    # New frame of a device (addr as bytes), pending until published()
+    def put(self, addr, rssi, timestamp, adv, data=None, name=None):
+        slot = self._slots.get(addr)
+        if slot is None:
+            if not self._free:
+                self._evict()
+            slot = self._free.pop()
+            self._slots[addr] = slot
+            self._addr[slot] = addr
+            self._name_tries[slot] = 0
+            self._sent[slot] = 0
+            self._suppressed[slot] = 0
+            self._duplicates[slot] = 0
+            if self.deadbands is not None:
+                self._last_data[slot] = None
+            if self.aggregate:
+                self._rssi_count[slot] = 0
+                self._fields[slot] = None
+            self.stats['inserted'] += 1
+        self._seen[slot] = ticks_ms()
+        self._timestamp[slot] = timestamp
+        self._rssi[slot] = rssi
+        size = len(adv)
+        if size > len(self._adv[slot]):
+            self._adv[slot] = bytearray(size)
+        self._adv[slot][:size] = adv
+        self._adv_len[slot] = size
+        if name:
+            self._name[slot] = name
+        elif self._name[slot] is None and self._name_tries[slot] < NAME_TRIES:
+            self._name_tries[slot] += 1
+        self._data[slot] = data
+        if data and self.deadbands is not None and not self._changed(slot, data):
+            # Within the deadbands: stored, but only published if an older frame still is pending
+            self._flags[slot] = SENSOR | (self._flags[slot] & (PENDING | QUEUED))
+            self._suppressed[slot] += 1
+            self.stats['suppressed'] += 1
+        else:
+            self._flags[slot] = PENDING | (SENSOR if data else 0) | (self._flags[slot] & QUEUED)
+            self._enqueue(slot)
+        self._version[slot] = (self._version[slot] + 1) & 0xFFFF
+        if self.aggregate:
+            self._add_rssi(slot, rssi)
+            if data:
+                self._add_fields(slot, data)
+
+    # Queues a pending device for drain(), once
+    def _enqueue(self, slot):
+        if not self._flags[slot] & QUEUED:
+            self._flags[slot] |= QUEUED
+            self._queue.append(self._addr[slot])
+            if len(self._queue) > 2 * self.capacity:
+                self._compact()
+            if self._on_pending is not None:
+                self._on_pending()
+
+    # Drops the addresses of released devices from the queue, and the older entry of an
+    # address released then inserted again, so the queue stays within twice the capacity
+    def _compact(self):
+        slots = self._slots
+        flags = self._flags
+        queue = []
+        for addr in self._queue:
+            slot = slots.get(addr)
+            if slot is not None and flags[slot] & QUEUED:
+                flags[slot] &= ~QUEUED
+                queue.append(addr)
+        for addr in queue:
+            flags[slots[addr]] |= QUEUED
+        self._queue = queue
+
+    # True when a decoded frame has to be published under the deadbands
+    def _changed(self, slot, data):
+        last = self._last_data[slot]
+        if last is None or ticks_diff(ticks_ms(), self._last_pub[slot]) >= self._heartbeat:
+            return True
+        deadbands = self.deadbands
+        for key, value in data.items():
+            if key in AGG_SKIP:
+                continue
+            prev = last.get(key)
+            if prev is None or not isinstance(value, (int, float)) or isinstance(value, bool):
+                if value != prev:
+                    return True
+            elif abs(value - prev) >= deadbands.get(key, 0) * 0.999 and value != prev:  # 0.1 % for float rounding
+                return True
+        return False
+
+    def _add_rssi(self, slot, rssi):
+        count = self._rssi_count[slot]
+        if not count:
+            self._rssi_min[slot] = self._rssi_max[slot] = rssi
+            self._rssi_sum[slot] = 0
+            self._rssi_ewma[slot] = rssi
+        else:
+            if rssi < self._rssi_min[slot]:
+                self._rssi_min[slot] = rssi
+            elif rssi > self._rssi_max[slot]:
+                self._rssi_max[slot] = rssi
+            self._rssi_ewma[slot] += self._alpha * (rssi - self._rssi_ewma[slot])
+        self._rssi_sum[slot] += rssi
+        if count < 0xFFFF:
+            self._rssi_count[slot] = count + 1
+
+    def _add_fields(self, slot, data):
+        fields = self._fields[slot]
+        if fields is None:
+            fields = self._fields[slot] = {}
+        for key, value in data.items():
+            if key in AGG_SKIP or not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            agg = fields.get(key)
+            if agg is None:
+                agg = fields[key] = array('f', [0] * 5)
+            if not agg[AGG_COUNT]:
+                agg[AGG_MIN] = agg[AGG_MAX] = agg[AGG_EWMA] = value
+                agg[AGG_SUM] = 0
+            else:
+                if value < agg[AGG_MIN]:
+                    agg[AGG_MIN] = value
+                elif value > agg[AGG_MAX]:
+                    agg[AGG_MAX] = value
+                agg[AGG_EWMA] += self._alpha * (value - agg[AGG_EWMA])
+            agg[AGG_SUM] += value
+            agg[AGG_COUNT] += 1
+
+    # Window summary of a device: {'count', 'rssi': {min, max, mean, ewma}, 'data': {field: {...}}}
+    def window(self, addr):
+        slot = self._slots.get(addr)
+        if slot is None or not self.aggregate or not self._rssi_count[slot]:
+            return None
+        count = self._rssi_count[slot]
+        summary = {'count': count,
+                   'rssi': {'min': self._rssi_min[slot], 'max': self._rssi_max[slot],
+                            'mean': round(self._rssi_sum[slot] / count, 1), 'ewma': round(self._rssi_ewma[slot], 1)}}
+        fields = self._fields[slot]
+        if fields:
+            data = {}
+            for key, agg in fields.items():
+                n = agg[AGG_COUNT]
+                if n:
+                    data[key] = {'min': round(agg[AGG_MIN], 2), 'max': round(agg[AGG_MAX], 2),
+                                 'mean': round(agg[AGG_SUM] / n, 2), 'ewma': round(agg[AGG_EWMA], 2), 'count': int(n)}
+            summary['data'] = data
+        return summary
+
+    # Starts a new aggregation window for a device
+    def close_window(self, addr):
+        slot = self._slots.get(addr)
+        if slot is None or not self.aggregate:
+            return
+        self._rssi_count[slot] = 0
+        fields = self._fields[slot]
+        if fields:
+            for agg in fields.values():
+                agg[AGG_COUNT] = 0
+
+    # True when the name of the next frame of a device should be resolved: it has none
+    # cached and was not looked for in NAME_TRIES frames yet
+    def wants_name(self, addr):
+        slot = self._slots.get(addr)
+        if slot is not None and (self._name[slot] is not None or self._name_tries[slot] >= NAME_TRIES):
+            self.stats['name_cached'] += 1
+            return False
+        self.stats['name_lookups'] += 1
+        return True
+
+    def name(self, addr):
+        slot = self._slots.get(addr)
+        return self._name[slot] if slot is not None else None
+
+    # Name from a scan response, which repeats the advertisement: cached without a new frame
+    def set_name(self, addr, name):
+        slot = self._slots.get(addr)
+        if slot is not None and name:
+            self._name[slot] = name
+
+    # Sensors without a name, worth an active scan (scan responses carry most names)
+    def unnamed_sensors(self):
+        count = 0
+        for slot in self._slots.values():
+            if self._flags[slot] & SENSOR and self._name[slot] is None:
+                count += 1
+        return count
+
+    # Lets every unnamed device be looked at again, when scan responses start coming in
+    def retry_names(self):
+        for slot in self._slots.values():
+            self._name_tries[slot] = 0
+
+    # Device seen again without a new frame (repeated measurement), its RSSI still counts
+    def touch(self, addr, rssi=None):
+        slot = self._slots.get(addr)
+        if slot is not None:
+            self._seen[slot] = ticks_ms()
+            self._duplicates[slot] += 1
+            # Heartbeat of a device that only repeats its last measurement
+            if (self.deadbands is not None and self._data[slot] and not self._flags[slot] & PENDING
+                    and ticks_diff(self._seen[slot], self._last_pub[slot]) >= self._heartbeat):
+                self._flags[slot] |= PENDING
+                self._version[slot] = (self._version[slot] + 1) & 0xFFFF
+                self._enqueue(slot)
+            if self.aggregate and rssi is not None:
+                # Presence counts too: the device gets a summary for this window
+                self._add_rssi(slot, rssi)
+                self._flags[slot] |= PENDING
+                self._version[slot] = (self._version[slot] + 1) & 0xFFFF
+                self._enqueue(slot)
+
+    # Version of the pending frame of a device, None when nothing is pending
+    def version(self, addr):
+        slot = self._slots.get(addr)
+        if slot is None or not self._flags[slot] & PENDING:
+            return None
+        return self._version[slot]
+
+    # Clears the pending frame, unless a newer one arrived while it was being published
+    def published(self, addr, version):
+        slot = self._slots.get(addr)
+        if slot is None:
+            return
+        self._sent[slot] += 1
+        self.stats['sent'] += 1
+        if self._version[slot] == version:
+            self._flags[slot] &= ~PENDING
+            if self.deadbands is not None:
+                self._last_data[slot] = self._data[slot]
+                self._last_pub[slot] = ticks_ms()
+        else:
+            self._enqueue(slot)
+
+    # Puts a device whose publish failed back in the queue
+    def retry(self, addr):
+        slot = self._slots.get(addr)
+        if slot is not None and self._flags[slot] & PENDING:
+            self._enqueue(slot)
+
+    # Addresses with a frame pending, as a list so the table can change while it is walked
+    def pending(self):
+        flags = self._flags
+        return [addr for addr, slot in self._slots.items() if flags[slot] & PENDING]
+
+    # Pending addresses queued since the last call, emptying the queue. Devices released
+    # meanwhile are skipped.
+    def drain(self):
+        queue = self._queue
+        if not queue:
+            return []
+        self._queue = []
+        slots = self._slots
+        flags = self._flags
+        ready = []
+        for addr in queue:
+            slot = slots.get(addr)
+            if slot is not None and flags[slot] & QUEUED:
+                flags[slot] &= ~QUEUED
+                if flags[slot] & PENDING:
+                    ready.append(addr)
+        return ready
+
+    def queued(self):
+        return len(self._queue)
+
+    def pending_count(self):
+        count = 0
+        flags = self._flags
+        for slot in self._slots.values():
+            if flags[slot] & PENDING:
+                count += 1
+        return count
+
+    def addrs(self):
+        return list(self._slots)
+
+    # (sent, suppressed, duplicates) frames of a device
+    def counters(self, addr):
+        slot = self._slots.get(addr)
+        if slot is None:
+            return None
+        return self._sent[slot], self._suppressed[slot], self._duplicates[slot]
+
+    # Frame of a device as it is published: addr, rssi, timestamp, name, raw_data (hex, or bytes), data
+    def frame(self, addr, raw_hex=True):
+        slot = self._slots.get(addr)
+        if slot is None:
+            return None
+        frame = {'addr': addr_hex(addr), 'rssi': self._rssi[slot], 'timestamp': self._timestamp[slot]}
+        if self._name[slot]:
+            frame['name'] = self._name[slot]
+        raw = memoryview(self._adv[slot])[:self._adv_len[slot]]
+        frame['raw_data'] = adv_hex(raw) if raw_hex else bytes(raw)
+        if self._data[slot]:
+            frame['data'] = self._data[slot]
+        if self.aggregate:
+            summary = self.window(addr)
+            if summary:
+                frame['window'] = summary
+        return frame
+
+    def _release(self, addr):
+        slot = self._slots.pop(addr)
+        flags = self._flags[slot]
+        self._addr[slot] = None
+        self._data[slot] = None
+        self._name[slot] = None
+        if self.deadbands is not None:
+            self._last_data[slot] = None
+        self._flags[slot] = 0
+        if self.aggregate:
+            self._fields[slot] = None
+        self._free.append(slot)
+        return flags
+
+    def _evict(self):
+        now = ticks_ms()
+        seen = self._seen
+        flags = self._flags
+        # Other devices before sensors, the longest idle first
+        order = sorted((flags[slot] & SENSOR, -ticks_diff(now, seen[slot]), slot) for slot in self._slots.values())
+        for _, _, slot in order[:self._batch]:
+            released = self._release(self._addr[slot])
+            if released & PENDING:
+                self.stats['evicted_pending'] += 1
+            if released & SENSOR:
+                self.stats['evicted_sensors'] += 1
+            self.stats['evicted'] += 1
+
+    # Drops the devices idle for more than the TTL, at most every TTL / 8. Returns how many.
+    def expire(self, force=False):
+        now = ticks_ms()
+        if not force and ticks_diff(now, self._sweep) < self.ttl_ms // 8:
+            return 0
+        self._sweep = now
+        seen = self._seen
+        idle = [addr for addr, slot in self._slots.items() if ticks_diff(now, seen[slot]) > self.ttl_ms]
+        for addr in idle:
+            self._release(addr)
+        self.stats['expired'] += len(idle)
+        return len(idle)
@@ -0,0 +1,30 @@
+# Helpers shared by the ble_* modules: MicroPython's ticks_ms/ticks_diff and
+# asyncio.sleep_ms, with CPython stand-ins so the modules also run in the host tools,
+# and the aa:bb:cc:dd:ee:ff formatting of addresses.
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    sleep_ms = asyncio.sleep_ms
+except AttributeError:  # CPython
+
+    def sleep_ms(ms):
+        return asyncio.sleep(ms / 1000)
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+
+def addr_hex(addr):
+    return ':'.join('{:02x}'.format(b) for b in addr)
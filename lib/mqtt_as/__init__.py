@@ -30,9 +30,19 @@ VERSION = (0, 8, 2)
 # Default initial size for input messge buffer. Increase this if large messages
 # are expected, but rarely, to avoid big runtime allocations
 IBUFSIZE = 50
+# Initial size of the receive buffer of the broker socket. Every socket read takes all
+# that fits, so a burst of PUBACKs is read in a few calls. It grows to the largest
+# packet received.
+RBUFSIZE = 256
 # By default the callback interface returns and incoming message as bytes.
 # For performance reasons with large messages it may return a memoryview.
 MSG_BYTES = True
+# Initial size of the output buffer PUBLISH packets are built in. It grows to the
+# largest packet copied into it.
+OBUFSIZE = 256
+# Payloads from this size on are written from the caller's object instead of being
+# copied to the output buffer (a second socket write, but no copy).
+ZC_MIN = 512
 
 # Legitimate errors while waiting on a socket. See uasyncio __init__.py open_connection().
 ESP32 = platform == "esp32"
@@ -107,6 +117,7 @@ config = {
     "gateway": False,
     "mqttv5": False,
     "mqttv5_con_props": None,
+    "inflight": 1,
 }
 
 
@@ -121,6 +132,34 @@ def pid_gen():
         yield pid
 
 
+# A QoS 1 publish awaiting its PUBACK. The client retransmits it until acknowledged
+# (re-publishing after a reconnect); wait() returns True once acked, False if abandoned
+# by .disconnect(). ms is the time from first transmission to PUBACK.
+class Delivery:
+    def __init__(self, topic, msg, retain, properties):
+        self.topic = topic
+        self.msg = msg
+        self.retain = retain
+        self.properties = properties
+        self.pid = 0
+        self.t = None  # Last transmission, None until first written
+        self.t0 = None
+        self.count = 0  # Retransmissions
+        self.ok = None
+        self.ms = None
+        self._evt = asyncio.Event()
+
+    def done(self, ok):
+        self.ok = ok
+        if self.t0 is not None:  # Abandoned before it was written: no time
+            self.ms = ticks_diff(ticks_ms(), self.t0)
+        self._evt.set()
+
+    async def wait(self):
+        await self._evt.wait()
+        return self.ok
+
+
 def qos_check(qos):
     if not (qos == 0 or qos == 1):
         raise ValueError("Only qos 0 and 1 are supported.")
@@ -188,15 +227,24 @@ class MQTT_base:
             self._espnow.active(True)
 
         self.newpid = pid_gen()
-        self.rcv_pids = set()  # PUBACK and SUBACK pids awaiting ACK response
+        self.rcv_pids = {}  # pid: Event of SUBACK and UNSUBACK awaiting response
+        self._inflight = {}  # pid: Delivery of QoS 1 publishes awaiting PUBACK
+        self._window = max(config["inflight"], 1)  # QoS 1 publishes in flight at once
+        self._slot = asyncio.Event()  # Set when a window slot frees
         self.last_rx = ticks_ms()  # Time of last communication from broker
         self.lock = asyncio.Lock()
         self._ibuf = bytearray(IBUFSIZE)
         self._mvbuf = memoryview(self._ibuf)
+        self._rbuf = bytearray(RBUFSIZE)  # Received, unparsed data is _rbuf[_rstart:_rend]
+        self._rmv = memoryview(self._rbuf)
+        self._rstart = 0
+        self._rend = 0
+        self._obuf = bytearray(OBUFSIZE)  # Used under self.lock only
 
         self.mqttv5 = config.get("mqttv5")
         self.mqttv5_con_props = config.get("mqttv5_con_props")
         self.topic_alias_maximum = 0
+        self.receive_maximum = 0  # Broker's limit on QoS 1 publishes in flight (MQTTv5)
 
         if self.mqttv5:
             global encode_properties, decode_properties
@@ -218,9 +266,93 @@ class MQTT_base:
     def _timeout(self, t):
         return ticks_diff(ticks_ms(), t) > self._response_time
 
+    # Makes room in the receive buffer for need bytes from _rstart, and some free space
+    def _room(self, need):
+        start = self._rstart
+        avail = self._rend - start
+        if not avail:  # All parsed: start over at the front
+            start = self._rstart = self._rend = 0
+        size = len(self._rbuf)
+        if self._rend == size or start + need > size:
+            if avail <= start and need <= size:  # Move the data to the front, no overlap
+                self._rbuf[:avail] = self._rmv[start : self._rend]
+            else:  # Grow, it keeps the new size
+                rbuf = bytearray(max(size * 2, need + RBUFSIZE))
+                rbuf[:avail] = self._rmv[start : self._rend]
+                self._rbuf = rbuf
+                self._rmv = memoryview(rbuf)
+            self._rstart = 0
+            self._rend = avail
+
+    # Reads whatever the broker socket has into the receive buffer, after making room for
+    # need bytes. Returns the number of bytes read.
+    def _fill(self, need=1):
+        self._room(need)
+        try:
+            n = self._sock.readinto(self._rmv[self._rend :])
+        except OSError as e:  # ESP32 issues weird 119 errors here
+            n = None
+            if e.args[0] not in BUSY_ERRORS:
+                raise
+        if n == 0:  # Connection closed by host
+            raise OSError(-1, "Connection closed by host")
+        if n is None:
+            return 0
+        self._rend += n
+        self.last_rx = ticks_ms()
+        return n
+
+    # Sleeps until the broker socket is readable, then reads what it has into the receive
+    # buffer as _fill() does
+    async def _recv(self, stream, need):
+        self._room(need)
+        try:
+            n = await stream.readinto(self._rmv[self._rend :])
+        except OSError as e:  # ESP32 issues weird 119 errors here
+            n = None
+            if e.args[0] not in BUSY_ERRORS:
+                raise
+        if n == 0:  # Connection closed by host
+            raise OSError(-1, "Connection closed by host")
+        if n:
+            self._rend += n
+            self.last_rx = ticks_ms()
+
+    # Bytes the next packet takes from _rstart: its full length once the fixed header is
+    # buffered, else the header bytes buffered so far plus one
+    def _need(self):
+        rbuf = self._rbuf
+        start = self._rstart
+        i = start + 1
+        n = 0
+        sh = 0
+        while i < self._rend:
+            b = rbuf[i]
+            i += 1
+            n |= (b & 0x7F) << sh
+            if not b & 0x80:
+                return i - start + n
+            sh += 7
+        return i - start + 1
+
+    # Returns the next n bytes of the broker socket, from the receive buffer when they are
+    # there already: no socket call, no yield. The memoryview is valid until the next read.
     async def _as_read(self, n, sock=None):  # OSError caught by superclass
-        if sock is None:
-            sock = self._sock
+        if sock is not None:
+            return await self._sock_read(n, sock)
+        t = ticks_ms()
+        while self._rend - self._rstart < n:
+            if self._timeout(t) or not self.isconnected():
+                raise OSError(-1, "Timeout on socket read")
+            if self._fill(n):
+                t = ticks_ms()
+            else:
+                await asyncio.sleep_ms(0)
+        start = self._rstart
+        self._rstart = start + n
+        return self._rmv[start : start + n]
+
+    async def _sock_read(self, n, sock):  # Other sockets, e.g. the DNS check of wan_ok()
         # Ensure input buffer is big enough to hold data. It keeps the new size
         oflow = n - len(self._ibuf)
         if oflow > 0:  # Grow the buffer and re-create the memoryview
@@ -292,6 +424,7 @@ class MQTT_base:
         mqttv5 = self.mqttv5  # Cache local
         self._sock = socket.socket()
         self._sock.setblocking(False)
+        self._rstart = self._rend = 0
         try:
             self._sock.connect(self._addr)
         except OSError as e:
@@ -380,6 +513,7 @@ class MQTT_base:
             raise OSError(-1, "CONNACK reason code 0x%x" % connack_resp[1])
 
         del connack_resp
+        self.receive_maximum = 0
         if not mqttv5:
             # If we are not on MQTTv5 we can stop here
             return
@@ -390,6 +524,12 @@ class MQTT_base:
             decoded_props = decode_properties(connack_props, connack_props_length)
             self.dprint("CONNACK properties: %s", decoded_props)
             self.topic_alias_maximum = decoded_props.get(0x22, 0)
+            self.receive_maximum = decoded_props.get(0x21, 0)
+
+    # QoS 1 publishes allowed in flight: the configured window, capped by Receive Maximum
+    def window(self):
+        rm = self.receive_maximum
+        return min(self._window, rm) if rm else self._window
 
     async def _ping(self):
         async with self.lock:
@@ -448,6 +588,10 @@ class MQTT_base:
                 pass
             self._close()
         self._has_connected = False
+        for d in self._inflight.values():
+            d.done(False)
+        self._inflight.clear()
+        self._slot.set()
 
     def _close(self):
         if self._sock is not None:
@@ -461,44 +605,90 @@ class MQTT_base:
             self.dprint("Wi-Fi not started, unable to disconnect interface")
         self._sta_if.active(False)
 
+    # wait_msg() pops the pid and sets its event on the ACK. A connection failure sets it
+    # too, leaving the pid in place: it is popped here after a failure or a timeout.
     async def _await_pid(self, pid):
-        t = ticks_ms()
-        while pid in self.rcv_pids:  # local copy
-            if self._timeout(t) or not self.isconnected():
-                break  # Must repub or bail out
-            await asyncio.sleep_ms(100)
-        else:
+        evt = self.rcv_pids.get(pid)
+        if evt is None:
             return True  # PID received. All done.
-        return False
-
-    # qos == 1: coro blocks until wait_msg gets correct PID.
-    # If WiFi fails completely subclass re-publishes with new PID.
-    async def publish(self, topic, msg, retain, qos, properties=None):
-        pid = next(self.newpid)
-        if qos:
-            self.rcv_pids.add(pid)
-        async with self.lock:
-            await self._publish(topic, msg, retain, qos, 0, pid, properties)
+        try:
+            await asyncio.wait_for_ms(evt.wait(), self._response_time)
+        except asyncio.TimeoutError:
+            pass
+        return self.rcv_pids.pop(pid, None) is None
+
+    # qos == 1: up to .window() publishes are in flight, further ones wait for a slot.
+    # With wait the coro returns once the PUBACK arrived, otherwise as soon as the message
+    # is written, returning its Delivery. Unacked messages are retransmitted by ._repub().
+    async def publish(self, topic, msg, retain, qos, properties=None, wait=True):
+        # _publish() copies topic and msg into a bytearray, which only takes buffers
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
         if qos == 0:
+            async with self.lock:
+                await self._publish(topic, msg, retain, qos, 0, next(self.newpid), properties)
             return
-
-        count = 0
-        while 1:  # Await PUBACK, republish on timeout
-            if await self._await_pid(pid):
-                return
-            # No match
-            if count >= self._max_repubs or not self.isconnected():
-                raise OSError(-1)  # Subclass to re-publish with new PID
+        while len(self._inflight) >= self.window():
+            self._slot.clear()
+            await self._slot.wait()
+        d = Delivery(topic, msg, retain, properties)
+        d.pid = next(self.newpid)
+        self._inflight[d.pid] = d
+        try:
             async with self.lock:
-                # Add pid
-                await self._publish(topic, msg, retain, qos, dup=1, pid=pid, properties=properties)
-            count += 1
-            self.REPUB_COUNT += 1
+                d.t = d.t0 = ticks_ms()
+                await self._publish(topic, msg, retain, qos, 0, d.pid, properties)
+        except:  # OSError: caller re-publishes after reconnect. Any error frees the slot.
+            self._inflight.pop(d.pid, None)
+            self._slot.set()
+            raise
+        if not wait:
+            return d
+        if not await d.wait():
+            raise OSError(-1)
 
+    # Retransmits (dup) publishes whose PUBACK is overdue, sleeping until the next one is due.
+    # After max_repubs the connection is presumed dead: reconnect and re-publish with new PIDs.
+    # Runs until connectivity fails.
+    async def _repub(self):
+        for d in list(self._inflight.values()):  # Unacked before a reconnect
+            if d.t is None or self._inflight.pop(d.pid, None) is None:  # publish() sends it / acked
+                continue
+            d.pid = next(self.newpid)
+            d.count = 0
+            self._inflight[d.pid] = d
+            async with self.lock:
+                await self._publish(d.topic, d.msg, d.retain, 1, 0, d.pid, d.properties)
+            d.t = ticks_ms()
+        while self.isconnected():
+            due = self._response_time
+            for d in list(self._inflight.values()):
+                if d.t is None:
+                    continue
+                left = self._response_time - ticks_diff(ticks_ms(), d.t)
+                if left > 0:
+                    due = min(due, left)
+                    continue
+                if d.pid not in self._inflight:  # Acked meanwhile
+                    continue
+                if d.count >= self._max_repubs:
+                    return
+                async with self.lock:
+                    await self._publish(d.topic, d.msg, d.retain, 1, 1, d.pid, d.properties)
+                d.t = ticks_ms()
+                d.count += 1
+                self.REPUB_COUNT += 1
+            await asyncio.sleep_ms(due)
+
+    # The packet is built in the output buffer and sent in one write, so it leaves in as
+    # few TCP segments as possible. Payloads of ZC_MIN bytes or more follow in a second
+    # write straight from msg.
     async def _publish(self, topic, msg, retain, qos, dup, pid, properties=None):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain | dup << 3
-        sz = 2 + len(topic) + len(msg)
+        tlen = len(topic)
+        mlen = len(msg)
+        sz = 2 + tlen + mlen
         if qos > 0:
             sz += 2
 
@@ -508,41 +698,60 @@ class MQTT_base:
 
         if sz >= 2097152:
             raise MQTTException("Strings too long.")
+        copy = mlen < ZC_MIN
+        n = 5 + sz - (0 if copy else mlen)  # Fixed header is at most 5 bytes
+        oflow = n - len(self._obuf)
+        if oflow > 0:  # Grow the buffer, it keeps the new size
+            self._obuf.extend(bytearray(oflow + 50))
+        pkt = self._obuf
+        pkt[0] = 0x30 | qos << 1 | retain | dup << 3
         i = 1
         while sz > 0x7F:
             pkt[i] = (sz & 0x7F) | 0x80
             sz >>= 7
             i += 1
         pkt[i] = sz
-        await self._as_write(pkt, i + 1)
-        await self._send_str(topic)
+        struct.pack_into("!H", pkt, i + 1, tlen)
+        i += 3
+        pkt[i : i + tlen] = topic
+        i += tlen
         if qos > 0:
-            struct.pack_into("!H", pkt, 0, pid)
-            await self._as_write(pkt, 2)
+            struct.pack_into("!H", pkt, i, pid)
+            i += 2
         if self.mqttv5:
-            await self._as_write(properties)
-        await self._as_write(msg)
+            pkt[i : i + len(properties)] = properties
+            i += len(properties)
+        if copy:
+            pkt[i : i + mlen] = msg
+            i += mlen
+        await self._as_write(pkt, i)
+        if not copy:
+            await self._as_write(msg)
 
     # Can raise OSError if WiFi fails. Subclass traps.
     async def subscribe(self, topic, qos, properties=None):
         pkt = bytearray(b"\x82\0\0\0")
         pid = next(self.newpid)
-        self.rcv_pids.add(pid)
+        self.rcv_pids[pid] = asyncio.Event()
         sz = 2 + 2 + len(topic) + 1
         if self.mqttv5:
             properties = encode_properties(properties)
             sz += len(properties)
 
         struct.pack_into("!BH", pkt, 1, sz, pid)
-        async with self.lock:
-            await self._as_write(pkt)
-            if self.mqttv5:
-                await self._as_write(properties)
-            await self._send_str(topic)
-            # Only QoS is supported other features such as:
-            # (NL) No Local, (RAP) Retain As Published and Retain Handling.
-            # Are not supported.
-            await self._as_write(qos.to_bytes(1, "little"))
+        try:
+            async with self.lock:
+                await self._as_write(pkt)
+                if self.mqttv5:
+                    await self._as_write(properties)
+                await self._send_str(topic)
+                # Only QoS is supported other features such as:
+                # (NL) No Local, (RAP) Retain As Published and Retain Handling.
+                # Are not supported.
+                await self._as_write(qos.to_bytes(1, "little"))
+        except:
+            self.rcv_pids.pop(pid, None)
+            raise
 
         if not await self._await_pid(pid):
             raise OSError(-1)
@@ -551,18 +760,22 @@ class MQTT_base:
     async def unsubscribe(self, topic, properties=None):
         pkt = bytearray(b"\xa2\0\0\0")
         pid = next(self.newpid)
-        self.rcv_pids.add(pid)
+        self.rcv_pids[pid] = asyncio.Event()
         sz = 2 + 2 + len(topic)
         if self.mqttv5:
             properties = encode_properties(properties)
             sz += len(properties)
 
-        struct.pack_into("!BH", pkt, sz, pid)
-        async with self.lock:
-            await self._as_write(pkt)
-            if self.mqttv5:
-                await self._as_write(properties)
-            await self._send_str(topic)
+        struct.pack_into("!BH", pkt, 1, sz, pid)
+        try:
+            async with self.lock:
+                await self._as_write(pkt)
+                if self.mqttv5:
+                    await self._as_write(properties)
+                await self._send_str(topic)
+        except:
+            self.rcv_pids.pop(pid, None)
+            raise
 
         if not await self._await_pid(pid):
             raise OSError(-1)
@@ -574,23 +787,14 @@ class MQTT_base:
     # Immediate return if no data available. Called from ._handle_msg().
     async def wait_msg(self):
         mqttv5 = self.mqttv5  # Cache local
-        try:
-            res = self._sock.read(1)  # Throws OSError on WiFi fail
-        except OSError as e:
-            if e.args[0] in BUSY_ERRORS:  # Needed by RP2
-                await asyncio.sleep_ms(0)
-                return
-            raise
-
-        if res is None:
+        # Throws OSError on WiFi fail
+        if self._rstart == self._rend and not self._fill():
             return
-        if res == b"":
-            raise OSError(-1, "Empty response")
 
-        if res == b"\xd0":  # PINGRESP
-            await self._as_read(1)  # Update .last_rx time
+        op = (await self._as_read(1))[0]
+        if op == 0xD0:  # PINGRESP
+            await self._as_read(1)  # Remaining length, 0
             return
-        op = res[0]
 
         if op == 0x40:  # PUBACK: save pid
             sz, _ = await self._recv_len()
@@ -610,10 +814,11 @@ class MQTT_base:
                     puback_props = await self._as_read(puback_props_sz)
                     decoded_props = decode_properties(puback_props, puback_props_sz)
                     self.dprint("PUBACK properties %s", decoded_props)
-            if pid in self.rcv_pids:
-                self.rcv_pids.discard(pid)
-            else:
+            d = self._inflight.pop(pid, None)
+            if d is None:
                 raise OSError(-1, "Invalid pid in PUBACK packet")
+            d.done(True)
+            self._slot.set()
 
         if op == 0x90:  # SUBACK
             sz, _ = await self._recv_len()
@@ -638,10 +843,39 @@ class MQTT_base:
             if reason_code >= 0x80:
                 raise OSError(-1, "SUBACK reason code 0x%x" % reason_code)
 
-            if pid in self.rcv_pids:
-                self.rcv_pids.discard(pid)
-            else:
+            evt = self.rcv_pids.pop(pid, None)
+            if evt is None:
                 raise OSError(-1, "Invalid pid in SUBACK packet")
+            evt.set()
+
+        if op == 0xB0:  # UNSUBACK
+            sz, _ = await self._recv_len()
+            rcv_pid = await self._as_read(2)
+            sz -= 2
+            pid = rcv_pid[0] << 8 | rcv_pid[1]
+            # MQTTv5: properties and a reason code, MQTT 3.1.1 only has the pid
+            if mqttv5:
+                unsuback_props_sz, sz_len = await self._recv_len()
+                sz -= sz_len
+                sz -= unsuback_props_sz
+                if unsuback_props_sz > 0:
+                    unsuback_props = await self._as_read(unsuback_props_sz)
+                    decoded_props = decode_properties(unsuback_props, unsuback_props_sz)
+                    self.dprint("UNSUBACK properties %s", decoded_props)
+
+            if sz > 1:
+                raise OSError(-1, "Got too many bytes")
+
+            if sz:
+                reason_code = await self._as_read(sz)
+                reason_code = reason_code[0]
+                if reason_code >= 0x80:
+                    raise OSError(-1, "UNSUBACK reason code 0x%x" % reason_code)
+
+            evt = self.rcv_pids.pop(pid, None)
+            if evt is None:
+                raise OSError(-1, "Invalid pid in UNSUBACK packet")
+            evt.set()
 
         if op == 0xE0:  # DISCONNECT
             if mqttv5:
@@ -827,8 +1061,10 @@ class MQTTClient(MQTT_base):
             asyncio.create_task(self._keep_connected())
             # Runs forever unless user issues .disconnect()
 
-        asyncio.create_task(self._handle_msg())  # Task quits on connection fail.
+        # Task quits on connection fail, it is cancelled if waiting on the socket then
+        self._tasks.append(asyncio.create_task(self._handle_msg()))
         self._tasks.append(asyncio.create_task(self._keep_alive()))
+        self._tasks.append(asyncio.create_task(self._retransmit()))
         if self.DEBUG:
             self._tasks.append(asyncio.create_task(self._memory()))
         if self._events:
@@ -836,13 +1072,18 @@ class MQTTClient(MQTT_base):
         else:
             asyncio.create_task(self._connect_handler(self))  # User handler.
 
-    # Launched by .connect(). Runs until connectivity fails. Checks for and
-    # handles incoming messages.
+    # Launched by .connect(). Runs until connectivity fails. Sleeps until the socket is
+    # readable and takes the lock only to handle a packet that is fully received.
     async def _handle_msg(self):
         try:
+            stream = asyncio.StreamReader(self._sock)
             while self.isconnected():
+                need = self._need()
+                if self._rend - self._rstart < need:
+                    await self._recv(stream, need)
+                    continue
                 async with self.lock:
-                    await self.wait_msg()  # Immediate return if no message
+                    await self.wait_msg()  # Parses from the receive buffer
                 await asyncio.sleep_ms(0)  # Let other tasks get lock
 
         except OSError:
@@ -864,6 +1105,15 @@ class MQTTClient(MQTT_base):
                 break
         self._reconnect()  # Broker or WiFi fail.
 
+    # Retransmits overdue publishes. Runs until connectivity fails or a message runs
+    # out of republishes.
+    async def _retransmit(self):
+        try:
+            await self._repub()
+        except OSError:
+            pass
+        self._reconnect()  # Broker or WiFi fail.
+
     async def _kill_tasks(self, kill_skt):  # Cancel running tasks
         for task in self._tasks:
             task.cancel()
@@ -890,6 +1140,8 @@ class MQTTClient(MQTT_base):
     def _reconnect(self):  # Schedule a reconnection if not underway.
         if self._isconnected:
             self._isconnected = False
+            for evt in self.rcv_pids.values():  # Fail pending subscribes at once
+                evt.set()
             asyncio.create_task(self._kill_tasks(True))  # Shut down tasks and socket
             if self._events:  # Signal an outage
                 self.down.set()
@@ -952,12 +1204,12 @@ class MQTTClient(MQTT_base):
                 pass
             self._reconnect()  # Broker or WiFi fail.
 
-    async def publish(self, topic, msg, retain=False, qos=0, properties=None):
+    async def publish(self, topic, msg, retain=False, qos=0, properties=None, wait=True):
         qos_check(qos)
         while 1:
             await self._connection()
             try:
-                return await super().publish(topic, msg, retain, qos, properties)
+                return await super().publish(topic, msg, retain, qos, properties, wait)
             except OSError:
                 pass
             self._reconnect()  # Broker or WiFi fail.
@@ -32,6 +32,18 @@ class OTAUpdater:
             with open('version.json', 'w') as f:
                 json.dump({'version': self.current_version}, f)
 
+    def temp_name(self, filename):
+        """ Name of the download file, next to the target one. Creates its directory if missing."""
+
+        path, _, name = filename.rpartition('/')
+        if not path:
+            return f'_{name}'
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass
+        return f'{path}/_{name}'
+
     def fetch_new_code(self, filename):
         """ Fetch the code from the repo, returns False if not found."""
     
@@ -43,9 +55,10 @@ class OTAUpdater:
     
             # Save the fetched code to file (with prepended '_')
             new_code = response.text
-            with open(f'_{filename}', 'w') as f:
+            newfile = self.temp_name(filename)
+            with open(newfile, 'w') as f:
                 f.write(new_code)
-            print(f'Saved as _{filename}')
+            print(f'Saved as {newfile}')
             return True
         
         elif response.status_code == 404:
@@ -84,9 +97,9 @@ class OTAUpdater:
 
             # Overwrite current code with new
             for filename in self.filename_list:
-                newfile = f"_{filename}"
+                newfile = self.temp_name(filename)
                 os.rename(newfile, filename)
-                print(f'Renamed _{filename} to {filename}, overwriting existing file')
+                print(f'Renamed {newfile} to {filename}, overwriting existing file')
 
             # save the current version
             with open('version.json', 'w') as f:
@@ -1,15 +1,21 @@
 import aioble
 import json
 from mqtt_as import MQTTClient, config
-import struct
 import uasyncio as asyncio
 import ntptime
 from machine import WDT, soft_reset
-from ble_decoder import decode_ble
+from ble_decoder import decode_cached, is_duplicate, affinity_stats
+from ble_scan import Scanner, ScanStats, DutyCycle
+from ble_filter import AddrFilter
+from ble_store import DeviceStore
+from ble_util import addr_hex
+from ble_publish import groups
+from ble_codec import get_codec
 from ota import OTAUpdater
 from sys import exit
 import socket
 import time
+import os
 
 # Config file
 try:
@@ -27,6 +33,30 @@ config['port'] = params['port']
 config['user'] = params['user']
 config['password'] = params['password']
 config["queue_len"] = 1
+# QoS 1 publishes awaiting their PUBACK at once (capped by the broker's MQTTv5 Receive Maximum)
+config['inflight'] = params.get('inflight', 1)
+
+# Bindkeys of devices with encrypted advertising, from params.json and/or /bindkeys.json
+bindkeys = params.get('bindkeys', {})
+try:
+    with open('/bindkeys.json', 'rb') as f:
+        bindkeys.update(json.load(f))
+except OSError:
+    pass
+if bindkeys:
+    from ble_crypto import load_keys
+    load_keys(bindkeys)
+
+# Address allow/deny lists, from params.json "filter" and/or /filter.json: {"allow": [...], "deny": [...]}
+# Entries are full addresses or OUI prefixes, they can be changed at runtime from the webpage (/filter)
+filter_config = params.get('filter', {})
+try:
+    with open('/filter.json', 'rb') as f:
+        for kind, entries in json.load(f).items():
+            filter_config[kind] = filter_config.get(kind, []) + entries
+except OSError:
+    pass
+addr_filter = AddrFilter(filter_config)
 
 # (Optional) Enable SSL/TLS support for the MQTT client
 # import ssl
@@ -40,9 +70,31 @@ config["queue_len"] = 1
 # config['ssl_params'] = {'server_hostname': 'mqtt.internal.local', 'cadata': cacert, 'cert_reqs': ssl.CERT_REQUIRED}
 
 # Globals
-frame_dict = {}
+# Last frame of every device until published, bounded ("store_capacity" devices, dropped after "store_ttl" s idle)
+# With "aggregate_window" (s) set, one summary per device and window is published instead of every frame
+aggregate_ms = params.get('aggregate_window', 0) * 1000
+# (Optional) "batch": {"topic", "max_count", "max_bytes"} publishes pending devices in batches on one topic
+batch = params.get('batch')
+# Payload encoding: "json" (default), "cbor" or "binary", see ble_codec.py
+codec = get_codec(params.get('codec', 'json'))
+
+# With "deadband" ({field: band}) set, decoded frames are only published when a field moved by its band,
+# or every "heartbeat" s
+# The store sets publish_ready whenever a device becomes pending, main() sleeps on it
+publish_ready = asyncio.Event()
+device_store = DeviceStore(params.get('store_capacity', 256), params.get('store_ttl', 600),
+                           aggregate=bool(aggregate_ms), ewma_alpha=params.get('ewma_alpha', 0.2),
+                           deadbands=params.get('deadband'), heartbeat_s=params.get('heartbeat', 300),
+                           on_pending=publish_ready.set)
+# Longest sleep of the publisher with nothing to do (watchdog feed, store expiry)
+IDLE_MS = 2000
 log_list = []
 start_time = 0
+recorder = None
+scan_stats = ScanStats()
+active_scan = False
+# Scan window/interval, adapted at runtime unless "adaptive_scan" is false. "scan_duty" holds DutyCycle settings
+duty = DutyCycle(scan_stats, log=lambda msg: logging(msg, 'DutyCycle'), **params.get('scan_duty', {}))
 
 # Logging (50 rows max)
 def logging(_str, func_name='unknown', severity='INFO', _print=True):
@@ -57,7 +109,7 @@ def logging(_str, func_name='unknown', severity='INFO', _print=True):
 
 # HTML template for the webpage
 async def webpage(request, writer, *_values):
-    global frame_dict
+    global device_store
     global log_list
     global start_time
 
@@ -87,7 +139,7 @@ async def webpage(request, writer, *_values):
         writer.write(str(f"""
                     <div>
                         <p><a href="/">Back</a></p>
-                        <h1>List of devices pending to send (Total seen: {len(list(frame_dict.keys()))})</h1>
+                        <h1>List of devices pending to send (Total seen: {len(device_store)})</h1>
                         <table>
                             <thead>
                                 <tr>
@@ -100,7 +152,8 @@ async def webpage(request, writer, *_values):
                             </thead>
                             <tbody>"""))
 
-        for curr_addr, curr_frame in frame_dict.items():
+        for curr_addr in device_store.pending():
+            curr_frame = device_store.frame(curr_addr)
             if curr_frame:
                 curr_data = {}
                 if 'data' in curr_frame.keys():
@@ -108,7 +161,7 @@ async def webpage(request, writer, *_values):
 
                 writer.write(str(f"""   
                                 <tr>
-                                    <td>{curr_addr}</td>
+                                    <td>{curr_frame['addr']}</td>
                                     <td>{curr_frame['rssi']}</td>
                                     <td>{curr_frame['raw_data']}</td>
                                     <td>{json.dumps(curr_data)}</td>
@@ -132,6 +185,50 @@ async def webpage(request, writer, *_values):
 
         writer.write(str(f"""</div>"""))
 
+    elif request == '/devices':
+        writer.write(str(f"""
+                    <div>
+                        <p><a href="/">Back</a></p>
+                        <h1>Devices ({len(device_store)})</h1>
+                        <table>
+                            <thead>
+                                <tr>
+                                    <th>addr</th>
+                                    <th>name</th>
+                                    <th>sent</th>
+                                    <th>suppressed</th>
+                                    <th>duplicates</th>
+                                </tr>
+                            </thead>
+                            <tbody>"""))
+
+        for curr_addr in device_store.addrs():
+            curr_counters = device_store.counters(curr_addr)
+            if curr_counters:
+                writer.write(str(f"""
+                                <tr>
+                                    <td>{addr_hex(curr_addr)}</td>
+                                    <td>{device_store.name(curr_addr) or ''}</td>
+                                    <td>{curr_counters[0]}</td>
+                                    <td>{curr_counters[1]}</td>
+                                    <td>{curr_counters[2]}</td>
+                                <tr>"""))
+                await writer.drain()
+
+        writer.write(str(f"""</tbody>
+                        </table>
+                    </div>"""))
+
+    elif request.startswith('/filter'):
+        writer.write(str(f"""
+                    <div>
+                        <p><a href="/">Back</a></p>
+                        <h1>Address filter</h1>
+                        <p>Dropped frames: {json.dumps(addr_filter.stats)}</p>
+                        <p>{json.dumps(addr_filter.as_dict())}</p>
+                        <p>Change with /filter/allow/&lt;addr or OUI&gt;, /filter/deny/... and /filter/remove/...</p>
+                    </div>"""))
+
     elif request == '/reset':
         writer.write(str(f"""
                     <div>
@@ -141,15 +238,17 @@ async def webpage(request, writer, *_values):
 
     # Default page
     else:
-        pending_total = 0
-        for curr_addr, curr_frame in frame_dict.items():
-            if curr_frame:
-                pending_total += 1
+        pending_total = device_store.pending_count()
 
         writer.write(str(f"""
                     <div>
-                        <p>Total devices seen by PicoW: {len(list(frame_dict.keys()))} <a href="/pending">Pending list ({pending_total})</a></p>
+                        <p>Total devices seen by PicoW: {len(device_store)} <a href="/devices">Devices</a> <a href="/pending">Pending list ({pending_total})</a></p>
+                        <p>Device table: capacity {device_store.capacity}, {json.dumps(device_store.stats)}</p>
                         <p>{len(log_list)} lines saved in log <a href="/log">See logs</a></p>
+                        <p>Address filter: {json.dumps(addr_filter.stats)} <a href="/filter">See filter</a></p>
+                        <p>Decoder affinity: {json.dumps(affinity_stats)}</p>
+                        <p>Scan: {json.dumps(scan_stats.as_dict())}</p>
+                        <p>Scan duty cycle: {json.dumps(duty.as_dict())}</p>
                     </div>"""))
 
     writer.write(str(f"""
@@ -174,6 +273,21 @@ async def handle_client(reader, writer):
     if request == '/reset_confirm':
         soft_reset()
 
+    # Filter changes: /filter/<allow|deny|remove>/<addr or OUI>
+    if request.startswith('/filter/'):
+        try:
+            _, _, action, entry = request.split('/', 3)
+            if action == 'remove':
+                addr_filter.remove(entry)
+                logging(f'Filter {action} {entry}', 'handle_client()')
+            elif action in ('allow', 'deny'):
+                addr_filter.add(action, entry)
+                logging(f'Filter {action} {entry}', 'handle_client()')
+            else:
+                logging(f'Unknown filter action {action}', 'handle_client()', 'ERROR')
+        except Exception as e:
+            logging(e, 'handle_client()', 'ERROR')
+
     # Generate HTML response and send the response
     await webpage(request, writer)  
 
@@ -188,34 +302,106 @@ async def up(client):
         await client.up.wait()  # Wait on an Event
         client.up.clear()
 
-# Get BLE frames from scanner
-async def get_ble_adv():
-    global frame_dict
-    while True:
-        try:
-            async with aioble.scan(1000, interval_us=30000, window_us=30000) as scanner:
-                async for result in scanner:
-                    # ['__class__', '__init__', '__module__', '__qualname__', '__str__', '__dict__', 'adv_data', 'connectable', 'name',
-                    #  'resp_data', 'rssi', '_decode_field', '_update', 'device', 'manufacturer', 'services']
-                    if result.adv_data:
-                        raw_adv = ''.join('%02x' % struct.unpack("B", bytes([x]))[0] for x in result.adv_data)
-                        dec_adv = decode_ble(raw_adv)
-                        
-                        dict_result = {}
-                        dict_result['addr'] = result.device.addr_hex()
-                        dict_result['rssi'] = result.rssi
-                        dict_result['timestamp'] = time.time()
-
-                        if result.name():
-                            dict_result['name'] = result.name()
-                        dict_result['raw_data'] = raw_adv
-                        if dec_adv:
-                            dict_result['data'] = dec_adv
-
-                        frame_dict[result.device.addr_hex()] = dict_result
+# (Optional) Record every received frame to flash, see ble_capture.py for the format
+def open_recorder():
+    global params
+    if not params.get('capture_file'):
+        return None
+    from ble_capture import Recorder
+    path = params['capture_file']
+    try:
+        new_file = os.stat(path)[6] == 0
+    except OSError:
+        new_file = True
+    logging(f'Recording frames to {path}', 'open_recorder()')
+    return Recorder(open(path, 'ab'), params.get('capture_batch', 2048), params.get('capture_limit', 0), new_file)
+
+# Frames source: the BLE scanner (continuous, duration 0), or a capture being replayed for load tests
+def scan_source():
+    global params
+    global duty
+    global active_scan
+    if params.get('replay_file'):
+        from ble_capture import ReplayScan
+        return ReplayScan(params['replay_file'], params.get('replay_speed', 1))
+    return aioble.scan(0, interval_us=duty.interval_us, window_us=duty.window_us, active=active_scan)
+
+# Process one BLE frame from the scanner
+def handle_adv(result):
+    global device_store
+    global recorder
+    global scan_stats
+    try:
+        # Unwanted addresses (phones, wearables...) are dropped before any other work
+        if not addr_filter.check(result.device.addr):
+            return
+
+        # ['__class__', '__init__', '__module__', '__qualname__', '__str__', '__dict__', 'adv_data', 'connectable', 'name',
+        #  'resp_data', 'rssi', '_decode_field', '_update', 'device', 'manufacturer', 'services']
+        if recorder and result.adv_data:
+            recorder.record(result.device.addr_type, result.device.addr, result.rssi, result.adv_data)
+
+        if result.adv_data:
+            # Keep the raw bytes, the hex string is only built at publish/display time
+            raw_adv = result.adv_data
+
+            # Same counter as the last decoded frame: a repeated measurement. Or the scan response of the
+            # last frame, aioble yields the result again when only resp_data changed: it may carry the name
+            if is_duplicate(result.device.addr, raw_adv):
+                if result.resp_data and device_store.wants_name(result.device.addr):
+                    device_store.set_name(result.device.addr, result.name())
+                device_store.touch(result.device.addr, result.rssi)
+                return
+            scan_stats.new += 1
+
+            dec_adv = decode_cached(result.device.addr, raw_adv)
+
+            # Names are cached per device, only resolved until found (or when a scan response came in)
+            name = None
+            if result.resp_data or device_store.wants_name(result.device.addr):
+                name = result.name()
+
+            # Updated in place in the device's slot, the JSON payload is built when publishing
+            device_store.put(result.device.addr, result.rssi, time.time(), raw_adv, dec_adv, name)
 
-        except Exception as e:
-            logging(e, 'get_ble_adv()', 'ERROR')
+    except Exception as e:
+        logging(e, 'handle_adv()', 'ERROR')
+
+# (Optional) Every "name_scan_interval" s, scan actively for "name_scan_ms" while some sensors have no name yet.
+# Active scanning asks every device for a scan response, where most names are, so it is kept short
+async def name_scan(scanner):
+    global active_scan
+    global device_store
+    while True:
+        await asyncio.sleep(params['name_scan_interval'])
+        unnamed = device_store.unnamed_sensors()
+        if unnamed:
+            logging(f'Active scan for {unnamed} sensors without name', 'name_scan()')
+            device_store.retry_names()
+            active_scan = True
+            await scanner.restart()
+            await asyncio.sleep_ms(params.get('name_scan_ms', 5000))
+            active_scan = False
+            await scanner.restart()
+
+# Get BLE frames from scanner. The scan runs in sessions of "scan_session" s or "scan_session_devices" addresses,
+# which bound aioble's per-scan device set and let it report static devices again. Restarted at once, or on error
+async def get_ble_adv():
+    global recorder
+    global scan_stats
+    global duty
+    recorder = open_recorder()
+    # A replay starts over from the beginning of the capture on every restart: no sessions, duty cycle or name scans
+    replay = bool(params.get('replay_file'))
+    session_ms = 0 if replay else params.get('scan_session', 60) * 1000
+    session_devices = 0 if replay else params.get('scan_session_devices', 128)
+    scanner = Scanner(scan_source, scan_stats, session_ms=session_ms, session_devices=session_devices,
+                      log=lambda msg: logging(msg, 'get_ble_adv()', 'ERROR'))
+    if params.get('adaptive_scan', True) and not replay:
+        asyncio.create_task(duty.run(scanner))
+    if params.get('name_scan_interval') and not replay:
+        asyncio.create_task(name_scan(scanner))
+    await scanner.run(handle_adv)
 
 # Network starting and OTA update
 async def init(client):
@@ -228,12 +414,66 @@ async def init(client):
     ntptime.settime()
     logging("Checking for OTA Update", 'init()')
     firmware_url = f"https://github.com/{params['GitHub_username']}/{params['repo_name']}/{params['branch']}/"
-    ota_updater = OTAUpdater(firmware_url, 'main.py', 'ble_decoder.py')
+    ota_updater = OTAUpdater(firmware_url, 'main.py', 'ble_decoder.py', 'ble_crypto.py', 'ble_capture.py', 'ble_scan.py',
+                             'ble_filter.py', 'ble_store.py', 'ble_publish.py', 'ble_codec.py', 'ble_util.py',
+                             'ble_formats/__init__.py', 'ble_formats/bthome.py', 'ble_formats/mibeacon.py',
+                             'ble_formats/ruuvi.py', 'ble_formats/govee.py', 'ble_formats/ibeacon.py',
+                             'lib/mqtt_as/__init__.py')
     ota_updater.download_and_install_update_if_available()
 
+# Waits for the PUBACKs of publishes sent without waiting, marking their devices published. The aggregation
+# window of a device only starts over once its summary was acked: a failed publish is retried with it
+async def acked(deliveries):
+    global device_store
+    global duty
+    for delivery, addrs in deliveries:
+        if await delivery.wait():
+            duty.published(delivery.ms)
+            for curr_addr, curr_version in addrs:
+                device_store.published(curr_addr, curr_version)
+                device_store.close_window(curr_addr)
+        else:
+            for curr_addr, _ in addrs:
+                device_store.retry(curr_addr)
+
+# One message per device, on its own topic
+async def publish_devices(client, pending):
+    global device_store
+    deliveries = []
+    for curr_addr in pending:
+        curr_version = device_store.version(curr_addr)
+        curr_result = device_store.frame(curr_addr, codec.raw_hex)
+        if curr_version is not None and curr_result:
+            # Send to MQTT Broker, up to the in-flight window ahead of the PUBACKs
+            delivery = await client.publish(f'ble_{curr_result["addr"]}/', codec.encode(curr_result), qos = 1, wait = False)
+            deliveries.append((delivery, ((curr_addr, curr_version),)))
+
+            # Print to console
+            #print(curr_result)
+    await acked(deliveries)
+
+# All pending devices in arrays on the gateway topic, as few messages as the size and count caps allow
+async def publish_batches(client, pending):
+    global device_store
+    items = []
+    for curr_addr in pending:
+        curr_version = device_store.version(curr_addr)
+        curr_result = device_store.frame(curr_addr, codec.raw_hex)
+        if curr_version is not None and curr_result:
+            items.append(((curr_addr, curr_version), codec.encode(curr_result)))
+    del pending
+
+    deliveries = []
+    for curr_group in groups(items, batch.get('max_count', 50), batch.get('max_bytes', 4096)):
+        delivery = await client.publish(batch.get('topic', 'ble_gateway/'), codec.array([p for _, p in curr_group]), qos = 1, wait = False)
+        deliveries.append((delivery, [key for key, _ in curr_group]))
+    await acked(deliveries)
+
 # MQTT client and local Webserver
 async def main(client):
-    global frame_dict
+    global device_store
+    global duty
+    global recorder
 
     # Connect to MQTT
     logging("Connecting to MQTT", 'main()')
@@ -256,24 +496,54 @@ async def main(client):
     # Watchdog timer
     wdt = WDT(timeout=8388)
 
+    window_start = time.ticks_ms()
+    # Recorded frames reach the flash at least every "capture_flush" s, not only when the buffer fills
+    flush_ms = params.get('capture_flush', 30) * 1000
+    flush_start = time.ticks_ms()
     while True:
+        pending = []
         try:
-            for curr_addr, curr_result in frame_dict.items():
-                if curr_result:
-                    # Send to MQTT Broker
-                    await client.publish(f'ble_{curr_addr}/', json.dumps(curr_result), qos = 1)
-                    
-                    # Print to console
-                    #print(json.dumps(curr_result))
-
-                    # Set device frame data to None
-                    frame_dict[curr_addr] = None
+            device_store.expire()
+            if aggregate_ms:
+                # Summaries are due at the end of the window
+                wait_ms = aggregate_ms - time.ticks_diff(time.ticks_ms(), window_start)
+                if wait_ms > 0:
+                    await asyncio.sleep_ms(min(wait_ms, IDLE_MS))
+                else:
+                    window_start = time.ticks_ms()
+                    pending = device_store.drain()
+            else:
+                # Sleep until the scanner queues a pending device
+                if not device_store.queued():
+                    publish_ready.clear()
+                    try:
+                        await asyncio.wait_for_ms(publish_ready.wait(), IDLE_MS)
+                    except asyncio.TimeoutError:
+                        pass
+                pending = device_store.drain()
+            # Backlog and publish times drive the scan duty cycle
+            duty.publish_begin(len(pending))
+            if pending:
+                if batch:
+                    await publish_batches(client, pending)
+                else:
+                    await publish_devices(client, pending)
 
         except Exception as e:
             logging(e, 'main()', 'ERROR')
+            # Left pending, tried again after a pause
+            for curr_addr in pending:
+                device_store.retry(curr_addr)
+            await asyncio.sleep(0.5)
+        duty.publish_end()
         
         wdt.feed()
-        await asyncio.sleep(0.5)
+        if recorder and time.ticks_diff(time.ticks_ms(), flush_start) >= flush_ms:
+            flush_start = time.ticks_ms()
+            try:
+                recorder.flush()
+            except Exception as e:
+                logging(e, 'main()', 'ERROR')
 
 # MAIN #
 if __name__ == "__main__":
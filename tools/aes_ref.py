@@ -0,0 +1,76 @@
+# aes_ref.py Pure Python AES block encryption (FIPS 197), AES-128/192/256
+# Reference backend for tools/bench_crypto.py on hosts with neither cryptolib nor the
+# cryptography package. Correct but some 1000x slower: frame rates measured with it say
+# nothing about the device.
+
+
+def _xtime(a):
+    a <<= 1
+    return a ^ 0x11B if a & 0x100 else a
+
+
+def _sbox():
+    # Multiplicative inverse in GF(2^8) through the 3 generator, then the affine transform
+    exp = [0] * 255
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x ^= _xtime(x)
+    box = bytearray(256)
+    for a in range(256):
+        inv = exp[(255 - log[a]) % 255] if a else 0
+        s = inv
+        for shift in range(1, 5):
+            s ^= (inv << shift | inv >> (8 - shift)) & 0xFF
+        box[a] = s ^ 0x63
+    return bytes(box)
+
+
+SBOX = _sbox()
+XTIME = bytes(_xtime(a) & 0xFF for a in range(256))
+
+
+def _expand(key):
+    nk = len(key) // 4
+    if nk not in (4, 6, 8):
+        raise ValueError('AES key of 16, 24 or 32 bytes')
+    rounds = nk + 6
+    w = bytearray(key)
+    rcon = 1
+    for i in range(nk, 4 * (rounds + 1)):
+        t = w[-4:]
+        if i % nk == 0:
+            t = bytearray((SBOX[t[1]] ^ rcon, SBOX[t[2]], SBOX[t[3]], SBOX[t[0]]))
+            rcon = XTIME[rcon]
+        elif nk > 6 and i % nk == 4:
+            t = bytearray(SBOX[b] for b in t)
+        w += bytes(w[-4 * nk + j] ^ t[j] for j in range(4))
+    return [bytes(w[16 * r:16 * r + 16]) for r in range(rounds + 1)]
+
+
+def _encrypt(round_keys, block):
+    s = bytearray(block[j] ^ round_keys[0][j] for j in range(16))
+    last = len(round_keys) - 1
+    for r in range(1, last + 1):
+        # SubBytes and ShiftRows: column c takes row i from column c + i
+        s = bytearray(SBOX[s[(4 * (c + i) + i) % 16]] for c in range(4) for i in range(4))
+        if r != last:  # MixColumns
+            for c in range(0, 16, 4):
+                a0, a1, a2, a3 = s[c:c + 4]
+                t = a0 ^ a1 ^ a2 ^ a3
+                s[c] = a0 ^ t ^ XTIME[a0 ^ a1]
+                s[c + 1] = a1 ^ t ^ XTIME[a1 ^ a2]
+                s[c + 2] = a2 ^ t ^ XTIME[a2 ^ a3]
+                s[c + 3] = a3 ^ t ^ XTIME[a3 ^ a0]
+        k = round_keys[r]
+        for j in range(16):
+            s[j] ^= k[j]
+    return bytes(s)
+
+
+# Same shape as ble_crypto._ecb(): returns the encrypt function of one 16 byte block
+def ecb(key):
+    round_keys = _expand(bytes(key))
+    return lambda block: _encrypt(round_keys, block)
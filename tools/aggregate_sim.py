@@ -0,0 +1,78 @@
+# aggregate_sim.py Messages and bytes sent with per-frame publishing, aggregation windows
+# and deadbands
+#   python3 tools/aggregate_sim.py [devices] [minutes] [window_s]
+# Every device advertises once a second with a new measurement every 10 s (as the
+# LYWSD03MMC custom firmwares do), RSSI jittering, temperature drifting slowly with
+# 0.01 degree noise and humidity with 0.1 % noise. The publisher runs every 0.5 s like
+# main(). The clock is simulated. Deadbands are those of params.json.
+
+import sys
+import json
+import math
+import random
+
+sys.path.insert(0, '.')
+import ble_store
+from ble_store import DeviceStore
+from ble_decoder import decode_cached, is_duplicate, affinity_clear
+
+clock = [0]
+ble_store.ticks_ms = lambda: clock[0]
+
+
+with open('params.json') as f:
+    params = json.load(f)
+DEADBANDS = params.get('deadband') or {'temp': 0.1, 'hum': 1, 'batt': 1, 'battery_volts': 20}
+HEARTBEAT_S = params.get('heartbeat', 300)
+
+
+def pvvx(temp, hum, counter):
+    return bytes((2, 1, 6, 0x12, 0x16, 0x1a, 0x18, 1, 2, 3, 4, 5, 6)) + int(temp * 100).to_bytes(2, 'little') \
+        + int(hum * 100).to_bytes(2, 'little') + (2950).to_bytes(2, 'little') + bytes((80, counter & 0xFF, 5))
+
+
+def run(devices, minutes, window_s=0, deadbands=None):
+    affinity_clear()
+    rng = random.Random(1)
+    store = DeviceStore(devices, aggregate=bool(window_s), deadbands=deadbands, heartbeat_s=HEARTBEAT_S)
+    addrs = [bytes((0xa4, 0xc1, 0x38, 0, 0, i)) for i in range(devices)]
+    messages = sent = 0
+    window_start = 0
+    last = None
+    for ms in range(0, minutes * 60000, 500):
+        clock[0] = ms
+        if ms % 1000 == 0:
+            for i, addr in enumerate(addrs):
+                counter = (ms + i * 997) // 10000
+                temp = 21 + i % 5 + math.sin(ms / 1800000 + i) + rng.randint(-1, 1) / 100
+                adv = pvvx(temp, 45 + i % 20 + rng.randint(-1, 1) / 10, counter)
+                rssi = -60 - rng.randint(0, 20)
+                if is_duplicate(addr, adv):
+                    store.touch(addr, rssi)
+                    continue
+                store.put(addr, rssi, ms // 1000, adv, decode_cached(addr, adv))
+        if window_s and ms - window_start < window_s * 1000:
+            continue
+        window_start = ms
+        for addr in store.pending():
+            version = store.version(addr)
+            last = json.dumps(store.frame(addr))
+            store.close_window(addr)
+            store.published(addr, version)
+            messages += 1
+            sent += len(last)
+    return messages, sent, last
+
+
+def main(devices, minutes, window_s):
+    print('{} devices, {} min'.format(devices, minutes))
+    base = None
+    for name, window, deadbands in (('per frame', 0, None), ('{} s windows'.format(window_s), window_s, None),
+                                    ('deadbands', 0, DEADBANDS)):
+        messages, sent, last = run(devices, minutes, window, deadbands)
+        base = base or (messages, sent)
+        print('{:<16} {:>8} messages {:>10} bytes  x{:.1f} fewer messages, x{:.1f} fewer bytes'.format(
+            name, messages, sent, base[0] / messages, base[1] / sent))
+
+
+main(*(int(a) for a in sys.argv[1:4])) if len(sys.argv) > 3 else main(100, 10, 60)
@@ -0,0 +1,100 @@
+# bench_ack.py PUBACK latency: 100 ms polling vs completion events (host, CPython)
+#   python3 tools/bench_ack.py [messages] [latency_ms]
+# Sends QoS 1 publishes one at a time (publish(wait=True), window 1) to
+# tools/stub_broker.py, which acks after latency_ms, and histograms the time each
+# publish() call took. 'poll' waits like MQTT_base._await_pid() did before: check the
+# pid set, sleep 100 ms, check again. 'event' waits on the event the reader sets when it
+# parses the PUBACK, as Delivery.wait() and _await_pid() do now.
+
+import sys
+import time
+import socket
+import struct
+import asyncio
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+from stub_broker import StubBroker, varint
+
+POLL_MS = 100
+BUCKETS = (2, 5, 10, 20, 50, 100, 150, 200)  # Upper bounds, ms
+
+
+class HostClient:
+    def __init__(self, mode):
+        self._mode = mode
+
+    async def connect(self, port):
+        self._reader, self._writer = await asyncio.open_connection('127.0.0.1', port)
+        self._writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_id = b'bench'
+        body = b'\x00\x04MQTT\x04\x02\x00\x3c' + struct.pack('!H', len(client_id)) + client_id
+        self._writer.write(b'\x10' + varint(len(body)) + body)
+        await self._reader.readexactly(4)  # CONNACK
+        self._pid = 0
+        self._pids = {}
+        self._task = asyncio.create_task(self._read())
+
+    async def _read(self):
+        while True:
+            header = await self._reader.readexactly(4)
+            if header[0] == 0x40:
+                self._pids.pop(struct.unpack_from('!H', header, 2)[0]).set()
+
+    async def publish(self, topic, msg):
+        self._pid = self._pid % 65535 + 1
+        pid = self._pid
+        evt = self._pids[pid] = asyncio.Event()
+        self._writer.write(b'\x32' + varint(2 + len(topic) + 2 + len(msg)) + struct.pack('!H', len(topic)) + topic
+                           + struct.pack('!H', pid) + msg)
+        await self._writer.drain()
+        if self._mode == 'poll':
+            while pid in self._pids:
+                await asyncio.sleep(POLL_MS / 1000)
+        else:
+            await evt.wait()
+
+    def close(self):
+        self._task.cancel()
+        self._writer.close()
+
+
+def histogram(samples):
+    counts = [0] * (len(BUCKETS) + 1)
+    for ms in samples:
+        i = 0
+        while i < len(BUCKETS) and ms > BUCKETS[i]:
+            i += 1
+        counts[i] += 1
+    return counts
+
+
+async def run(mode, messages, latency_ms):
+    broker = StubBroker(latency_ms)
+    port = await broker.start('127.0.0.1', 0)
+    client = HostClient(mode)
+    await client.connect(port)
+    samples = []
+    for i in range(messages):
+        t0 = time.perf_counter()
+        await client.publish(b'ble_bench/', b'{"n": %d}' % i)
+        samples.append((time.perf_counter() - t0) * 1000)
+    client.close()
+    broker.close()
+    return sorted(samples)
+
+
+async def main(messages, latency_ms):
+    print('{} QoS 1 publishes, one at a time, {} ms broker latency'.format(messages, latency_ms))
+    labels = ['<={}'.format(b) for b in BUCKETS] + ['>{}'.format(BUCKETS[-1])]
+    print('{:<6} {:>7} {:>7} {:>7}  '.format('mode', 'p50', 'p99', 'msg/s') + ' '.join('{:>6}'.format(l) for l in labels))
+    for mode in ('poll', 'event'):
+        samples = await run(mode, messages, latency_ms)
+        p50 = samples[len(samples) // 2]
+        p99 = samples[len(samples) * 99 // 100]
+        print('{:<6} {:>7.1f} {:>7.1f} {:>7.0f}  '.format(mode, p50, p99, len(samples) * 1000 / sum(samples))
+              + ' '.join('{:>6}'.format(c) for c in histogram(samples)))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100, float(sys.argv[2]) if len(sys.argv) > 2 else 2))
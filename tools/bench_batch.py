@@ -0,0 +1,124 @@
+# bench_batch.py Per-device vs batched publishing against tools/stub_broker.py (host, CPython)
+#   python3 tools/bench_batch.py [devices] [latency_ms]
+# One publish cycle of `devices` pending sensors, as main() sends it: per-device QoS 1
+# messages, each waiting for its PUBACK (mqtt_as publishes one at a time), then batches
+# of ble_publish.groups() on the gateway topic. The client writes a PUBLISH in one go
+# as mqtt_as._publish() does (see tools/bench_packets.py), with TCP_NODELAY so the
+# segment counts look like the device's. Reported: cycle time,
+# messages, TCP reads at the broker, wire bytes and when each device's data arrived.
+
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+from ble_store import DeviceStore
+from ble_decoder import decode_ble, unhexlify
+from ble_publish import groups
+from ble_codec import JsonCodec
+from corpus import CORPUS
+from stub_broker import StubBroker, varint
+
+BATCH_COUNT = 50
+BATCH_BYTES = 4096
+
+
+class HostClient:
+    async def connect(self, port):
+        self._reader, self._writer = await asyncio.open_connection('127.0.0.1', port)
+        self._writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_id = b'bench'
+        body = b'\x00\x04MQTT\x04\x02\x00\x3c' + struct.pack('!H', len(client_id)) + client_id
+        self._writer.write(b'\x10' + varint(len(body)) + body)
+        await self._reader.readexactly(4)  # CONNACK
+        self._pid = 0
+        self._acks = {}
+        self._task = asyncio.create_task(self._read())
+
+    async def _read(self):
+        while True:
+            header = await self._reader.readexactly(4)
+            if header[0] == 0x40:
+                self._acks.pop(struct.unpack_from('!H', header, 2)[0]).set_result(None)
+
+    async def publish(self, topic, msg):
+        self._pid = self._pid % 65535 + 1
+        done = self._acks[self._pid] = asyncio.get_running_loop().create_future()
+        topic = topic.encode()
+        msg = msg.encode()
+        self._writer.write(b'\x32' + varint(2 + len(topic) + 2 + len(msg)) + struct.pack('!H', len(topic)) + topic
+                           + struct.pack('!H', self._pid) + msg)
+        await self._writer.drain()
+        await done
+
+    def close(self):
+        self._task.cancel()
+        self._writer.close()
+
+
+def pending_store(devices):
+    store = DeviceStore(devices)
+    frames = [unhexlify(frame) for fmt, frame, _ in CORPUS if fmt in ('atc1441', 'pvvx', 'bthome')]
+    for i in range(devices):
+        adv = frames[i % len(frames)]
+        store.put(bytes((0xa4, 0xc1, 0x38, 0, i >> 8, i & 0xFF)), -60 - i % 30, 1700000000 + i, adv,
+                  decode_ble(adv), 'ATC_{:04x}'.format(i))
+    return store
+
+
+async def cycle(mode, devices, latency_ms):
+    arrivals = []
+    t0 = time.perf_counter()
+
+    def on_publish(topic, payload):
+        n = len(json.loads(payload)) if mode == 'batch' else 1
+        arrivals.extend([(time.perf_counter() - t0) * 1000] * n)
+
+    broker = StubBroker(latency_ms, on_publish=on_publish)
+    port = await broker.start('127.0.0.1', 0)
+    client = HostClient()
+    await client.connect(port)
+    store = pending_store(devices)
+    broker.stats.reset()
+
+    t0 = time.perf_counter()
+    pending = store.pending()
+    if mode == 'batch':
+        items = [((addr, store.version(addr)), json.dumps(store.frame(addr))) for addr in pending]
+        for group in groups(items, BATCH_COUNT, BATCH_BYTES):
+            await client.publish('ble_gateway/', JsonCodec().array([p for _, p in group]))
+            for (addr, version), _ in group:
+                store.published(addr, version)
+    else:
+        for addr in pending:
+            version = store.version(addr)
+            frame = store.frame(addr)
+            await client.publish('ble_{}/'.format(frame['addr']), json.dumps(frame))
+            store.published(addr, version)
+    ms = (time.perf_counter() - t0) * 1000
+
+    client.close()
+    broker.close()
+    stats = broker.stats
+    arrivals.sort()
+    print('{:<8} {:>9.1f} {:>9} {:>8} {:>10} {:>12.1f} {:>12.1f}'.format(
+        mode, ms, stats.publishes, stats.reads, stats.bytes, arrivals[len(arrivals) // 2], arrivals[-1]))
+    return ms
+
+
+async def main(devices, latency_ms):
+    print('{} devices, {} ms broker latency, batches of up to {} devices / {} bytes'.format(
+        devices, latency_ms, BATCH_COUNT, BATCH_BYTES))
+    print('{:<8} {:>9} {:>9} {:>8} {:>10} {:>12} {:>12}'.format(
+        'mode', 'cycle ms', 'messages', 'reads', 'bytes', 'p50 arrival', 'last arrival'))
+    per_device = await cycle('device', devices, latency_ms)
+    batched = await cycle('batch', devices, latency_ms)
+    print('Batching: x{:.1f} faster cycle'.format(per_device / batched))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200, float(sys.argv[2]) if len(sys.argv) > 2 else 20))
@@ -0,0 +1,93 @@
+# bench_codec.py Payload size and encode time per codec (see ble_codec.py)
+# Runs under CPython and the MicroPython unix port, from the repo root:
+#   python3 tools/bench_codec.py [rounds]
+# Every corpus frame is stored in a DeviceStore and encoded as the publisher does it,
+# per device and as one batch, plus a thermometer whose counter needs 16 bits, then all
+# of it again with aggregation windows. Under CPython every payload is also decoded with
+# tools/payload_decode.py and compared to the whole frame (float32 tolerance): no codec
+# may drop a field. "thermo" counts the frames sent as binary THERMO records.
+
+import sys
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+from ble_store import DeviceStore
+from ble_codec import CODECS, RECORD_THERMO, get_codec
+from ble_decoder import decode_ble, unhexlify
+from bench_util import now_us, elapsed_us
+from corpus import CORPUS
+
+ROUNDS = 200
+
+
+def frames(raw_hex, aggregate=False):
+    store = DeviceStore(len(CORPUS) + 1, aggregate=aggregate)
+    for i, (fmt, frame, _) in enumerate(CORPUS):
+        adv = unhexlify(frame)
+        store.put(bytes((0xa4, 0xc1, 0x38, 0, 0, i)), -60 - i, 1700000000 + i, adv, decode_ble(adv),
+                  'ATC_{:04x}'.format(i) if i % 2 else None)
+    adv = unhexlify(CORPUS[0][1])
+    data = decode_ble(adv)
+    data['counter'] = 60000
+    store.put(bytes((0xa4, 0xc1, 0x38, 0, 1, 0)), -70, 1700000100, adv, data)
+    return [store.frame(addr, raw_hex) for addr in store.addrs()]
+
+
+def close(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        return abs(a - b) <= 1e-5 * max(1, abs(a))
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(close(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(close(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def check(name, sample, payloads, batch, aggregate):
+    from payload_decode import decode
+    expected = frames(True, aggregate)
+    got = [decode(bytes(p) if not isinstance(p, str) else p, name)[0] for p in payloads]
+    bad = 0
+    for exp, frame in zip(expected, got):
+        if not close(exp, frame):
+            bad += 1
+            print('Mismatch', name, exp, frame)
+    if len(decode(bytes(batch) if not isinstance(batch, str) else batch, name)) != len(sample):
+        bad += 1
+        print('Batch mismatch', name)
+    return bad
+
+
+def main(rounds):
+    host = sys.implementation.name != 'micropython'
+    print('{} frames, {} rounds'.format(len(CORPUS) + 1, rounds))
+    print('{:<10} {:>12} {:>12} {:>12} {:>7} {:>10}'.format('codec', 'bytes/frame', 'batch bytes', 'us/frame', 'thermo',
+                                                           'check'))
+    bad = 0
+    for aggregate in (False, True):
+        for name in CODECS:
+            bad += run(name, rounds, host, aggregate)
+    return bad
+
+
+def run(name, rounds, host, aggregate):
+    codec = get_codec(name)
+    sample = frames(codec.raw_hex, aggregate)
+    t0 = now_us()
+    for _ in range(rounds):
+        payloads = [codec.encode(frame) for frame in sample]
+    us = elapsed_us(t0) / (rounds * len(sample))
+    batch = codec.array(payloads)
+    size = sum(len(p) for p in payloads) / len(payloads)
+    thermo = sum(1 for p in payloads if name == 'binary' and p[2] == RECORD_THERMO)
+    bad = 0
+    result = '-'
+    if host:
+        bad = check(name, sample, payloads, batch, aggregate)
+        result = 'ok' if not bad else '{} bad'.format(bad)
+    print('{:<10} {:>12.1f} {:>12} {:>12.1f} {:>7} {:>10}'.format(name + ('+win' if aggregate else ''), size, len(batch),
+                                                                 us, thermo, result))
+    return bad
+
+
+sys.exit(1 if main(int(sys.argv[1]) if len(sys.argv) > 1 else ROUNDS) else 0)
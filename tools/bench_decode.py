@@ -0,0 +1,242 @@
+# bench_decode.py Decoder throughput benchmark suite
+# Runs under CPython and the MicroPython unix port, from the repo root:
+#   python3 tools/bench_decode.py [--rounds N] [--out results.json]
+#   micropython tools/bench_decode.py [--rounds N] [--out results.json]
+#   python3 tools/bench_decode.py --compare old.json new.json
+# Every decoder runs over the real frames of tools/corpus.py and a synthetic set
+# (corpus frames with new counters and addresses, plus undecodable noise), per format.
+# Reports frames/s and, on MicroPython, heap bytes allocated per frame (gc.mem_alloc
+# deltas with the GC disabled). Results are written as JSON tagged with the firmware
+# version of version.json, so runs of two versions can be compared.
+
+import sys
+import gc
+import json
+import struct
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+from ble_decoder import decode_ble, decode_cached, is_duplicate, affinity_clear, unhexlify
+from corpus import CORPUS, CONSECUTIVE
+from bench_util import now_us, elapsed_us, Lcg
+
+ROUNDS = 2000
+SYNTH_DEVICES = 50
+REGRESSION = 0.9  # Flag formats running below 90 % of the reference speed
+
+
+# Decoding path as it was before adv_data was kept as bytes (ATC1441 / PVVX only)
+def legacy_hex(adv):
+    return ''.join('%02x' % struct.unpack("B", bytes([x]))[0] for x in adv)
+
+
+def legacy_decode(pkg):
+    output = {}
+    if pkg[4:8] == '1a18' or pkg[10:14] == '1a18':
+        pkg_init = pkg.index('1a18') + 4
+        if pkg_init + 26 == len(pkg):
+            output['temp'] = int(pkg[12+pkg_init:16+pkg_init], 16) / 10.0
+            output['hum'] = int(pkg[16+pkg_init:18+pkg_init], 16)
+            output['batt'] = int(pkg[18+pkg_init:20+pkg_init], 16)
+            output['battery_volts'] = int(pkg[20+pkg_init:24+pkg_init], 16)
+            output['counter'] = int(pkg[24+pkg_init:26+pkg_init], 16)
+        else:
+            temp_little = pkg[12+pkg_init:16+pkg_init]
+            temp_big = ''.join([temp_little[i:i+2] for i in range(0, len(temp_little), 2)][::-1])
+            output['temp'] = int(temp_big, 16) / 100.0
+            hum_little = pkg[16+pkg_init:20+pkg_init]
+            hum_big = ''.join([hum_little[i:i+2] for i in range(0, len(hum_little), 2)][::-1])
+            output['hum'] = int(hum_big, 16) / 100.0
+            vbat_little = pkg[20+pkg_init:24+pkg_init]
+            vbat_big = ''.join([vbat_little[i:i+2] for i in range(0, len(vbat_little), 2)][::-1])
+            output['battery_volts'] = int(vbat_big, 16)
+            output['batt'] = int(pkg[24+pkg_init:26+pkg_init], 16)
+            output['counter'] = int(pkg[26+pkg_init:28+pkg_init], 16)
+            output['flag'] = int(pkg[28+pkg_init:30+pkg_init], 16)
+    return output
+
+
+def decode_legacy(addr, adv):
+    return legacy_decode(legacy_hex(adv))
+
+
+def decode_plain(addr, adv):
+    return decode_ble(adv)
+
+
+# Cached decode behind the duplicate check, as get_ble_adv() does it
+def decode_pipeline(addr, adv):
+    if is_duplicate(addr, adv):
+        return None
+    return decode_cached(addr, adv)
+
+
+# Name -> (function(addr, adv), formats it handles or None for all)
+DECODERS = (
+    ('legacy_hex', decode_legacy, ('atc1441', 'pvvx')),
+    ('decode_ble', decode_plain, None),
+    ('decode_cached', decode_cached, None),
+    ('pipeline', decode_pipeline, None),
+)
+
+
+# format -> list of (addr, adv). Real frames come from the corpus, one address each.
+def frame_sets():
+    lcg = Lcg()
+    sets = {}
+    for i, (fmt, frame, _) in enumerate(CORPUS):
+        sets.setdefault(fmt, []).append((bytes((0xa4, 0xc1, 0x38, 0, 0, i)), unhexlify(frame)))
+
+    # Synthetic: every corpus frame from SYNTH_DEVICES addresses, the last byte changed per copy
+    for fmt, frames in list(sets.items()):
+        synth = []
+        for _, adv in frames:
+            for d in range(SYNTH_DEVICES):
+                adv = bytearray(adv)
+                adv[-1] = lcg.byte()
+                synth.append((bytes((0xa4, 0xc1, 0x38, 1, len(synth) >> 8, len(synth) & 0xFF)), bytes(adv)))
+        sets['synth_' + fmt] = synth
+
+    # Noise: manufacturer data of random companies, as phones and wearables send
+    noise = []
+    for d in range(SYNTH_DEVICES):
+        payload = bytes(lcg.byte() for _ in range(3 + d % 20))
+        noise.append((bytes((0x5c, 0, 0, 2, 0, d)), bytes((2, 1, 6, len(payload) + 1, 0xFF)) + payload))
+    sets['synth_noise'] = noise
+    return sets
+
+
+def measure(func, frames, rounds):
+    n = len(frames)
+    per_round = max(1, rounds // n)
+    t0 = now_us()
+    for _ in range(per_round):
+        for addr, adv in frames:
+            func(addr, adv)
+    us = elapsed_us(t0)
+    total = per_round * n
+    result = {'frames': total, 'fps': round(total * 1000000 / us) if us else 0, 'alloc_per_frame': None}
+
+    # Heap bytes per frame: only meaningful on MicroPython, with the GC off
+    if hasattr(gc, 'mem_alloc') and sys.implementation.name == 'micropython':
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        for addr, adv in frames:
+            func(addr, adv)
+        result['alloc_per_frame'] = round((gc.mem_alloc() - before) / n, 1)
+        gc.enable()
+    return result
+
+
+def check_corpus():
+    failed = 0
+    for fmt, frame, expected in CORPUS:
+        got = decode_ble(unhexlify(frame))
+        if got != expected:
+            failed += 1
+            print('Corpus mismatch', fmt, frame, got)
+    print('Corpus: {} frames, {} mismatches'.format(len(CORPUS), failed))
+    return failed == 0 and check_consecutive()
+
+
+# A repeat of a frame is a duplicate, the next measurement of the same device is not
+def check_consecutive():
+    failed = 0
+    for i, (fmt, first, nxt) in enumerate(CONSECUTIVE):
+        affinity_clear()
+        addr = bytes((0xc0, 0, 0, 0, 0, i))
+        first = unhexlify(first)
+        nxt = unhexlify(nxt)
+        decode_cached(addr, first)
+        repeat = is_duplicate(addr, first)
+        new = is_duplicate(addr, nxt)
+        changed = decode_cached(addr, nxt) != decode_ble(first)
+        # Formats without a counter never report duplicates
+        if new or not changed or repeat != (fmt not in ('govee', 'ibeacon')):
+            failed += 1
+            print('Consecutive frames wrong', fmt, 'repeat duplicate', repeat, 'next duplicate', new,
+                  'next changed', changed)
+    print('Consecutive frames: {} formats, {} wrong'.format(len(CONSECUTIVE), failed))
+    return failed == 0
+
+
+def firmware_version():
+    try:
+        with open('version.json') as f:
+            return json.load(f)['version']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def run(rounds, out):
+    if not check_corpus():
+        sys.exit(1)
+    sets = frame_sets()
+    results = {}
+    print('{:<14} {:<18} {:>10} {:>12}'.format('decoder', 'format', 'frames/s', 'bytes/frame'))
+    for name, func, formats in DECODERS:
+        results[name] = {}
+        for fmt in sorted(sets):
+            base = fmt[6:] if fmt.startswith('synth_') else fmt
+            if formats is not None and base not in formats:
+                continue
+            affinity_clear()
+            res = results[name][fmt] = measure(func, sets[fmt], rounds)
+            alloc = res['alloc_per_frame']
+            print('{:<14} {:<18} {:>10} {:>12}'.format(name, fmt, res['fps'], '-' if alloc is None else alloc))
+
+    report = {
+        'version': firmware_version(),
+        'implementation': sys.implementation.name,
+        'platform': sys.platform,
+        'rounds': rounds,
+        'results': results,
+    }
+    if out:
+        with open(out, 'w') as f:
+            json.dump(report, f)
+        print('Results written to', out)
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print('Version {} ({}) -> {} ({})'.format(old['version'], old['implementation'], new['version'],
+                                             new['implementation']))
+    regressions = 0
+    for name, formats in new['results'].items():
+        for fmt, res in formats.items():
+            ref = old['results'].get(name, {}).get(fmt)
+            if not ref or not ref['fps']:
+                continue
+            ratio = res['fps'] / ref['fps']
+            flag = ''
+            if ratio < REGRESSION:
+                flag = '  REGRESSION'
+                regressions += 1
+            print('{:<14} {:<18} {:>10} -> {:>10}  x{:.2f}{}'.format(name, fmt, ref['fps'], res['fps'], ratio, flag))
+    print(regressions, 'regressions')
+    return regressions
+
+
+def main(argv):
+    rounds = ROUNDS
+    out = None
+    i = 0
+    while i < len(argv):
+        if argv[i] == '--rounds':
+            i += 1
+            rounds = int(argv[i])
+        elif argv[i] == '--out':
+            i += 1
+            out = argv[i]
+        elif argv[i] == '--compare':
+            sys.exit(1 if compare(argv[i + 1], argv[i + 2]) else 0)
+        i += 1
+    run(rounds, out)
+
+
+main(sys.argv[1:])
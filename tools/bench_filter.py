@@ -0,0 +1,34 @@
+# bench_filter.py Address filter lookup cost against the number of entries
+# Runs under CPython and the MicroPython unix port, from the repo root:
+#   python3 tools/bench_filter.py [lookups]
+# The cost per frame should stay flat from 10 to 10000 entries.
+
+import sys
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+from ble_filter import AddrFilter
+from ble_util import addr_hex
+from bench_util import now_us, elapsed_us, Lcg
+
+
+def bench(lookups):
+    lcg = Lcg()
+    addrs = [bytes(lcg.byte() for _ in range(6)) for _ in range(1000)]
+    print('{:>8} {:>8} {:>12} {:>10}'.format('macs', 'ouis', 'lookups/s', 'dropped'))
+    for size in (0, 10, 100, 1000, 10000):
+        # Half the entries deny exact addresses, half deny OUIs, a fifth of the scanned addresses are listed
+        config = {'deny': [addr_hex(addrs[i % 200]) if i < 200 else addr_hex(bytes(lcg.byte() for _ in range(6)))
+                           for i in range(size // 2)]
+                  + [addr_hex(bytes(lcg.byte() for _ in range(3))) for _ in range(size - size // 2)]}
+        flt = AddrFilter(config)
+        n = len(addrs)
+        t0 = now_us()
+        for i in range(lookups):
+            flt.check(addrs[i % n])
+        us = elapsed_us(t0)
+        dropped = flt.stats['denied'] + flt.stats['not_allowed']
+        print('{:>8} {:>8} {:>12.0f} {:>10}'.format(size // 2, size - size // 2, lookups * 1000000 / us, dropped))
+
+
+bench(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,154 @@
+# bench_packets.py PUBLISH packet assembly: one write per field vs one write per packet
+# (host, CPython)
+#   python3 tools/bench_packets.py [messages]
+# Sends QoS 1 PUBLISH packets to tools/stub_broker.py (no ack latency, window of 8) the
+# way MQTT_base._publish() in lib/mqtt_as wrote them before (fixed header, topic length,
+# topic, packet id, payload: a socket write each, yielding after every write) and does
+# now (built in a preallocated buffer and written at once; payloads of ZC_MIN bytes or
+# more follow in a second write without being copied). TCP_NODELAY is set, so every
+# write leaves as its own segment like on the CYW43. Reported: packets/s and the TCP
+# reads the broker needed per packet.
+
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+from bench_batch import pending_store
+from stub_broker import StubBroker, varint
+
+WINDOW = 8
+OBUFSIZE = 256
+ZC_MIN = 512
+
+
+class HostClient:
+    def __init__(self, mode):
+        self._mode = mode
+        self._obuf = bytearray(OBUFSIZE)
+
+    async def connect(self, port):
+        self._reader, self._writer = await asyncio.open_connection('127.0.0.1', port)
+        self._writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_id = b'bench'
+        body = b'\x00\x04MQTT\x04\x02\x00\x3c' + struct.pack('!H', len(client_id)) + client_id
+        self._writer.write(b'\x10' + varint(len(body)) + body)
+        await self._reader.readexactly(4)  # CONNACK
+        self._pid = 0
+        self._inflight = {}
+        self._slot = asyncio.Event()
+        self._task = asyncio.create_task(self._read())
+
+    async def _read(self):
+        while True:
+            header = await self._reader.readexactly(4)
+            if header[0] == 0x40:
+                self._inflight.pop(struct.unpack_from('!H', header, 2)[0]).set_result(None)
+                self._slot.set()
+
+    async def _write(self, data, length=0):
+        data = memoryview(data)
+        self._writer.write(data[:length] if length else data)
+        await asyncio.sleep(0)  # _as_write() yields after every write
+
+    async def _split(self, topic, msg, pid):
+        pkt = bytearray(b'\x32\0\0\0')
+        sz = 2 + len(topic) + 2 + len(msg)
+        i = 1
+        while sz > 0x7F:
+            pkt[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        pkt[i] = sz
+        await self._write(pkt, i + 1)
+        await self._write(struct.pack('!H', len(topic)))
+        await self._write(topic)
+        struct.pack_into('!H', pkt, 0, pid)
+        await self._write(pkt, 2)
+        await self._write(msg)
+
+    async def _single(self, topic, msg, pid):
+        tlen = len(topic)
+        mlen = len(msg)
+        sz = 2 + tlen + 2 + mlen
+        copy = mlen < ZC_MIN
+        n = 5 + sz - (0 if copy else mlen)
+        if n > len(self._obuf):
+            self._obuf.extend(bytearray(n - len(self._obuf) + 50))
+        pkt = self._obuf
+        pkt[0] = 0x32
+        i = 1
+        while sz > 0x7F:
+            pkt[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        pkt[i] = sz
+        struct.pack_into('!H', pkt, i + 1, tlen)
+        i += 3
+        pkt[i:i + tlen] = topic
+        i += tlen
+        struct.pack_into('!H', pkt, i, pid)
+        i += 2
+        if copy:
+            pkt[i:i + mlen] = msg
+            i += mlen
+        await self._write(pkt, i)
+        if not copy:
+            await self._write(msg)
+
+    async def publish(self, topic, msg):
+        while len(self._inflight) >= WINDOW:
+            self._slot.clear()
+            await self._slot.wait()
+        self._pid = self._pid % 65535 + 1
+        done = self._inflight[self._pid] = asyncio.get_running_loop().create_future()
+        await (self._split if self._mode == 'split' else self._single)(topic, msg, self._pid)
+        return done
+
+    def close(self):
+        self._task.cancel()
+        self._writer.close()
+
+
+async def run(mode, messages, payloads):
+    broker = StubBroker()
+    port = await broker.start('127.0.0.1', 0)
+    client = HostClient(mode)
+    await client.connect(port)
+    broker.stats.reset()
+    t0 = time.perf_counter()
+    deliveries = []
+    for i in range(messages):
+        topic, msg = payloads[i % len(payloads)]
+        deliveries.append(await client.publish(topic, msg))
+    for done in deliveries:
+        await done
+    seconds = time.perf_counter() - t0
+    client.close()
+    broker.close()
+    stats = broker.stats
+    return messages / seconds, stats.reads / stats.publishes
+
+
+async def main(messages):
+    store = pending_store(50)
+    frames = [store.frame(addr) for addr in store.pending()]
+    small = [('ble_{}/'.format(f['addr']).encode(), json.dumps(f).encode()) for f in frames]
+    large = [(b'ble_gateway/', json.dumps(frames[i:i + 10]).encode()) for i in range(0, len(frames), 10)]
+    print('{} QoS 1 messages, window {}'.format(messages, WINDOW))
+    print('{:<20} {:>8} {:>10} {:>10} {:>9}'.format('payload', 'mode', 'packets/s', 'reads/pkt', 'gain'))
+    for name, payloads in (('device', small), ('batch of 10', large)):
+        size = sum(len(m) for _, m in payloads) // len(payloads)
+        split, split_reads = await run('split', messages, payloads)
+        single, single_reads = await run('single', messages, payloads)
+        label = '{} {} B'.format(name, size)
+        print('{:<20} {:>8} {:>10.0f} {:>10.2f}'.format(label, 'split', split, split_reads))
+        print('{:<20} {:>8} {:>10.0f} {:>10.2f} {:>8.1f}x'.format('', 'single', single, single_reads, single / split))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,114 @@
+# bench_publisher.py Polling vs event-driven publisher (host, CPython)
+#   python3 tools/bench_publisher.py [devices] [seconds]
+# A scanner task puts frames of `devices` sensors into a DeviceStore at random intervals
+# (10 frames/s overall) while a publisher drains it, as main() did before (wake every
+# 0.5 s, walk the whole table with pending()) and does now (sleep on the on_pending
+# event, drain() the queued devices, wake at least every IDLE_MS). Publishing is free
+# here, so the latency is the publisher's own: time from a device becoming pending to its
+# publish. Then the scanner stops and the process CPU time of the idle publisher is
+# measured with the store full of published devices.
+
+import sys
+import time
+import random
+import asyncio
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+from ble_store import DeviceStore
+from ble_decoder import decode_ble, unhexlify
+from corpus import CORPUS
+
+POLL_S = 0.5
+IDLE_MS = 2000
+RATE = 10
+
+
+class Run:
+    def __init__(self, devices):
+        self.ready = asyncio.Event()
+        self.store = DeviceStore(devices, on_pending=self.ready.set)
+        self.addrs = [bytes((0xa4, 0xc1, 0x38, 0, i >> 8, i & 0xFF)) for i in range(devices)]
+        self.advs = [unhexlify(frame) for fmt, frame, _ in CORPUS if fmt in ('atc1441', 'pvvx')]
+        self.since = {}
+        self.latency = []
+        self.wakeups = 0
+        self.stop = False
+        for i, addr in enumerate(self.addrs):
+            self.put(i, addr)
+            self.publish(addr)
+        self.store.drain()
+        self.latency = []
+
+    def put(self, i, addr):
+        adv = self.advs[i % len(self.advs)]
+        self.since.setdefault(addr, time.perf_counter())
+        self.store.put(addr, -60, 1700000000, adv, decode_ble(adv))
+
+    def publish(self, addr):
+        version = self.store.version(addr)
+        if version is not None:
+            self.store.frame(addr)
+            self.store.published(addr, version)
+            self.latency.append((time.perf_counter() - self.since.pop(addr)) * 1000)
+
+    async def scan(self, seconds):
+        rng = random.Random(1)
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            await asyncio.sleep(rng.expovariate(RATE))
+            i = rng.randrange(len(self.addrs))
+            self.put(i, self.addrs[i])
+
+    async def poll(self):
+        while not self.stop:
+            self.wakeups += 1
+            for addr in self.store.pending():
+                self.publish(addr)
+            await asyncio.sleep(POLL_S)
+
+    async def event(self):
+        while not self.stop:
+            if not self.store.queued():
+                self.ready.clear()
+                try:
+                    await asyncio.wait_for(self.ready.wait(), IDLE_MS / 1000)
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeups += 1
+            for addr in self.store.drain():
+                self.publish(addr)
+
+
+async def measure(mode, devices, seconds):
+    run = Run(devices)
+    task = asyncio.create_task(getattr(run, mode)())
+    await run.scan(seconds)
+    await asyncio.sleep(POLL_S)
+    latency = sorted(run.latency)
+    wakeups = run.wakeups
+    run.wakeups = 0
+    cpu = time.process_time()
+    t0 = time.perf_counter()
+    await asyncio.sleep(seconds)
+    cpu = (time.process_time() - cpu) / (time.perf_counter() - t0)
+    run.stop = True
+    run.ready.set()
+    await task
+    print('{:<6} {:>9} {:>9.1f} {:>9.1f} {:>10.1f} {:>12.1f} {:>12.3f}'.format(
+        mode, len(latency), latency[len(latency) // 2], latency[-1], wakeups / seconds,
+        run.wakeups / seconds, cpu * 1000))
+    return latency[len(latency) // 2]
+
+
+async def main(devices, seconds):
+    print('{} devices, {} frames/s for {} s, then idle for {} s'.format(devices, RATE, seconds, seconds))
+    print('{:<6} {:>9} {:>9} {:>9} {:>10} {:>12} {:>12}'.format(
+        'mode', 'published', 'p50 ms', 'max ms', 'wakeups/s', 'idle wake/s', 'idle cpu ms/s'))
+    poll = await measure('poll', devices, seconds)
+    event = await measure('event', devices, seconds)
+    print('Event-driven: p50 latency {:.1f} ms -> {:.2f} ms'.format(poll, event))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 256, float(sys.argv[2]) if len(sys.argv) > 2 else 10))
@@ -0,0 +1,116 @@
+# bench_store.py Heap churn and GC pauses of the device table, dict per frame vs slots
+# Runs under CPython and the MicroPython unix port, from the repo root:
+#   python3 tools/bench_store.py [devices] [frames]
+# "dicts" stores a new dict per frame (addr, rssi, timestamp, name, raw_data, data) as
+# handle_adv() did before the slot table; "slots" is ble_store.DeviceStore. Reported:
+#   retained   heap held by a full table
+#   churn      heap allocated per stored frame (GC disabled on MicroPython; on CPython
+#              the transient peak of each put)
+#   gc pause   gc.collect() time added by the full table, best of GC_ROUNDS
+
+import sys
+import gc
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+from ble_store import DeviceStore
+from ble_util import addr_hex
+from bench_util import now_us, elapsed_us, Lcg
+
+MICROPYTHON = sys.implementation.name == 'micropython'
+GC_ROUNDS = 50
+if not MICROPYTHON:
+    import tracemalloc
+
+
+# The table as it was: a dict per frame in a dict of [seen, frame, sensor] entries
+class DictStore:
+    def __init__(self):
+        self._entries = {}
+
+    def put(self, addr, rssi, timestamp, adv, data=None, name=None):
+        frame = {'addr': addr_hex(addr), 'rssi': rssi, 'timestamp': timestamp}
+        if name:
+            frame['name'] = name
+        frame['raw_data'] = adv
+        if data:
+            frame['data'] = data
+        key = addr_hex(addr)
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = [timestamp, frame, bool(data)]
+        else:
+            entry[0] = timestamp
+            entry[1] = frame
+            entry[2] = bool(data)
+
+
+def workload(devices, frames):
+    lcg = Lcg()
+    addrs = [bytes((0xa4, 0xc1, 0x38, 0, i >> 8, i & 0xFF)) for i in range(devices)]
+    advs = [bytes((2, 1, 6, 17, 0x16, 0x1a, 0x18)) + bytes(lcg.byte() for _ in range(15)) for _ in range(16)]
+    # Decoded dicts are built by the decoder either way, they are reused to leave them out
+    data = {'temp': 21.5, 'hum': 45.0, 'batt': 90}
+    return [(addrs[i % devices], -40 - i % 50, 1700000000 + i, advs[i % len(advs)], data) for i in range(frames)]
+
+
+def heap_used():
+    gc.collect()
+    if MICROPYTHON:
+        return gc.mem_alloc()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def gc_pause():
+    best = None
+    for _ in range(GC_ROUNDS):
+        t0 = now_us()
+        gc.collect()
+        us = elapsed_us(t0)
+        best = us if best is None else min(best, us)
+    return best
+
+
+def measure(factory, frames, devices):
+    if not MICROPYTHON:
+        tracemalloc.start()
+    base = heap_used()
+    store = factory()
+    for addr, rssi, ts, adv, data in frames[:devices]:
+        store.put(addr, rssi, ts, adv, data)
+    retained = heap_used() - base
+
+    if MICROPYTHON:
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        for addr, rssi, ts, adv, data in frames:
+            store.put(addr, rssi, ts, adv, data)
+        churn = (gc.mem_alloc() - before) / len(frames)
+        gc.enable()
+    else:
+        total = 0
+        for addr, rssi, ts, adv, data in frames:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            store.put(addr, rssi, ts, adv, data)
+            total += tracemalloc.get_traced_memory()[1] - before
+        churn = total / len(frames)
+        tracemalloc.stop()
+
+    # Collection time with the full table, against the same heap without it
+    pause = gc_pause()
+    del store
+    return retained, churn, pause - gc_pause()
+
+
+def main(devices, frames):
+    work = workload(devices, frames)
+    print('{} devices, {} frames, {}'.format(devices, frames, sys.implementation.name))
+    print('{:<6} {:>12} {:>14} {:>12}'.format('table', 'retained kB', 'churn B/frame', 'gc pause us'))
+    for name, factory in (('dicts', DictStore), ('slots', lambda: DeviceStore(devices))):
+        retained, churn, pause = measure(factory, work, devices)
+        print('{:<6} {:>12.1f} {:>14.1f} {:>12.0f}'.format(name, retained / 1024, churn, pause))
+
+
+main(int(sys.argv[1]) if len(sys.argv) > 1 else 256, int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
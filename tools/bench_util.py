@@ -0,0 +1,29 @@
+# bench_util.py Timing helpers and test data generator shared by the host benchmarks (CPython and MicroPython unix port)
+
+try:
+    from time import ticks_us, ticks_diff
+
+    def now_us():
+        return ticks_us()
+
+    def elapsed_us(t0):
+        return ticks_diff(ticks_us(), t0)
+
+except ImportError:
+    from time import perf_counter
+
+    def now_us():
+        return perf_counter()
+
+    def elapsed_us(t0):
+        return (perf_counter() - t0) * 1000000
+
+
+# Deterministic pseudo random bytes, identical under CPython and MicroPython
+class Lcg:
+    def __init__(self, seed=12345):
+        self._x = seed
+
+    def byte(self):
+        self._x = (self._x * 1103515245 + 12345) & 0x7FFFFFFF
+        return self._x >> 16 & 0xFF
@@ -0,0 +1,118 @@
+# bench_window.py QoS 1 throughput against the in-flight window (host, CPython)
+#   python3 tools/bench_window.py [messages] [latency_ms]
+# Publishes `messages` device frames to tools/stub_broker.py, which acks after latency_ms,
+# for growing windows. HostClient follows MQTT_base.publish() in lib/mqtt_as: at most
+# window() QoS 1 publishes await their PUBACK, the window being capped by the Receive
+# Maximum of the MQTTv5 CONNACK; publish(wait=False) returns once the PUBLISH is written
+# and the caller awaits the PUBACKs afterwards, as main.acked() does. The last run has the
+# broker announce a Receive Maximum below the window, which must never be exceeded.
+
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+from bench_batch import pending_store
+from stub_broker import StubBroker, varint, read_varint
+
+WINDOWS = (1, 2, 4, 8, 16, 32)
+
+
+class HostClient:
+    def __init__(self, window):
+        self._window = window
+        self.receive_maximum = 0
+
+    async def connect(self, port):
+        self._reader, self._writer = await asyncio.open_connection('127.0.0.1', port)
+        self._writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_id = b'bench'
+        body = b'\x00\x04MQTT\x05\x02\x00\x3c\x00' + struct.pack('!H', len(client_id)) + client_id
+        self._writer.write(b'\x10' + varint(len(body)) + body)
+        header = await self._reader.readexactly(2)
+        connack = await self._reader.readexactly(header[1])
+        size, used = read_varint(connack, 2)
+        props = connack[2 + used:2 + used + size]
+        i = 0
+        while i < len(props):
+            if props[i] == 0x21:
+                self.receive_maximum = struct.unpack_from('!H', props, i + 1)[0]
+            i += 3  # The stub broker only sends two byte properties
+        self._pid = 0
+        self._inflight = {}
+        self._slot = asyncio.Event()
+        self._task = asyncio.create_task(self._read())
+
+    def window(self):
+        rm = self.receive_maximum
+        return min(self._window, rm) if rm else self._window
+
+    async def _read(self):
+        while True:
+            header = await self._reader.readexactly(4)
+            if header[0] == 0x40:
+                self._inflight.pop(struct.unpack_from('!H', header, 2)[0]).set_result(None)
+                self._slot.set()
+
+    async def publish(self, topic, msg, wait=True):
+        while len(self._inflight) >= self.window():
+            self._slot.clear()
+            await self._slot.wait()
+        self._pid = self._pid % 65535 + 1
+        done = self._inflight[self._pid] = asyncio.get_running_loop().create_future()
+        topic = topic.encode()
+        msg = msg.encode()
+        self._writer.write(b'\x32' + varint(2 + len(topic) + 2 + 1 + len(msg)) + struct.pack('!H', len(topic)) + topic
+                           + struct.pack('!H', self._pid) + b'\x00' + msg)  # No properties
+        await self._writer.drain()
+        if not wait:
+            return done
+        await done
+
+    def close(self):
+        self._task.cancel()
+        self._writer.close()
+
+
+async def run(messages, latency_ms, window, receive_max=0):
+    broker = StubBroker(latency_ms, receive_max)
+    port = await broker.start('127.0.0.1', 0)
+    client = HostClient(window)
+    await client.connect(port)
+    store = pending_store(messages)
+    broker.stats.reset()
+
+    t0 = time.perf_counter()
+    deliveries = []
+    for addr in store.pending():
+        frame = store.frame(addr)
+        deliveries.append(await client.publish('ble_{}/'.format(frame['addr']), json.dumps(frame), wait=False))
+    for done in deliveries:
+        await done
+    ms = (time.perf_counter() - t0) * 1000
+
+    client.close()
+    broker.close()
+    stats = broker.stats
+    print('{:>6} {:>8} {:>9.1f} {:>9.1f} {:>10} {:>10}'.format(
+        window, receive_max or '-', ms, messages * 1000 / ms, stats.max_inflight, stats.over_receive_max))
+    return ms, stats.over_receive_max
+
+
+async def main(messages, latency_ms):
+    print('{} QoS 1 messages, {} ms broker latency'.format(messages, latency_ms))
+    print('{:>6} {:>8} {:>9} {:>9} {:>10} {:>10}'.format('window', 'recv max', 'ms', 'msg/s', 'inflight', 'over max'))
+    base, _ = await run(messages, latency_ms, 1)
+    for window in WINDOWS[1:]:
+        ms, _ = await run(messages, latency_ms, window)
+    print('Window {}: x{:.1f} throughput'.format(WINDOWS[-1], base / ms))
+    _, over = await run(messages, latency_ms, WINDOWS[-1], 4)
+    return over
+
+
+sys.exit(1 if asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+                               float(sys.argv[2]) if len(sys.argv) > 2 else 20)) else 0)
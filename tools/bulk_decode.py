@@ -0,0 +1,180 @@
+# bulk_decode.py Vectorized decoding of captured raw_data for server-side reprocessing (host only, NumPy)
+#   python3 tools/bulk_decode.py [frames]     benchmark against the scalar decode_ble()
+# Frames are laid out as a uint8 matrix, one row per advertisement. The AD structures of all
+# rows are walked in lockstep to find ATC1441 and PVVX service data, whose fields are read
+# through structured dtype views. Every other row goes through decode_ble(), so decode_bulk()
+# returns exactly what decode_ble() would for each frame.
+
+import sys
+
+import numpy as np
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+from ble_decoder import decode_ble
+
+KIND_NONE = 0
+KIND_ATC1441 = 1
+KIND_PVVX = 2
+
+# Payload fields of the 0x181A service data, after the 6 byte MAC
+ATC1441_FIELDS = [('temp', '>i2'), ('hum', 'u1'), ('batt', 'u1'), ('vbat', '>u2'), ('counter', 'u1')]
+PVVX_FIELDS = [('temp', '<i2'), ('hum', '<u2'), ('vbat', '<u2'), ('batt', 'u1'), ('counter', 'u1'), ('flag', 'u1')]
+
+# AD structures walked before giving up on a row
+MAX_STRUCTURES = 6
+
+
+# Hex strings (as published in raw_data) -> (uint8 matrix zero padded to the longest frame, lengths)
+def hex_to_matrix(frames):
+    lengths = np.fromiter((len(f) // 2 for f in frames), dtype=np.int64, count=len(frames))
+    width = int(lengths.max()) if len(frames) else 0
+    matrix = np.zeros((len(frames), width), dtype=np.uint8)
+    for size in np.unique(lengths):
+        rows = np.nonzero(lengths == size)[0]
+        if size:
+            joined = bytes.fromhex(''.join(frames[i] for i in rows))
+            matrix[rows, :size] = np.frombuffer(joined, dtype=np.uint8).reshape(-1, size)
+    return matrix, lengths
+
+
+# Length-type-value walk of all rows in lockstep. Returns the payload offset of the 0x181A
+# service data per row, or -1. Only rows where decode_ble() can only pick that structure are
+# kept: it must be the last structure, and no other service or manufacturer data precedes it.
+def locate_181a(matrix, lengths):
+    n, width = matrix.shape
+    padded = np.zeros((n, width + 4), dtype=np.uint8)  # Header reads past the end stay in bounds
+    padded[:, :width] = matrix
+    pos = np.zeros(n, dtype=np.int64)
+    start = np.full(n, -1, dtype=np.int64)
+    alive = lengths > 0
+    for _ in range(MAX_STRUCTURES):
+        rows = np.nonzero(alive)[0]
+        if not len(rows):
+            break
+        p = pos[rows]
+        size = padded[rows, p].astype(np.int64)
+        ad_type = padded[rows, p + 1]
+        end = p + 1 + size
+        last = end == lengths[rows]
+        found = (last & (size >= 3) & (ad_type == 0x16) & (padded[rows, p + 2] == 0x1A)
+                 & (padded[rows, p + 3] == 0x18))
+        start[rows[found]] = p[found] + 4
+        stop = found | last | (size == 0) | (end > lengths[rows]) | (ad_type == 0x16) | (ad_type == 0xFF)
+        alive[rows[stop]] = False
+        pos[rows] = end
+    return start
+
+
+# Returns columns for every row: kind, temp, hum, batt, battery_volts, counter, flag.
+# Rows that are not a plain ATC1441 / PVVX frame have kind KIND_NONE and zeroed fields.
+def decode_matrix(matrix, lengths):
+    n = len(lengths)
+    cols = {
+        'kind': np.zeros(n, dtype=np.uint8),
+        'temp': np.zeros(n, dtype=np.float64),
+        'hum': np.zeros(n, dtype=np.float64),
+        'batt': np.zeros(n, dtype=np.uint8),
+        'battery_volts': np.zeros(n, dtype=np.uint16),
+        'counter': np.zeros(n, dtype=np.uint8),
+        'flag': np.zeros(n, dtype=np.uint8),
+    }
+    start = locate_181a(matrix, lengths)
+    size = np.where(start >= 0, lengths - start, 0)
+    for kind, payload, fields in ((KIND_ATC1441, 13, ATC1441_FIELDS), (KIND_PVVX, 15, PVVX_FIELDS)):
+        rows = np.nonzero(size == payload)[0]
+        if not len(rows):
+            continue
+        # Gather the payloads into a contiguous block and read it through a structured view
+        block = matrix[rows[:, None], start[rows][:, None] + np.arange(payload)]
+        rec = np.ascontiguousarray(block).view(np.dtype([('mac', 'u1', 6)] + fields)).ravel()
+        cols['kind'][rows] = kind
+        if kind == KIND_ATC1441:
+            cols['temp'][rows] = rec['temp'] / 10.0
+            cols['hum'][rows] = rec['hum']
+        else:
+            cols['temp'][rows] = rec['temp'] / 100.0
+            cols['hum'][rows] = rec['hum'] / 100.0
+            cols['flag'][rows] = rec['flag']
+        cols['batt'][rows] = rec['batt']
+        cols['battery_volts'][rows] = rec['vbat']
+        cols['counter'][rows] = rec['counter']
+    return cols
+
+
+# Hex strings -> list of dicts, identical to [decode_ble(f) for f in frames]
+def decode_bulk(frames):
+    matrix, lengths = hex_to_matrix(frames)
+    cols = decode_matrix(matrix, lengths)
+    kind = cols['kind']
+    out = [None] * len(frames)
+
+    atc = np.nonzero(kind == KIND_ATC1441)[0]
+    for i, temp, hum, batt, vbat, counter in zip(atc.tolist(), cols['temp'][atc].tolist(),
+                                                 cols['hum'][atc].astype(np.int64).tolist(),
+                                                 cols['batt'][atc].tolist(),
+                                                 cols['battery_volts'][atc].tolist(),
+                                                 cols['counter'][atc].tolist()):
+        out[i] = {'temp': temp, 'hum': hum, 'batt': batt, 'battery_volts': vbat, 'counter': counter}
+
+    pvvx = np.nonzero(kind == KIND_PVVX)[0]
+    for i, temp, hum, vbat, batt, counter, flag in zip(pvvx.tolist(), cols['temp'][pvvx].tolist(),
+                                                       cols['hum'][pvvx].tolist(),
+                                                       cols['battery_volts'][pvvx].tolist(),
+                                                       cols['batt'][pvvx].tolist(),
+                                                       cols['counter'][pvvx].tolist(),
+                                                       cols['flag'][pvvx].tolist()):
+        out[i] = {'temp': temp, 'hum': hum, 'battery_volts': vbat, 'batt': batt, 'counter': counter, 'flag': flag}
+
+    for i in np.nonzero(kind == KIND_NONE)[0].tolist():
+        out[i] = decode_ble(frames[i])
+    return out
+
+
+# Corpus frames with random sensor bytes, as a day of published raw_data would look:
+# mostly LYWSD03MMC sensors, OTHERS of the frames from the other formats
+OTHERS = 0.1
+
+
+def synth_frames(n, seed=1):
+    from corpus import CORPUS
+
+    rng = np.random.default_rng(seed)
+    base = [frame for _, frame, _ in CORPUS]
+    weights = np.array([1.0 if fmt in ('atc1441', 'pvvx') else 0.0 for fmt, _, _ in CORPUS])
+    weights = weights / weights.sum() * (1 - OTHERS) + (weights == 0) * OTHERS / (weights == 0).sum()
+    picks = rng.choice(len(base), n, p=weights)
+    noise = rng.integers(0, 256, (n, 4), dtype=np.uint8)
+    frames = []
+    for i in range(n):
+        frame = bytearray.fromhex(base[picks[i]])
+        frame[-4:] = noise[i].tobytes()
+        frames.append(frame.hex())
+    return frames
+
+
+def bench(n):
+    from time import perf_counter
+
+    frames = synth_frames(n)
+    t0 = perf_counter()
+    scalar = [decode_ble(f) for f in frames]
+    t_scalar = perf_counter() - t0
+    t0 = perf_counter()
+    bulk = decode_bulk(frames)
+    t_bulk = perf_counter() - t0
+    t0 = perf_counter()
+    matrix, lengths = hex_to_matrix(frames)
+    decode_matrix(matrix, lengths)
+    t_cols = perf_counter() - t0
+
+    mismatches = sum(1 for a, b in zip(scalar, bulk) if a != b)
+    print('{} frames, {} mismatches against decode_ble()'.format(n, mismatches))
+    print('scalar decode_ble() {:>10.0f} frames/s'.format(n / t_scalar))
+    print('decode_bulk()       {:>10.0f} frames/s  x{:.1f}'.format(n / t_bulk, t_scalar / t_bulk))
+    print('columns only        {:>10.0f} frames/s  x{:.1f}'.format(n / t_cols, t_scalar / t_cols))
+    return mismatches
+
+
+if __name__ == '__main__':
+    sys.exit(1 if bench(int(sys.argv[1]) if len(sys.argv) > 1 else 200000) else 0)
@@ -0,0 +1,81 @@
+# corpus.py Reference advertisements for every supported format.
+# Each entry is (format, hex advertisement, expected decode_ble() output).
+# Used by the host benchmarks, which check decode_ble() against it before timing.
+
+CORPUS = [
+    # LYWSD03MMC ATC1441 firmware, with AdFlags
+    ('atc1441', '020106' '10161a18' 'a4c138aabbcc' '0102' '2d' '5c' '0b81' '1e',
+     {'temp': 25.8, 'hum': 45, 'batt': 92, 'battery_volts': 2945, 'counter': 30}),
+    # ATC1441 without AdFlags, below zero
+    ('atc1441', '10161a18' 'a4c138aabbcc' 'ffc4' '50' '3c' '0a8c' '07',
+     {'temp': -6.0, 'hum': 80, 'batt': 60, 'battery_volts': 2700, 'counter': 7}),
+    # LYWSD03MMC PVVX firmware, with AdFlags
+    ('pvvx', '020106' '12161a18' 'ccbbaa38c1a4' '1a0a' 'a011' '810b' '5c' '1e' '05',
+     {'temp': 25.86, 'hum': 45.12, 'battery_volts': 2945, 'batt': 92, 'counter': 30, 'flag': 5}),
+    # PVVX after a complete local name
+    ('pvvx', '020106' '0809415443' '5f313233' '12161a18' 'ccbbaa38c1a4' '06ff' '8813' '400b' '32' '02' '00',
+     {'temp': -2.5, 'hum': 50.0, 'battery_volts': 2880, 'batt': 50, 'counter': 2, 'flag': 0}),
+    # BTHome v2: packet id 17, battery 97 %, 25.00 C, 50.55 %
+    ('bthome', '020106' '0e16d2fc' '40' '0011' '0161' '02c409' '03bf13',
+     {'counter': 17, 'batt': 97, 'temp': 25.0, 'hum': 50.55}),
+    # BTHome v2: voltage 3.074 V, pressure 1008.83 hPa, an unknown object ends the parse
+    ('bthome', '020106' '0d16d2fc' '40' '0c020c' '04138a01' 'ff01',
+     {'voltage': 3.074, 'pressure': 1008.83}),
+    # MiBeacon v2 (LYWSDCGQ): temperature and humidity object
+    ('mibeacon', '020106' '151695fe' '5020' 'aa01' 'da' '672613342d58' '0d10' '04' 'e400a001',
+     {'temp': 22.8, 'hum': 41.6, 'counter': 218}),
+    # MiBeacon v3 with capability byte: battery object
+    ('mibeacon', '020106' '131695fe' '7030' '5b05' '03' '0a0b0c0d0e0f' '08' '0a10' '01' '5d',
+     {'batt': 93, 'counter': 3}),
+    # RuuviTag data format 5 (reference vector from the Ruuvi documentation)
+    ('ruuvi', '020106' '1bff9904' '0512fc5394c37c0004fffc040cac364200cdcbb8334c884f',
+     {'temp': 24.3, 'hum': 53.49, 'pressure': 1000.44, 'acc_x': 4, 'acc_y': -4, 'acc_z': 1036,
+      'battery_volts': 2977, 'tx_power': 4, 'movement': 66, 'counter': 205}),
+    # Govee H5075: 21.6 C, 62.3 %, battery 94 %
+    ('govee', '020106' '09ff88ec' '00034e2f5e00',
+     {'temp': 21.6, 'hum': 62.3, 'batt': 94}),
+    # Govee H5075 below zero: -5.3 C, 71.2 %
+    ('govee', '09ff88ec' '0080d1d06400',
+     {'temp': -5.3, 'hum': 71.2, 'batt': 100}),
+    # iBeacon
+    ('ibeacon', '020106' '1aff4c00' '0215' 'e2c56db5dffb48d2b060d0f5a71096e0' '0001' '0002' 'c5',
+     {'uuid': 'e2c56db5dffb48d2b060d0f5a71096e0', 'major': 1, 'minor': 2, 'tx_power': -59}),
+    # Apple continuity frame from a phone: not decodable
+    ('unknown', '02011a' '0aff4c00' '1005031c1a7b9e',
+     {}),
+    # Truncated AD structure
+    ('unknown', '020106' '10161a18' 'a4c138',
+     {}),
+]
+
+# Two consecutive frames of one device per format: (format, first, next). The next frame
+# carries a new measurement (and the next counter value where the format has one), so
+# is_duplicate() must let it through while it drops a repeat of the first.
+CONSECUTIVE = [
+    ('atc1441', '020106' '10161a18' 'a4c138aabbcc' '0102' '2d' '5c' '0b81' '1e',
+     '020106' '10161a18' 'a4c138aabbcc' '0103' '2d' '5c' '0b81' '1f'),
+    ('pvvx', '020106' '12161a18' 'ccbbaa38c1a4' '1a0a' 'a011' '810b' '5c' '1e' '05',
+     '020106' '12161a18' 'ccbbaa38c1a4' '240a' 'a011' '810b' '5c' '1f' '05'),
+    ('bthome', '020106' '0e16d2fc' '40' '0011' '0161' '02c409' '03bf13',
+     '020106' '0e16d2fc' '40' '0012' '0161' '02c509' '03bf13'),
+    ('mibeacon', '020106' '151695fe' '5020' 'aa01' 'da' '672613342d58' '0d10' '04' 'e400a001',
+     '020106' '151695fe' '5020' 'aa01' 'db' '672613342d58' '0d10' '04' 'e500a001'),
+    ('ruuvi', '020106' '1bff9904' '0512fc5394c37c0004fffc040cac364200cdcbb8334c884f',
+     '020106' '1bff9904' '0513005394c37c0004fffc040cac364200cecbb8334c884f'),
+    ('govee', '020106' '09ff88ec' '00034e2f5e00',
+     '020106' '09ff88ec' '00034e305e00'),
+    ('ibeacon', '020106' '1aff4c00' '0215' 'e2c56db5dffb48d2b060d0f5a71096e0' '0001' '0002' 'c5',
+     '020106' '1aff4c00' '0215' 'e2c56db5dffb48d2b060d0f5a71096e0' '0001' '0003' 'c5'),
+]
+
+# Encrypted advertisements: (format, address, bindkey, hex advertisement, expected output)
+ENCRYPTED = [
+    # PVVX custom encrypted format: 23.45 C, 48.12 %, 87 %, counter 42, trigger flags 1
+    ('pvvx_enc', 'a4:c1:38:aa:bb:cc', '231d39c1d7cc1ab1aee224cd096db932',
+     '020106' '0e161a18' '2a' '1f874109ed69' '96b01b9b',
+     {'temp': 23.45, 'hum': 48.12, 'batt': 87, 'counter': 42, 'flag': 1}),
+    # BTHome v2 encrypted (key, address and counter of the bthome.io example): 25.06 C, 50.55 %
+    ('bthome_enc', '54:48:e6:8f:80:a5', '231d39c1d7cc1ab1aee224cd096db932',
+     '020106' '1216d2fc' '41' 'a47266c95f73' '00112233' '78237214',
+     {'temp': 25.06, 'hum': 50.55}),
+]
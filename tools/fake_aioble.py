@@ -0,0 +1,136 @@
+# fake_aioble.py Stand-in for the aioble scan API, to run ble_scan.Scanner on the host
+# scan() yields corpus frames from `devices` addresses at `rate` frames/s, of which the
+# scan catches window_us / interval_us. A duration ends the scan like aioble does; fail_every makes every n-th scan raise after fail_after
+# frames, fail_start makes the first n scans raise on entry (controller not ready).
+# Like aioble, every scan keeps the devices it saw and only yields a frame when the device
+# is new or its advertising data changed. Devices change their data every `repeat` frames,
+# the first `static` devices never do (beacons), the next `churn` ones advertise from a new
+# random address every frame (phones). `cached` is the largest per-scan device set so far.
+# During an active scan the next `names` devices answer with a scan response carrying
+# their name: aioble yields the result again with the same adv_data and the resp_data.
+
+import sys
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+
+from ble_capture import ReplayResult, sleep_ms, ticks_ms, ticks_diff
+from ble_decoder import unhexlify
+from corpus import CORPUS
+
+
+class FakeBle:
+    def __init__(self, rate=500, devices=50, fail_every=0, fail_after=100, fail_start=0, start_ms=5, repeat=1,
+                 static=0, churn=0, names=0):
+        self.rate = rate
+        self.devices = devices
+        self.repeat = repeat
+        self.static = static
+        self.churn = churn
+        self.names = names
+        self.fail_every = fail_every
+        self.fail_after = fail_after
+        self.fail_start = fail_start
+        self.start_ms = start_ms  # Controller setup time of every scan start
+        self.scans = 0
+        self.frames = 0
+        self.cached = 0
+        self.responses = 0
+        self._sent = [0] * devices
+        self.t0 = ticks_ms()  # Devices advertise on a fixed schedule from here, scanning or not
+        self._advs = [unhexlify(frame) for _, frame, _ in CORPUS]
+
+    # Same signature as aioble.scan()
+    def scan(self, duration_ms, interval_us=1280000, window_us=11250, active=False):
+        return FakeScan(self, duration_ms, window_us / interval_us, active)
+
+    def result(self):
+        device = self.frames % self.devices
+        n = self._sent[device]
+        self._sent[device] += 1
+        self.frames += 1
+        adv = bytearray(self._advs[device % len(self._advs)])
+        if device >= self.static:
+            adv[-1] = (adv[-1] + n // self.repeat) & 0xFF
+        if self.static <= device < self.static + self.churn:
+            addr = bytes((0x40 | n >> 16 & 0x3F, n >> 8 & 0xFF, n & 0xFF, 0x80, device >> 8, device & 0xFF))
+        else:
+            addr = bytes((0xa4, 0xc1, 0x38, 0, device >> 8, device & 0xFF))
+        return ReplayResult(0, addr, -60 - device % 30, bytes(adv))
+
+    # Scan response of a device that has a name, else None
+    def response(self, addr):
+        device = addr[4] << 8 | addr[5]
+        first = self.static + self.churn
+        if addr[0] != 0xa4 or not first <= device < first + self.names:
+            return None
+        name = 'Fake_{:04x}'.format(device).encode()
+        return bytes((len(name) + 1, 0x09)) + name
+
+
+class FakeScan:
+    def __init__(self, ble, duration_ms, duty, active=False):
+        self._ble = ble
+        self._duration = duration_ms
+        self._duty = duty
+        self._active = active
+        self._response = None  # Result with the scan response, yielded next
+        self._caught = 0
+        self._n = 0
+        self._cancelled = False
+        self._results = {}  # addr: [adv_data, resp_data], aioble's set of ScanResult
+
+    async def __aenter__(self):
+        ble = self._ble
+        ble.scans += 1
+        await sleep_ms(ble.start_ms)
+        if ble.scans <= ble.fail_start:
+            raise OSError(16)  # EBUSY, as the controller answers while still stopping the previous scan
+        self._fail = ble.fail_every and ble.scans % ble.fail_every == 0
+        self._t0 = ticks_ms()
+        self._slot = ticks_diff(self._t0, ble.t0) * ble.rate // 1000
+        return self
+
+    async def __aexit__(self, *_):
+        pass
+
+    async def cancel(self):
+        self._cancelled = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        ble = self._ble
+        while True:
+            if self._cancelled or self._duration and ticks_diff(ticks_ms(), self._t0) >= self._duration:
+                raise StopAsyncIteration
+            if self._response is not None:
+                result = self._response
+                self._response = None
+                return result
+            if self._fail and self._n >= ble.fail_after:
+                raise OSError(5)
+            # Frames sent while no scan was running are lost, and outside the scan window too
+            self._slot += 1
+            await sleep_ms(max(0, self._slot * 1000 // ble.rate - ticks_diff(ticks_ms(), ble.t0)))
+            self._caught += self._duty
+            if self._caught >= 1:
+                self._caught -= 1
+                self._n += 1
+                result = ble.result()
+                addr = result.device.addr
+                cached = self._results.get(addr)
+                if cached is None:
+                    cached = self._results[addr] = [None, None]
+                    ble.cached = max(ble.cached, len(self._results))
+                resp = ble.response(addr) if self._active else None
+                if resp is not None and resp != cached[1]:
+                    cached[1] = resp
+                    self._response = ReplayResult(0, addr, result.rssi, result.adv_data)
+                    self._response.resp_data = resp
+                    ble.responses += 1
+                if cached[0] == result.adv_data:
+                    continue
+                cached[0] = result.adv_data
+                return result
@@ -0,0 +1,125 @@
+# payload_decode.py Host side decoder of the gateway payloads (see ble_codec.py)
+#   python3 tools/payload_decode.py json|cbor|binary <payload hex>
+# decode(payload, codec) returns a list of frame dicts (one, or a whole batch), with
+# raw_data as a hex string whatever the codec sent, like the JSON payloads have it.
+
+import sys
+import json
+import struct
+
+sys.path.insert(0, '.')
+from ble_codec import RECORD_CBOR, RECORD_THERMO, THERMO, THERMO_SIZE
+from ble_util import addr_hex
+
+
+# (object, next offset) of the CBOR item at data[i:]
+def cbor_item(data, i=0):
+    head = data[i]
+    major = head >> 5
+    info = head & 0x1F
+    i += 1
+    if major == 7:
+        if info == 20:
+            return False, i
+        if info == 21:
+            return True, i
+        if info == 22:
+            return None, i
+        if info == 25:
+            return _half(struct.unpack_from('>H', data, i)[0]), i + 2
+        if info == 26:
+            return struct.unpack_from('>f', data, i)[0], i + 4
+        if info == 27:
+            return struct.unpack_from('>d', data, i)[0], i + 8
+        raise ValueError('Unsupported simple value {}'.format(info))
+    if info < 24:
+        n = info
+    else:
+        size = {24: 1, 25: 2, 26: 4, 27: 8}[info]
+        n = int.from_bytes(data[i:i + size], 'big')
+        i += size
+    if major == 0:
+        return n, i
+    if major == 1:
+        return -1 - n, i
+    if major == 2:
+        return bytes(data[i:i + n]), i + n
+    if major == 3:
+        return bytes(data[i:i + n]).decode(), i + n
+    if major == 4:
+        items = []
+        for _ in range(n):
+            item, i = cbor_item(data, i)
+            items.append(item)
+        return items, i
+    if major == 5:
+        obj = {}
+        for _ in range(n):
+            key, i = cbor_item(data, i)
+            obj[key], i = cbor_item(data, i)
+        return obj, i
+    raise ValueError('Unsupported major type {}'.format(major))
+
+
+def _half(h):
+    exp = h >> 10 & 0x1F
+    mant = h & 0x3FF
+    val = mant * 2.0 ** -24 if exp == 0 else (mant + 1024) * 2.0 ** (exp - 25) if exp != 31 else float('inf')
+    return -val if h & 0x8000 else val
+
+
+def cbor_decode(data):
+    obj, end = cbor_item(data)
+    if end != len(data):
+        raise ValueError('{} trailing bytes'.format(len(data) - end))
+    return obj
+
+
+def _hex_raw(frame):
+    if isinstance(frame.get('raw_data'), bytes):
+        frame['raw_data'] = frame['raw_data'].hex()
+    return frame
+
+
+def binary_records(data):
+    i = 0
+    while i < len(data):
+        size = struct.unpack_from('<H', data, i)[0]
+        record = data[i + 2:i + 2 + size]
+        i += 2 + size
+        if record[0] == RECORD_THERMO and size >= THERMO_SIZE:
+            _, addr, rssi, timestamp, temp, hum, batt, mv, counter = struct.unpack_from(THERMO, record)
+            data_ = {'temp': temp / 100, 'hum': hum / 100, 'counter': counter}
+            if batt != 0xFF:
+                data_['batt'] = batt
+            if mv:
+                data_['battery_volts'] = mv
+            frame = {'addr': addr_hex(addr), 'rssi': rssi, 'timestamp': timestamp,
+                     'data': data_}
+            if size > THERMO_SIZE:
+                frame['raw_data'] = bytes(record[THERMO_SIZE:]).hex()
+            yield frame
+        elif record[0] == RECORD_CBOR:
+            yield _hex_raw(cbor_decode(record[1:]))
+        else:
+            raise ValueError('Unknown record type {}'.format(record[0]))
+
+
+def decode(payload, codec):
+    if codec == 'json':
+        obj = json.loads(payload)
+        return obj if isinstance(obj, list) else [obj]
+    if codec == 'cbor':
+        obj = cbor_decode(payload)
+        return [_hex_raw(f) for f in obj] if isinstance(obj, list) else [_hex_raw(obj)]
+    if codec == 'binary':
+        return list(binary_records(payload))
+    raise ValueError('Unknown codec ' + codec)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: payload_decode.py json|cbor|binary <payload hex>')
+        sys.exit(1)
+    for frame in decode(bytes.fromhex(sys.argv[2]), sys.argv[1]):
+        print(json.dumps(frame))
@@ -0,0 +1,181 @@
+# recv_fragments.py Receive path of lib/mqtt_as against a scripted socket (host, CPython)
+#   python3 tools/recv_fragments.py [rounds]
+# FakeSocket replays a byte stream (a PUBACK storm for pipelined publishes, SUBACKs,
+# UNSUBACKs with pids that look like packet types, PINGRESPs and inbound QoS 0 / 1 messages up to 3 kB, MQTT 3.1.1 and 5) cut into
+# fragments: all at once, random sizes with "no data yet" gaps in between, and one byte
+# at a time. wait_msg() runs until the stream is consumed and every message, PUBACK,
+# (UN)SUBACK and the PUBACKs the client sends back are checked. Reported per mode: socket
+# reads per packet, and _as_read() calls per packet (what the code before the receive
+# buffer made, at least one socket read each plus the type byte).
+
+import sys
+import random
+import asyncio
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+import upy_host  # noqa: F401
+import mqtt_as
+from mqtt_as import MQTTClient, Delivery
+from stub_broker import varint
+
+
+class FakeSocket:
+    def __init__(self, fragments):
+        self._fragments = fragments
+        self._i = 0
+        self._part = None
+        self.reads = 0
+        self.written = bytearray()
+
+    def done(self):
+        return self._part is None and self._i >= len(self._fragments)
+
+    def readinto(self, buf, n=None):
+        self.reads += 1
+        if self._part is None:
+            if self._i >= len(self._fragments):
+                return None
+            self._part = self._fragments[self._i]
+            self._i += 1
+            if self._part is None:  # Nothing arrived yet
+                return None
+        n = min(len(buf), len(self._part), n or len(buf))
+        buf[:n] = self._part[:n]
+        self._part = self._part[n:] or None
+        return n
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def packet(kind, body):
+    return bytes((kind,)) + varint(len(body)) + body
+
+
+def script(rng, v5):
+    stream = bytearray()
+    expected = {'msgs': [], 'pubacks': [], 'subacks': [], 'sent': bytearray()}
+    for _ in range(rng.randrange(40, 80)):
+        pick = rng.random()
+        if pick < 0.6:  # PUBACK storm
+            pid = rng.randrange(1, 65536)
+            if pid not in expected['pubacks']:
+                expected['pubacks'].append(pid)
+                stream += packet(0x40, pid.to_bytes(2, 'big') + (b'\x00\x00' if v5 and rng.random() < 0.5 else b''))
+        elif pick < 0.65:
+            pid = rng.randrange(1, 65536)
+            if pid not in expected['subacks']:
+                expected['subacks'].append(pid)
+                stream += packet(0x90, pid.to_bytes(2, 'big') + (b'\x00' if v5 else b'') + b'\x01')
+        elif pick < 0.68:
+            # Pid bytes 0x40 / 0x30 read as a type byte would start a PUBACK / PUBLISH
+            pid = rng.choice((0x4040, 0x3030, 0x0130, rng.randrange(1, 65536)))
+            if pid not in expected['subacks']:
+                expected['subacks'].append(pid)
+                stream += packet(0xB0, pid.to_bytes(2, 'big') + (b'\x00\x00' if v5 else b''))
+        elif pick < 0.7:
+            stream += b'\xd0\x00'
+        else:
+            qos = rng.randrange(2)
+            retain = rng.randrange(2)
+            topic = 'ble_gateway/cmd/{}'.format(rng.randrange(1000)).encode()
+            msg = bytes(rng.randrange(256) for _ in range(rng.choice((0, 5, 100, 700, 3000))))
+            body = len(topic).to_bytes(2, 'big') + topic
+            if qos:
+                pid = rng.randrange(1, 65536)
+                body += pid.to_bytes(2, 'big')
+                expected['sent'] += b'\x40\x02' + pid.to_bytes(2, 'big')
+            if v5:
+                body += b'\x00'
+            stream += packet(0x30 | qos << 1 | retain, body + msg)
+            expected['msgs'].append((topic, msg, bool(retain)))
+    return bytes(stream), expected
+
+
+def fragment(rng, stream, mode):
+    if mode == 'whole':
+        return [stream]
+    if mode == 'bytes':
+        return [stream[i:i + 1] for i in range(len(stream))]
+    fragments = []
+    i = 0
+    while i < len(stream):
+        if rng.random() < 0.3:
+            fragments.append(None)
+        n = rng.randrange(1, 65)
+        fragments.append(stream[i:i + n])
+        i += n
+    return fragments
+
+
+async def check(seed, mode, v5):
+    rng = random.Random(seed)
+    stream, expected = script(rng, v5)
+    received = []
+    config = dict(mqtt_as.config)
+    config.update(server='localhost', mqttv5=v5, subs_cb=lambda topic, msg, retained, *_:
+                  received.append((topic, msg, retained)))
+    client = MQTTClient(config)
+    client._isconnected = True
+    sock = client._sock = FakeSocket(fragment(rng, stream, mode))
+    deliveries = {}
+    for pid in expected['pubacks']:
+        d = deliveries[pid] = client._inflight[pid] = Delivery('t', b'', False, None)
+        d.pid = pid
+        d.t = d.t0 = upy_host.ticks_ms()
+    for pid in expected['subacks']:
+        client.rcv_pids[pid] = asyncio.Event()
+    events = dict(client.rcv_pids)
+
+    as_reads = 0
+    as_read = client._as_read
+
+    async def counted(n, s=None):
+        nonlocal as_reads
+        as_reads += 1
+        return await as_read(n, s)
+
+    client._as_read = counted
+    while not sock.done() or client._rstart != client._rend:
+        await client.wait_msg()
+    packets = len(expected['pubacks']) + len(expected['subacks']) + len(expected['msgs']) + stream.count(b'\xd0\x00')
+    errors = []
+    if received != expected['msgs']:
+        errors.append('messages')
+    if client._inflight or not all(d.ok for d in deliveries.values()):
+        errors.append('pubacks')
+    if client.rcv_pids or not all(e.is_set() for e in events.values()):
+        errors.append('subacks')
+    if bytes(sock.written) != bytes(expected['sent']):
+        errors.append('sent pubacks')
+    return errors, packets, sock.reads, as_reads
+
+
+async def main(rounds):
+    print('{:<8} {:>4} {:>8} {:>10} {:>12} {:>14}'.format('mode', 'v5', 'packets', 'errors', 'reads/pkt',
+                                                           '_as_read/pkt'))
+    failed = 0
+    for mode in ('whole', 'random', 'bytes'):
+        for v5 in (False, True):
+            packets = reads = as_reads = errors = 0
+            for seed in range(rounds):
+                err, p, r, a = await check(seed, mode, v5)
+                if err:
+                    print('seed', seed, mode, 'v5' if v5 else '', 'wrong', ', '.join(err))
+                errors += bool(err)
+                packets += p
+                reads += r
+                as_reads += a
+            failed += errors
+            print('{:<8} {:>4} {:>8} {:>10} {:>12.2f} {:>14.2f}'.format(mode, 'yes' if v5 else 'no', packets, errors,
+                                                                      reads / packets, as_reads / packets))
+    return failed
+
+
+if __name__ == '__main__':
+    sys.exit(1 if asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)) else 0)
@@ -0,0 +1,69 @@
+# replay.py Replay a frame capture through the gateway decoding pipeline on the host
+#   python3 tools/replay.py capture.bin [speed]
+#   python3 tools/replay.py --synth capture.bin [frames]
+# speed is relative to the capture (0 = as fast as possible, the default). --synth writes
+# a capture of corpus frames from 200 devices, for trying the pipeline out.
+# The pipeline mirrors get_ble_adv(): duplicate check, cached decode and JSON payload.
+
+import sys
+import json
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from ble_capture import Recorder, ReplayScan
+from ble_decoder import decode_cached, is_duplicate, adv_hex, affinity_stats, unhexlify
+from bench_util import now_us, elapsed_us
+from corpus import CORPUS
+
+DEVICES = 200
+
+
+def synth(path, frames):
+    advs = [bytearray(unhexlify(frame)) for _, frame, _ in CORPUS]
+    with open(path, 'wb') as f:
+        recorder = Recorder(f)
+        for i in range(frames):
+            device = i % DEVICES
+            adv = advs[device % len(advs)]
+            # Bump the last byte now and then (the counter for ATC1441/PVVX) so some frames are new
+            if i % 7 == 0:
+                adv[-1] = (adv[-1] + 1) & 0xFF
+            recorder.record(0, bytes((0xa4, 0xc1, 0x38, 0, device >> 8, device & 0xFF)), -60 - device % 30, adv)
+        recorder.flush()
+    print('Wrote', frames, 'frames to', path)
+
+
+async def replay(path, speed):
+    frames = dropped = decoded = 0
+    latest = {}
+    t0 = now_us()
+    async with ReplayScan(path, speed) as scanner:
+        async for result in scanner:
+            frames += 1
+            addr = result.device.addr
+            if is_duplicate(addr, result.adv_data):
+                dropped += 1
+                continue
+            data = decode_cached(addr, result.adv_data)
+            if data:
+                decoded += 1
+            latest[addr] = json.dumps({'addr': result.device.addr_hex(), 'rssi': result.rssi,
+                                       'raw_data': adv_hex(result.adv_data), 'data': data})
+    us = elapsed_us(t0)
+    print('{} frames in {:.0f} ms: {:.0f} frames/s'.format(frames, us / 1000, frames * 1000000 / us if us else 0))
+    print('{} duplicates dropped, {} decoded, {} devices'.format(dropped, decoded, len(latest)))
+    print('Affinity', affinity_stats)
+
+
+if len(sys.argv) > 2 and sys.argv[1] == '--synth':
+    synth(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 100000)
+elif len(sys.argv) > 1:
+    asyncio.run(replay(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 0))
+else:
+    print('Usage: replay.py capture.bin [speed] | --synth capture.bin [frames]')
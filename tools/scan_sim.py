@@ -0,0 +1,165 @@
+# scan_sim.py Continuous vs restarted scanning against tools/fake_aioble.py
+#   python3 tools/scan_sim.py [seconds]
+# "restart" is the old loop of 1000 ms scans, "continuous" is ble_scan.Scanner with
+# duration 0, then the same with injected scan failures to show the backoff. The
+# adaptive runs add ble_scan.DutyCycle and a publisher whose write latency grows with the
+# scan duty cycle, as WiFi and BLE share the radio, on a quiet and a busy site. The session
+# runs compare one endless scan with sessions ending on a timer or a device count, on a site
+# with beacons that never change their data and phones that change their address. The
+# name runs scan actively and check that handle_adv()'s pipeline caches the names of scan
+# responses, which repeat the last advertisement and so are duplicates.
+
+import sys
+
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from ble_scan import Scanner, ScanStats, DutyCycle
+from ble_store import DeviceStore
+from ble_decoder import decode_cached, is_duplicate, affinity_clear
+from ble_capture import sleep_ms, ticks_ms, ticks_diff
+from fake_aioble import FakeBle
+
+RATE = 500
+START_MS = 40  # Stop + start of a scan on the ESP32 controller takes tens of ms
+
+
+async def restart_loop(ble, stats, seconds):
+    stopped = None
+    t0 = ticks_ms()
+    while ticks_diff(ticks_ms(), t0) < seconds * 1000:
+        async with ble.scan(1000, 30000, 30000) as scanner:
+            if stopped is not None:
+                stats.last_gap_ms = ticks_diff(ticks_ms(), stopped)
+                stats.gap_ms += stats.last_gap_ms
+            async for result in scanner:
+                stats.frames += 1
+        stopped = ticks_ms()
+        stats.restarts += 1
+
+
+async def supervised(ble, stats, seconds):
+    scanner = Scanner(lambda: ble.scan(0, 30000, 30000), stats, session_ms=0, session_devices=0,
+                      log=lambda msg: None)
+    task = asyncio.create_task(scanner.run(lambda result: None))
+    await sleep_ms(seconds * 1000)
+    scanner.stop()
+    await task
+
+
+PUBLISH_MS = 10  # Write latency with the radio free for WiFi
+
+
+async def adaptive(name, rate, devices, seconds):
+    ble = FakeBle(rate, devices, start_ms=START_MS)
+    stats = ScanStats()
+    duty = DutyCycle(stats, period_ms=1000, log=lambda msg: print('  ', msg))
+    scanner = Scanner(lambda: ble.scan(0, duty.interval_us, duty.window_us), stats, session_ms=0, session_devices=0,
+                      log=lambda msg: None)
+    pending = set()
+
+    def on_result(result):
+        stats.new += 1
+        pending.add(result.device.addr)
+
+    task = asyncio.create_task(scanner.run(on_result))
+    duty_task = asyncio.create_task(duty.run(scanner))
+    published = 0
+    t0 = ticks_ms()
+    print(name)
+    while ticks_diff(ticks_ms(), t0) < seconds * 1000:
+        duty.publish_begin(len(pending))
+        while pending:
+            pending.pop()
+            ms = PUBLISH_MS * (1 + 4 * duty.window_us / duty.interval_us)
+            await sleep_ms(int(ms))
+            duty.published(ms)
+            published += 1
+        duty.publish_end()
+        await sleep_ms(500)
+    scanner.stop()
+    duty_task.cancel()
+    await task
+    print('   {} frames, {} published, {}'.format(stats.frames, published, duty.as_dict()))
+
+
+async def sessions(name, session_ms, session_devices, seconds):
+    static = 50
+    ble = FakeBle(RATE, 200, start_ms=START_MS, repeat=3, static=static, churn=20)
+    stats = ScanStats()
+    scanner = Scanner(lambda: ble.scan(0, 30000, 30000), stats, session_ms=session_ms,
+                      session_devices=session_devices, log=lambda msg: None)
+    beacons = [0] * static
+
+    def on_result(result):
+        device = result.device.addr[4] << 8 | result.device.addr[5]
+        if device < static and result.device.addr[0] == 0xa4:
+            beacons[device] += 1
+
+    task = asyncio.create_task(scanner.run(on_result))
+    await sleep_ms(seconds * 1000)
+    scanner.stop()
+    await task
+    print('{:<22} {:>6} frames {:>3} sessions {:>5} ms gap {:>5} max cached, beacons seen {}-{} times'.format(
+        name, stats.frames, stats.sessions, stats.gap_ms, ble.cached, min(beacons), max(beacons)))
+
+
+# Frame handling of main.handle_adv(), names from duplicates only kept with responses
+async def names(name, responses, seconds):
+    affinity_clear()
+    ble = FakeBle(RATE, 50, start_ms=START_MS, repeat=3, names=50)
+    store = DeviceStore(64)
+    scanner = Scanner(lambda: ble.scan(0, 30000, 30000, active=True), ScanStats(), session_ms=0, session_devices=0,
+                      log=lambda msg: None)
+
+    def on_result(result):
+        addr = result.device.addr
+        if is_duplicate(addr, result.adv_data):
+            if responses and result.resp_data and store.wants_name(addr):
+                store.set_name(addr, result.name())
+            store.touch(addr, result.rssi)
+            return
+        data = decode_cached(addr, result.adv_data)
+        name = result.name() if result.resp_data or store.wants_name(addr) else None
+        store.put(addr, result.rssi, 0, result.adv_data, data, name)
+
+    task = asyncio.create_task(scanner.run(on_result))
+    await sleep_ms(seconds * 1000)
+    scanner.stop()
+    await task
+    named = sum(1 for addr in store.addrs() if store.name(addr) and store.frame(addr).get('data'))
+    unnamed = store.unnamed_sensors()
+    print('{:<22} {:>4} scan responses, {} of {} sensors named'.format(name, ble.responses, named, named + unnamed))
+    return unnamed
+
+
+async def run(name, loop, ble, seconds):
+    stats = ScanStats()
+    t0 = ticks_ms()
+    await loop(ble, stats, seconds)
+    ms = ticks_diff(ticks_ms(), t0)
+    print('{:<12} {:>6.0f} frames/s {:>5.1f} % of sent {:>4} restarts {:>3} errors {:>6} ms gap'.format(
+        name, stats.frames * 1000 / ms, stats.frames * 100 / (ms * RATE / 1000), stats.restarts, stats.errors,
+        stats.gap_ms))
+
+
+async def main(seconds):
+    await run('restart', restart_loop, FakeBle(RATE, start_ms=START_MS), seconds)
+    await run('continuous', supervised, FakeBle(RATE, start_ms=START_MS), seconds)
+    await run('failing', supervised, FakeBle(RATE, start_ms=START_MS, fail_every=2, fail_after=RATE, fail_start=3),
+              seconds)
+    await adaptive('adaptive, quiet site', 5, 5, seconds)
+    await adaptive('adaptive, busy site', 500, 200, seconds)
+    await sessions('one session', 0, 0, seconds)
+    await sessions('2 s sessions', 2000, 0, seconds)
+    await sessions('128 device sessions', 0, 128, seconds)
+    await names('names, adv only', False, seconds)
+    return await names('names, responses', True, seconds)
+
+
+sys.exit(1 if asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)) else 0)
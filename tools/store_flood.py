@@ -0,0 +1,116 @@
+# store_flood.py Flood the device table with random addresses on the host
+#   python3 tools/store_flood.py [frames]
+# 90 % of the frames come from random (rotating) addresses, the rest from SENSORS fixed
+# sensors whose frames decode. Checks that the table never exceeds its capacity, that the
+# sensors survive the flood, that idle devices expire, that the drain() queue stays bounded
+# although the publisher here never drains it, and that the heap used stays within
+# HEAP_LIMIT_KB, compared against an unbounded dict (the old frame_dict). The clock is
+# simulated: FRAME_MS per frame. Exits 1 when a check fails.
+
+import sys
+import random
+
+sys.path.insert(0, '.')
+import ble_store
+from ble_store import DeviceStore
+from ble_util import addr_hex
+
+CAPACITY = 256
+TTL_S = 600
+SENSORS = 50
+FRAME_MS = 5
+PUBLISH_EVERY = 100  # Frames between two publisher passes
+HEAP_LIMIT_KB = 128  # The table itself takes about 90 kB on the host
+
+clock = [0]
+ble_store.ticks_ms = lambda: clock[0]
+
+
+def frames(n, rng):
+    sensors = [bytes((0xa4, 0xc1, 0x38, 0, 0, i)) for i in range(SENSORS)]
+    adv = bytes.fromhex('0201061a1801a4c1380000001a2b3c')
+    data = {'temp': 21.5}
+    for i in range(n):
+        if rng.random() < 0.1:
+            yield sensors[i % SENSORS], adv, data
+        else:
+            yield bytes(rng.getrandbits(8) for _ in range(6)), adv, None
+
+
+def heap(func):
+    try:
+        import tracemalloc
+    except ImportError:
+        import gc
+        gc.collect()
+        before = gc.mem_alloc()
+        result = func()
+        gc.collect()
+        return result, gc.mem_alloc() - before
+    tracemalloc.start()
+    result = func()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, used
+
+
+def flood(n):
+    store = DeviceStore(CAPACITY, TTL_S)
+    largest = 0
+    longest = 0
+    for i, (addr, adv, data) in enumerate(frames(n, random.Random(1))):
+        clock[0] += FRAME_MS
+        store.put(addr, -70, clock[0] // 1000, adv, data)
+        largest = max(largest, len(store))
+        longest = max(longest, store.queued())
+        if i % PUBLISH_EVERY == 0:
+            store.expire()
+            for pending in store.pending():
+                version = store.version(pending)
+                store.frame(pending)
+                store.published(pending, version)
+    return store, largest, longest
+
+
+def unbounded(n):
+    frame_dict = {}
+    for addr, adv, data in frames(n, random.Random(1)):
+        frame_dict[addr_hex(addr)] = {'addr': addr_hex(addr), 'rssi': -70, 'raw_data': adv, 'data': data}
+    for addr in frame_dict:
+        frame_dict[addr] = None
+    return frame_dict
+
+
+def main(n):
+    failed = 0
+    (store, largest, longest), store_bytes = heap(lambda: flood(n))
+    frame_dict, dict_bytes = heap(lambda: unbounded(n))
+    print('{} frames: table {} devices (max {}), queue {} (max {}), {}'.format(
+        n, len(store), largest, store.queued(), longest, store.stats))
+    print('Heap: bounded table {} kB, unbounded dict {} kB ({} devices)'.format(
+        store_bytes // 1024, dict_bytes // 1024, len(frame_dict)))
+    if largest > CAPACITY:
+        failed += 1
+        print('FAIL: table above capacity')
+    if longest > 2 * CAPACITY:
+        failed += 1
+        print('FAIL: queue above twice the capacity')
+    if store_bytes > HEAP_LIMIT_KB * 1024:
+        failed += 1
+        print('FAIL: table above', HEAP_LIMIT_KB, 'kB')
+    missing = sum(1 for i in range(SENSORS) if bytes((0xa4, 0xc1, 0x38, 0, 0, i)) not in store)
+    if missing:
+        failed += 1
+        print('FAIL:', missing, 'sensors evicted')
+
+    clock[0] += TTL_S * 1000 + 1
+    expired = store.expire()
+    print('After {} s idle: {} expired, {} left'.format(TTL_S, expired, len(store)))
+    if len(store):
+        failed += 1
+        print('FAIL: idle devices left')
+    print('OK' if not failed else '{} checks failed'.format(failed))
+    return failed
+
+
+sys.exit(1 if main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000) else 0)
@@ -0,0 +1,208 @@
+# stub_broker.py Minimal MQTT 3.1.1 / 5 broker for the publish benchmarks (host, CPython)
+#   python3 tools/stub_broker.py [--port 1883] [--latency ms] [--receive-max n]
+# Accepts any client, answers pings, acks QoS 1 publishes and (un)subscriptions after an
+# injected latency (acks are scheduled, reading goes on meanwhile) and prints every 5 s:
+# TCP reads (segments as the socket delivered them), packets by type, publishes, payload
+# bytes, PUBLISH -> PUBACK time and the most QoS 1 publishes in flight at once.
+# Point the gateway's params.json "server" at this host to measure it on the device.
+# The bench scripts import StubBroker and run it in their own event loop.
+
+import sys
+import time
+import struct
+import asyncio
+
+NAMES = {1: 'CONNECT', 3: 'PUBLISH', 4: 'PUBACK', 8: 'SUBSCRIBE', 10: 'UNSUBSCRIBE', 12: 'PINGREQ',
+         14: 'DISCONNECT'}
+
+
+def varint(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        out.append(b | 0x80 if n else b)
+        if not n:
+            return bytes(out)
+
+
+# (value, bytes used) of the variable byte integer at data[i:], value None if incomplete
+def read_varint(data, i):
+    n = shift = used = 0
+    while True:
+        if i + used >= len(data):
+            return None, 0
+        b = data[i + used]
+        used += 1
+        n |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return n, used
+        shift += 7
+
+
+class Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.connections = 0
+        self.reads = 0
+        self.bytes = 0
+        self.packets = {}
+        self.publishes = 0
+        self.payload_bytes = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self.over_receive_max = 0
+        self.ack_ms = []
+
+    def as_dict(self):
+        ack = sorted(self.ack_ms)
+        return {'connections': self.connections, 'reads': self.reads, 'bytes': self.bytes,
+                'packets': {NAMES.get(k, k): v for k, v in sorted(self.packets.items())},
+                'publishes': self.publishes, 'payload_bytes': self.payload_bytes,
+                'max_inflight': self.max_inflight, 'over_receive_max': self.over_receive_max,
+                'puback_ms_p50': round(ack[len(ack) // 2], 1) if ack else None}
+
+
+class Connection(asyncio.Protocol):
+    def __init__(self, broker):
+        self._broker = broker
+        self._buf = bytearray()
+        self._v5 = False
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._broker.stats.connections += 1
+
+    def data_received(self, data):
+        stats = self._broker.stats
+        stats.reads += 1
+        stats.bytes += len(data)
+        self._buf += data
+        while len(self._buf) >= 2:
+            size, used = read_varint(self._buf, 1)
+            if size is None or len(self._buf) < 1 + used + size:
+                return
+            header = self._buf[0]
+            body = bytes(self._buf[1 + used:1 + used + size])
+            del self._buf[:1 + used + size]
+            self._packet(header >> 4, header & 0x0F, body)
+
+    def _write_later(self, data):
+        latency = self._broker.latency_ms
+        if latency:
+            asyncio.get_running_loop().call_later(latency / 1000, self._write, data)
+        else:
+            self._write(data)
+
+    def _write(self, data):
+        if not self._transport.is_closing():
+            self._transport.write(data)
+
+    def _puback(self, pid, t0):
+        stats = self._broker.stats
+        stats.inflight -= 1
+        stats.ack_ms.append((time.perf_counter() - t0) * 1000)
+        self._write(b'\x40\x02' + struct.pack('!H', pid))
+
+    def _packet(self, kind, flags, body):
+        broker = self._broker
+        stats = broker.stats
+        stats.packets[kind] = stats.packets.get(kind, 0) + 1
+        if kind == 1:  # CONNECT: protocol name (2 + 4 bytes), then the level
+            self._v5 = body[6] == 5
+            if self._v5:
+                props = b''
+                if broker.receive_max:
+                    props = b'\x21' + struct.pack('!H', broker.receive_max)
+                self._write(b'\x20' + varint(3 + len(props)) + b'\x00\x00' + varint(len(props)) + props)
+            else:
+                self._write(b'\x20\x02\x00\x00')
+        elif kind == 3:
+            qos = flags >> 1 & 3
+            topic_len = struct.unpack_from('!H', body)[0]
+            i = 2 + topic_len
+            pid = None
+            if qos:
+                pid = struct.unpack_from('!H', body, i)[0]
+                i += 2
+            if self._v5:
+                props, used = read_varint(body, i)
+                i += used + props
+            stats.publishes += 1
+            stats.payload_bytes += len(body) - i
+            if broker.on_publish:
+                broker.on_publish(body[2:2 + topic_len].decode(), body[i:])
+            if qos:
+                stats.inflight += 1
+                stats.max_inflight = max(stats.max_inflight, stats.inflight)
+                if broker.receive_max and stats.inflight > broker.receive_max:
+                    stats.over_receive_max += 1
+                t0 = time.perf_counter()
+                if broker.latency_ms:
+                    asyncio.get_running_loop().call_later(broker.latency_ms / 1000, self._puback, pid, t0)
+                else:
+                    self._puback(pid, t0)
+        elif kind == 8:  # SUBSCRIBE: granted QoS 0
+            pid = body[:2]
+            self._write_later(b'\x90\x04' + pid + b'\x00\x00' if self._v5 else b'\x90\x03' + pid + b'\x00')
+        elif kind == 10:  # UNSUBSCRIBE: success
+            pid = body[:2]
+            self._write_later(b'\xb0\x04' + pid + b'\x00\x00' if self._v5 else b'\xb0\x02' + pid)
+        elif kind == 12:
+            self._write(b'\xd0\x00')
+        elif kind == 14:
+            self._transport.close()
+
+
+class StubBroker:
+    def __init__(self, latency_ms=0, receive_max=0, on_publish=None):
+        self.latency_ms = latency_ms
+        self.receive_max = receive_max
+        self.on_publish = on_publish
+        self.stats = Stats()
+        self.server = None
+
+    async def start(self, host='0.0.0.0', port=1883):
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(lambda: Connection(self), host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def close(self):
+        if self.server:
+            self.server.close()
+
+
+async def serve(port, latency_ms, receive_max):
+    broker = StubBroker(latency_ms, receive_max)
+    port = await broker.start(port=port)
+    print('Stub broker on port {}, latency {} ms, receive maximum {}'.format(port, latency_ms,
+                                                                               receive_max or '-'))
+    while True:
+        await asyncio.sleep(5)
+        if broker.stats.packets:
+            print(broker.stats.as_dict())
+            broker.stats.reset()
+
+
+def main(argv):
+    port, latency, receive_max = 1883, 0, 0
+    i = 0
+    while i < len(argv):
+        if argv[i] == '--port':
+            i += 1
+            port = int(argv[i])
+        elif argv[i] == '--latency':
+            i += 1
+            latency = float(argv[i])
+        elif argv[i] == '--receive-max':
+            i += 1
+            receive_max = int(argv[i])
+        i += 1
+    asyncio.run(serve(port, latency, receive_max))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
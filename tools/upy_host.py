@@ -0,0 +1,109 @@
+# upy_host.py Runs lib/mqtt_as under CPython, for the host checks in tools/
+# The MicroPython modules mqtt_as imports are mapped to their CPython counterparts
+# (usocket, ustruct, uerrno, ubinascii, uasyncio with sleep_ms / wait_for_ms, utime with
+# ticks_ms / ticks_diff). Sockets get MicroPython's non-blocking write() / readinto()
+# (None when the call would block) and uasyncio a StreamReader that sleeps until its
+# socket is readable. machine and network get just what MQTTClient touches: a fixed
+# unique_id() and a WLAN that is always connected. Import this before mqtt_as.
+
+import sys
+import time
+import types
+import errno
+import socket
+import struct
+import asyncio
+import binascii
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def ticks_ms():
+    return int(time.monotonic() * 1000)
+
+
+def ticks_diff(a, b):
+    return a - b
+
+
+class Socket(socket.socket):
+    def write(self, data):
+        try:
+            return self.send(data)
+        except BlockingIOError:
+            return None
+
+    def readinto(self, buf, n=0):
+        try:
+            return self.recv_into(buf, n)
+        except BlockingIOError:
+            return None
+
+
+# uasyncio.StreamReader(sock).readinto(), for Socket and scripted sockets without a fileno
+class StreamReader:
+    def __init__(self, s):
+        self.s = s
+
+    async def readinto(self, buf):
+        while True:
+            n = self.s.readinto(buf)
+            if n is not None:
+                return n
+            if not hasattr(self.s, 'fileno'):
+                await asyncio.sleep(0)
+                continue
+            loop = asyncio.get_running_loop()
+            readable = loop.create_future()
+            loop.add_reader(self.s.fileno(), readable.set_result, None)
+            try:
+                await readable
+            finally:
+                loop.remove_reader(self.s.fileno())
+
+
+class WLAN:
+    def __init__(self, *_):
+        self._active = False
+
+    def active(self, *args):
+        if args:
+            self._active = args[0]
+        return self._active
+
+    def isconnected(self):
+        return True
+
+    def config(self, **_):
+        pass
+
+    def connect(self, *_):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def status(self):
+        return 3
+
+
+_module('usocket', **socket.__dict__).socket = Socket
+_module('ustruct', **struct.__dict__)
+_module('uerrno', **errno.__dict__)
+_module('ubinascii', **binascii.__dict__)
+_module('utime', ticks_ms=ticks_ms, ticks_diff=ticks_diff, sleep=time.sleep,
+        sleep_ms=lambda ms: time.sleep(ms / 1000))
+_module('uasyncio', **asyncio.__dict__)
+sys.modules['uasyncio'].sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+sys.modules['uasyncio'].wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+sys.modules['uasyncio'].StreamReader = StreamReader
+_module('micropython', const=lambda x: x)
+_module('machine', unique_id=lambda: b'\x01\x02\x03\x04\x05\x06')
+_module('network', WLAN=WLAN, STA_IF=0, STAT_CONNECTING=1, STAT_IDLE=1000)
+
+sys.path.insert(0, 'lib')